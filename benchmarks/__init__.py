@@ -0,0 +1,3 @@
+# coding:utf-8
+"""ugly-sql 性能基准测试,运行: python -m benchmarks --help"""
+__author__ = 'Memory_Leak<irealing@163.com>'
@@ -0,0 +1,67 @@
+# coding:utf-8
+import argparse
+import json
+import platform
+import sys
+import time
+
+from .bench import run_all
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+
+def _flatten(data, prefix=''):
+    for k, v in data.items():
+        key = "{}.{}".format(prefix, k) if prefix else k
+        if isinstance(v, dict):
+            for item in _flatten(v, key):
+                yield item
+        else:
+            yield key, v
+
+
+def compare(current, baseline):
+    """
+    打印与基准结果的对比(当前/基准)
+    """
+    base = dict(_flatten(baseline.get("results", {})))
+    print("{:<60} {:>14} {:>14} {:>9}".format("benchmark", baseline.get("label") or "baseline",
+                                              current.get("label") or "current", "ratio"))
+    for key, value in _flatten(current["results"]):
+        old = base.get(key)
+        if not isinstance(value, (int, float)) or not old:
+            continue
+        print("{:<60} {:>14.2f} {:>14.2f} {:>8.2f}x".format(key, old, value, value / old))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="ugly-sql benchmarks")
+    parser.add_argument("--backend", choices=("fake", "sqlite"), default="fake",
+                        help="fake: 内存中的假游标(只测试ugly-sql本身); sqlite: sqlite3内存数据库")
+    parser.add_argument("--rows", type=int, default=10000, help="结果转换测试的行数")
+    parser.add_argument("--number", type=int, default=2000, help="SQL编译测试每轮的语句数")
+    parser.add_argument("--output", help="保存结果的JSON文件")
+    parser.add_argument("--compare", help="用于对比的历史结果JSON文件")
+    parser.add_argument("--label", default="", help="结果标签,如版本号")
+    args = parser.parse_args(argv)
+    result = {
+        "label": args.label,
+        "backend": args.backend,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": run_all(args.backend, args.rows, args.number),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+    else:
+        json.dump(result, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
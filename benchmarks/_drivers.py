@@ -0,0 +1,122 @@
+# coding:utf-8
+"""基准测试使用的数据库连接: 内存中的假DB-API游标, 以及sqlite3"""
+import sqlite3
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+
+class FakeCursor(object):
+    """
+    不访问数据库的DB-API游标,查询返回预先生成的数据
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = -1
+        self.lastrowid = 0
+        self.description = None
+        self.__rows = []
+        self.__pos = 0
+
+    def execute(self, sql, params=()):
+        self.conn.executed += 1
+        if sql.lstrip()[:6].upper() == 'SELECT':
+            self.__rows = self.conn.rows
+            self.__pos = 0
+            self.rowcount = len(self.__rows)
+        else:
+            self.__rows = []
+            self.rowcount = 1
+            self.conn.last_id += 1
+            self.lastrowid = self.conn.last_id
+        return self.rowcount
+
+    def executemany(self, sql, seq):
+        n = 0
+        for params in seq:
+            n += self.execute(sql, params)
+        self.rowcount = n
+        return n
+
+    def fetchone(self):
+        if self.__pos >= len(self.__rows):
+            return None
+        self.__pos += 1
+        return self.__rows[self.__pos - 1]
+
+    def fetchall(self):
+        rows = self.__rows[self.__pos:]
+        self.__pos = len(self.__rows)
+        return rows
+
+    def fetchmany(self, size=1):
+        rows = self.__rows[self.__pos:self.__pos + size]
+        self.__pos += len(rows)
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    """
+    :param rows: SELECT语句返回的数据
+    """
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.executed = 0
+        self.last_id = 0
+
+    def cursor(self, *args, **kwargs):
+        if kwargs:
+            raise TypeError("unexpected keyword arguments")
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _SQLiteCursor(object):
+    """将%s参数占位符转换为sqlite3的?"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        return self._cursor.execute(sql.replace('%s', '?'), tuple(params))
+
+    def executemany(self, sql, seq):
+        return self._cursor.executemany(sql.replace('%s', '?'), [tuple(p) for p in seq])
+
+    def __getattr__(self, item):
+        return getattr(self._cursor, item)
+
+
+class SQLiteConnection(object):
+    """
+    sqlite3连接,事务由会话的BEGIN/COMMIT语句控制
+    """
+
+    def __init__(self, path=':memory:'):
+        self._conn = sqlite3.connect(path, isolation_level=None)
+
+    def cursor(self, *args, **kwargs):
+        if args or kwargs:
+            raise TypeError("unexpected arguments")
+        return _SQLiteCursor(self._conn.cursor())
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,168 @@
+# coding:utf-8
+"""基准测试用例"""
+import gc
+import time
+import tracemalloc
+
+from ugly_sql import Table, SessionManager, Function, or_, sql_cache
+from ugly_sql._db import Query, Update, Insert
+
+from ._drivers import FakeConnection, SQLiteConnection
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age", "email", "created"), "id")
+Order = Table("orders", ("id", "user_id", "amount", "status", "note"), "id")
+
+_SCHEMA = (
+    "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, password TEXT, age INTEGER,"
+    " email TEXT, created INTEGER)",
+    "CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, amount REAL, status INTEGER,"
+    " note TEXT)",
+)
+
+
+def _user_row(i):
+    return i, "user%d" % i, "pwd%d" % i, i % 90, "user%d@example.com" % i, 1500000000 + i
+
+
+def _order_row(i):
+    return i, i % 1000 + 1, i * 0.5, i % 3, "note %d" % i
+
+
+def connection(backend, rows=0):
+    """
+    创建测试连接
+    :param backend: fake|sqlite
+    :param rows: users表的行数(orders表与其相同)
+    """
+    if backend == 'fake':
+        return FakeConnection([_user_row(i + 1) for i in range(rows)])
+    conn = SQLiteConnection()
+    cursor = conn.cursor()
+    for ddl in _SCHEMA:
+        cursor.execute(ddl)
+    if rows:
+        cursor.executemany("INSERT INTO users VALUES (%s,%s,%s,%s,%s,%s)", [_user_row(i + 1) for i in range(rows)])
+        cursor.executemany("INSERT INTO orders VALUES (%s,%s,%s,%s,%s)", [_order_row(i + 1) for i in range(rows)])
+    return conn
+
+
+def _join_connection(backend, rows):
+    if backend == 'fake':
+        return FakeConnection([_user_row(i + 1) + _order_row(i + 1) for i in range(rows)])
+    return connection(backend, rows)
+
+
+def timeit(fn, number, repeat=5):
+    """
+    :return: 最快一轮中每次调用的耗时(秒)
+    """
+    best = None
+    for _ in range(repeat):
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None or elapsed < best else best
+    return best / number
+
+
+SHAPES = {
+    'pk_lookup': lambda i: Query(User).filter(User.id == i),
+    'filter_in_order_limit': lambda i: Query(User).filter(
+        User.age > i, User.id.in_([i, i + 1, i + 2]), or_(User.name == "a", User.email.is_(None))
+    ).order_by(User.created.desc(), User.id.asc()).limit(20, i),
+    'join_group': lambda i: Query(User, User.name, Function.count(Order.id)).join(
+        Order, Order.user_id == User.id).filter(Order.status == i).group_by(User.name),
+    'update': lambda i: Update(User).set(User.name == "n", User.age == i).where(User.id == i),
+    'insert': lambda i: Insert(User).set(User.name == "n", User.age == i, User.email == "e"),
+}
+
+
+def bench_compile(number=2000):
+    """
+    SQL编译速度(语句/秒),分别测试启用和禁用编译缓存
+    """
+    result = {}
+    maxsize = sql_cache.maxsize
+    try:
+        for cached in (True, False):
+            sql_cache.clear()
+            sql_cache.resize(maxsize if cached else 0)
+            for name, build in SHAPES.items():
+                counter = [0]
+
+                def run():
+                    counter[0] += 1
+                    stmt = build(counter[0])
+                    stmt.sql()
+                    stmt.args()
+
+                per_call = timeit(run, number)
+                result["{}{}".format(name, "" if cached else "_nocache")] = {"statements_per_sec": 1 / per_call}
+    finally:
+        sql_cache.resize(maxsize)
+    return result
+
+
+def bench_render(backend, rows=10000):
+    """
+    结果转换速度(行/秒)及每行占用的内存
+    """
+    result = {}
+    cases = (
+        ('single_table', connection(backend, rows), lambda sm: sm.query(User).limit(rows)),
+        ('join', _join_connection(backend, rows),
+         lambda sm: sm.query(User, User, Order).join(Order, Order.user_id == User.id).limit(rows)),
+    )
+    for name, conn, query in cases:
+        sm = SessionManager(conn, identity_map=False)
+        per_call = timeit(lambda: list(query(sm).all()), 1, repeat=3)
+        n = len(list(query(sm).all()))
+        gc.collect()
+        tracemalloc.start()
+        try:
+            snapshot = tracemalloc.get_traced_memory()[0]
+            data = list(query(sm).all())
+            used = tracemalloc.get_traced_memory()[0] - snapshot
+        finally:
+            tracemalloc.stop()
+        del data
+        result[name] = {"rows": n, "rows_per_sec": n / per_call, "bytes_per_row": used / n if n else 0}
+    return result
+
+
+def bench_flush(backend, rows=5000):
+    """
+    提交修改(dirty flush)的耗时及执行的语句数
+    """
+    conn = connection(backend, rows)
+    sm = SessionManager(conn, identity_map=False)
+    sm.begin()
+    objs = list(sm.query(User).limit(rows).all())
+    for i, u in enumerate(objs):
+        u.age = i % 7
+        if i % 2:
+            u.name = "renamed%d" % i
+    executed = getattr(conn, 'executed', None)
+    start = time.perf_counter()
+    sm.commit()
+    elapsed = time.perf_counter() - start
+    result = {"rows": len(objs), "seconds": elapsed, "rows_per_sec": len(objs) / elapsed if elapsed else 0}
+    if executed is not None:
+        # 减去 COMMIT 和重新开启事务的 BEGIN
+        result["statements"] = conn.executed - executed - 2
+    return result
+
+
+def run_all(backend, rows=10000, compile_number=2000):
+    return {
+        "compile": bench_compile(compile_number),
+        "render": bench_render(backend, rows),
+        "flush": bench_flush(backend, rows // 2),
+    }
@@ -12,5 +12,5 @@ setup(
     description=__doc__,
     long_description=doc,
     long_description_content_type='text/markdown',
-    packages=find_packages(),
+    packages=find_packages(exclude=('benchmarks', 'benchmarks.*', 'tests', 'tests.*')),
 )
@@ -0,0 +1,162 @@
+# coding:utf-8
+"""测试使用的数据库连接: 基于sqlite3内存数据库的DB-API连接"""
+import asyncio
+import sqlite3
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+SCHEMA = (
+    "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, password TEXT, age INT)",
+    "CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INT, amount REAL, note TEXT)",
+)
+
+
+class SQLiteCursor(object):
+    """
+    将%s占位符转换为sqlite3的?
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @staticmethod
+    def _sql(sql):
+        return sql.replace('%s', '?')
+
+    def execute(self, sql, params=()):
+        return self.cursor.execute(self._sql(sql), tuple(params))
+
+    def executemany(self, sql, seq):
+        return self.cursor.executemany(self._sql(sql), [tuple(p) for p in seq])
+
+    def __getattr__(self, item):
+        return getattr(self.cursor, item)
+
+
+class SQLiteConnection(object):
+    def __init__(self, schema=SCHEMA):
+        self.conn = sqlite3.connect(':memory:', isolation_level=None, check_same_thread=False)
+        for sql in schema:
+            self.conn.execute(sql)
+
+    def cursor(self, *args, **kwargs):
+        if kwargs:
+            raise TypeError("unexpected keyword arguments")
+        return SQLiteCursor(self.conn.cursor())
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.conn.close()
+
+
+class MultiStatementCursor(SQLiteCursor):
+    """
+    模拟允许多语句的驱动:分号分隔的语句依次执行,通过nextset()读取各结果集
+    """
+
+    def __init__(self, cursor):
+        SQLiteCursor.__init__(self, cursor)
+        self.__sets = None
+        self.__rows = None
+
+    def execute(self, sql, params=()):
+        parts = sql.split(";")
+        if len(parts) == 1:
+            self.__sets = None
+            return SQLiteCursor.execute(self, sql, params)
+        params = list(params)
+        self.__sets = []
+        for part in parts:
+            n = part.count('%s')
+            self.__sets.append(self.cursor.execute(self._sql(part), tuple(params[:n])).fetchall())
+            params = params[n:]
+        self.__rows = self.__sets.pop(0)
+
+    def fetchall(self):
+        if self.__sets is None:
+            return self.cursor.fetchall()
+        return self.__rows
+
+    def nextset(self):
+        if not self.__sets:
+            return None
+        self.__rows = self.__sets.pop(0)
+        return True
+
+
+class MultiStatementConnection(SQLiteConnection):
+    client_flag = 1 << 16
+
+    def cursor(self, *args, **kwargs):
+        return MultiStatementCursor(self.conn.cursor())
+
+
+
+
+class AsyncCursor(object):
+    """
+    异步游标,接口与aiomysql.Cursor一致,每次执行前让出事件循环
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    async def execute(self, sql, params=()):
+        await asyncio.sleep(0)
+        return self.cursor.execute(sql, params)
+
+    async def executemany(self, sql, seq):
+        await asyncio.sleep(0)
+        return self.cursor.executemany(sql, seq)
+
+    async def fetchall(self):
+        return self.cursor.fetchall()
+
+    async def fetchone(self):
+        return self.cursor.fetchone()
+
+    async def fetchmany(self, size=1):
+        return self.cursor.fetchmany(size)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    async def close(self):
+        pass
+
+
+class AsyncConnection(object):
+    """
+    异步连接,接口与aiomysql.Connection一致
+    :param conn: SQLiteConnection,与同步连接共用数据
+    """
+
+    def __init__(self, conn=None):
+        self.conn = conn or SQLiteConnection()
+        self.closed = False
+
+    async def cursor(self, cls=None):
+        return AsyncCursor(self.conn.cursor())
+
+    async def ping(self, reconnect=True):
+        pass
+
+    async def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
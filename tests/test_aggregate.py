@@ -0,0 +1,68 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager, Function
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+AGES = [i % 4 for i in range(10)]
+
+
+class AggregateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = SessionManager(SQLiteConnection(), dialect="sqlite")
+        self.db.create_many(User, [dict(name="n%d" % i, age=a) for i, a in enumerate(AGES)], render=False)
+
+    def check(self, q):
+        """count/exists与查询结果一致"""
+        rows = list(q.all())
+        self.assertEqual(q.count(), len(rows))
+        self.assertEqual(q.exists(), bool(rows))
+        return rows
+
+    def test_plain(self):
+        q = self.db.query(User).filter(User.age > 1)
+        self.check(q)
+        self.assertEqual(q.aggregate(Function.sum(User.age)), sum(a for a in AGES if a > 1))
+        self.assertEqual(q.aggregate(Function.min(User.age), Function.max(User.age)), (2, 3))
+        empty = self.db.query(User).filter(User.age > 10)
+        self.assertEqual(self.check(empty), [])
+        self.assertIsNone(empty.aggregate(Function.max(User.age)))
+
+    def test_grouped(self):
+        q = self.db.query(User, User.age, Function.count(User.id)).group_by(User.age)
+        rows = self.check(q)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(q.aggregate(Function.sum(Function.count(User.id))), len(AGES))
+        self.assertEqual(q.aggregate(Function.max(Function.count(User.id)), Function.count(User.age)), (3, 4))
+
+    def test_distinct(self):
+        q = self.db.query(User, User.age.distinct())
+        self.assertEqual(len(self.check(q)), 4)
+        self.assertEqual(q.aggregate(Function.sum(User.age)), sum(set(AGES)))
+        self.assertEqual(q.aggregate(Function.count(User.age)), 4)
+
+    def test_limit(self):
+        q = self.db.query(User).order_by(User.id.asc()).limit(3, 2)
+        self.assertEqual(len(self.check(q)), 3)
+        self.assertEqual(q.aggregate(Function.sum(User.age)), sum(AGES[2:5]))
+        self.assertEqual(self.check(self.db.query(User).limit(3, 20)), [])
+
+    def test_aggregated_without_group(self):
+        q = self.db.query(User, Function.count(User.id))
+        self.assertEqual([tuple(r) for r in self.check(q)], [(10,)])
+        self.assertTrue(self.db.query(User, Function.count(User.id)).filter(User.age > 10).exists())
+        self.assertEqual(q.aggregate(Function.sum(Function.count(User.id))), 10)
+        self.assertEqual(q.copy().filter(User.age > 1).aggregate(Function.max(Function.count(User.id))), 4)
+
+    def test_not_selected(self):
+        q = self.db.query(User, User.age).group_by(User.age)
+        with self.assertRaises(ValueError):
+            q.aggregate(Function.sum(User.id))
+
+
+if __name__ == '__main__':
+    unittest.main()
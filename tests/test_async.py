@@ -0,0 +1,79 @@
+# coding:utf-8
+import asyncio
+import unittest
+
+from tests._fakes import AsyncConnection
+from ugly_sql import Table
+from ugly_sql._async import AsyncSessionManager
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id", deferred=("password",))
+Order = Table("orders", ("id", "user_id", "amount", "note"), "id")
+Order.relationship("user", User, Order.user_id)
+User.relationship("orders", Order, User.id, Order.user_id, many=True)
+
+
+class AsyncQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.db = AsyncSessionManager(AsyncConnection())
+        self.sql = []
+        self.db.listen("before_execute", lambda e: self.sql.append(e.sql))
+        self.run_async(self.db.create_many(User, [dict(name="n%d" % i, password="p", age=i % 3) for i in range(100)],
+                                           render=False))
+        self.run_async(self.db.create_many(Order, [dict(user_id=i % 10 + 1, amount=i) for i in range(30)],
+                                           render=False))
+        del self.sql[:]
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_prefetch(self):
+        orders = self.run_async(self.db.query(Order).prefetch("user").all())
+        self.assertEqual(len(self.sql), 2)
+        self.assertTrue(all(o.user.id == o.user_id for o in orders))
+        user = self.run_async(self.db.query(User).filter(User.id == 1).prefetch("orders").one())
+        self.assertEqual(sorted(o.amount for o in user.orders), [0, 10, 20])
+
+    def test_not_loaded(self):
+        user = self.run_async(self.db.query(User).filter(User.id == 1).one())
+        with self.assertRaises(TypeError):
+            user.password
+        with self.assertRaises(TypeError):
+            user.orders
+        user = self.run_async(self.db.query(User).filter(User.id == 2).undefer(User.password).one())
+        self.assertEqual(user.password, "p")
+
+    def test_chunk_in(self):
+        q = self.db.query(User).filter(User.id.in_(list(range(1, 101)))).order_by(User.id.desc()).limit(5, 2)
+        rows = self.run_async(q.chunk_in(30).all())
+        self.assertEqual([u.id for u in rows], [98, 97, 96, 95, 94])
+        self.assertEqual(len(self.sql), 4)
+        q = self.db.query(User, User.age.distinct()).filter(User.id.in_(list(range(1, 101))))
+        with self.assertRaises(TypeError):
+            self.run_async(q.chunk_in(30, 50).all())
+
+    def test_pages(self):
+        q = self.db.query(User).order_by(User.id.asc())
+        page = self.run_async(q.page_after(None, 10))
+        page = self.run_async(q.page_after(page[-1], 10))
+        self.assertEqual([u.id for u in page], list(range(11, 21)))
+
+        async def pages():
+            return [[u.id for u in p] async for p in self.db.query(User).filter(User.age == 0).iter_pages(size=7)]
+
+        ids = sum(self.run_async(pages()), [])
+        self.assertEqual(ids, list(range(1, 101, 3)))
+
+    def test_to_columns(self):
+        cols = self.run_async(self.db.query(Order).filter(Order.user_id == 1).to_columns(batch_size=2, numpy=False))
+        self.assertEqual(list(cols['amount']), [0, 10, 20])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection, MultiStatementConnection, MultiStatementCursor
+from ugly_sql import Table, SessionManager
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+Order = Table("orders", ("id", "user_id", "amount", "note"), "id")
+
+
+class ShortCursor(MultiStatementCursor):
+    """只返回第一个结果集"""
+
+    def nextset(self):
+        return None
+
+
+class ShortConnection(MultiStatementConnection):
+
+    def cursor(self, *args, **kwargs):
+        return ShortCursor(self.conn.cursor())
+
+
+class QueryBatchTest(unittest.TestCase):
+
+    def connect(self, cls):
+        conn = cls()
+        conn.conn.executemany("INSERT INTO users (name, age) VALUES (?, ?)", [("a", 1), ("b", 2), ("c", 3)])
+        conn.conn.executemany("INSERT INTO orders (user_id, amount) VALUES (?, ?)", [(1, 10), (2, 20)])
+        db = SessionManager(conn, dialect="sqlite")
+        statements = []
+        db.listen('before_execute', lambda e: statements.append(e.sql))
+        return db, statements
+
+    def run_batch(self, db):
+        with db.batch() as b:
+            users = b.all(db.query(User).filter(User.age > 1).order_by(User.id.asc()))
+            first = b.one(db.query(User).filter(User.name == "a"))
+            total = b.count(db.query(Order))
+            missing = b.exists(db.query(Order).filter(Order.amount > 100))
+        self.assertEqual([u.name for u in users.value], ["b", "c"])
+        self.assertEqual(first.value.id, 1)
+        self.assertEqual(total.value, 2)
+        self.assertFalse(missing.value)
+
+    def test_multi_statements(self):
+        db, statements = self.connect(MultiStatementConnection)
+        self.run_batch(db)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(statements[0].count(";"), 3)
+
+    def test_fallback(self):
+        db, statements = self.connect(SQLiteConnection)
+        self.run_batch(db)
+        self.assertEqual(len(statements), 4)
+        db, statements = self.connect(MultiStatementConnection)
+        db.session.multi_statements = False
+        self.run_batch(db)
+        self.assertEqual(len(statements), 4)
+
+    def test_missing_result_set(self):
+        db, statements = self.connect(ShortConnection)
+        b = db.batch()
+        b.all(db.query(User))
+        b.count(db.query(Order))
+        self.assertRaises(Exception, b.execute)
+
+    def test_separate_query(self):
+        db, statements = self.connect(MultiStatementConnection)
+        b = db.batch()
+        # IN条件需要拆分的查询单独执行
+        users = b.all(db.query(User).filter(User.id.in_([1, 2, 3])).chunk_in(2))
+        total = b.count(db.query(Order))
+        b.execute()
+        self.assertEqual(sorted(u.id for u in users.value), [1, 2, 3])
+        self.assertEqual(total.value, 2)
+
+    def test_value_before_execute(self):
+        db, _ = self.connect(SQLiteConnection)
+        result = db.batch().count(db.query(User))
+        self.assertRaises(RuntimeError, lambda: result.value)
+
+
+if __name__ == '__main__':
+    unittest.main()
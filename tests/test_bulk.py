@@ -0,0 +1,40 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+NoPK = Table("users", ("id", "name", "password", "age"), None)
+
+
+class BulkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = SessionManager(SQLiteConnection(), dialect="sqlite")
+        self.db.create_many(User, [dict(name="n%d" % i, age=i % 10) for i in range(100)], render=False)
+
+    def test_update_expression(self):
+        n = self.db.query(User).filter(User.age < 5).update({User.age: User.age + 1})
+        self.assertEqual(n, 50)
+        self.assertEqual(self.db.query(User).filter(User.age == 0).count(), 0)
+        self.assertEqual(self.db.query(User).filter(User.age == 5).count(), 20)
+
+    def test_limited_delete(self):
+        n = self.db.query(User).filter(User.age == 1).order_by(User.id.asc()).limit(3).delete()
+        self.assertEqual(n, 3)
+        self.assertEqual(self.db.query(User).filter(User.age == 1).count(), 7)
+
+    def test_delete_in_batches(self):
+        self.db.query(User).filter(User.age < 5).delete_in_batches(batch_size=7)
+        self.assertEqual(self.db.query(User).count(), 50)
+
+    def test_no_primary_key(self):
+        with self.assertRaises(ValueError):
+            self.db.query(NoPK).filter(NoPK.age == 1).limit(3).delete()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager, LRUResultCache
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = SQLiteConnection()
+        self.db = SessionManager(self.conn, dialect="sqlite")
+        self.db.create_many(User, [dict(name="n%d" % i, age=i) for i in range(10)], render=False)
+        self.db.begin()
+        self.db.commit()
+        self.cache = LRUResultCache()
+
+    def query(self):
+        return self.db.query(User).filter(User.age < 5).cached(cache=self.cache)
+
+    def test_uncommitted_write(self):
+        self.assertEqual(len(list(self.query().all())), 5)
+        self.assertEqual(self.cache.stats()['size'], 1)
+        self.db.query(User).filter(User.age == 0).update({User.age: 100})
+        self.assertEqual(self.cache.stats()['size'], 0)
+        self.assertEqual(len(list(self.query().all())), 4)
+        self.assertEqual(self.cache.stats()['size'], 0)
+        self.db.commit()
+        self.assertEqual(len(list(self.query().all())), 4)
+        self.assertEqual(self.cache.stats()['size'], 1)
+
+    def test_namespace(self):
+        def query(db):
+            return list(db.query(User).filter(User.age < 5).cached(cache=self.cache).all())
+
+        self.assertEqual(len(query(self.db)), 5)
+        # 其他数据库的会话不能读到本会话缓存的结果
+        self.assertEqual(query(SessionManager(SQLiteConnection(), dialect="sqlite")), [])
+        # 相同cache_key的会话共享缓存
+        self.assertEqual(len(query(SessionManager(self.conn, dialect="sqlite", cache_key="db1"))), 5)
+        self.assertEqual(len(query(SessionManager(SQLiteConnection(), dialect="sqlite", cache_key="db1"))), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
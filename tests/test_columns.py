@@ -0,0 +1,34 @@
+# coding:utf-8
+import unittest
+
+from ugly_sql._columns import ColumnBuilder, to_columns
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+
+class ColumnBuilderTest(unittest.TestCase):
+
+    def build(self, *batches):
+        builder = ColumnBuilder("c")
+        for values in batches:
+            builder.extend(values)
+        return list(builder.build(False))
+
+    def test_array(self):
+        self.assertEqual(self.build((1, 2), (3,)), [1, 2, 3])
+
+    def test_null_after_numbers(self):
+        # array.extend在None处出错前已追加了4
+        self.assertEqual(self.build((1, 2, 3), (4, None, 6)), [1, 2, 3, 4, None, 6])
+
+    def test_overflow(self):
+        self.assertEqual(self.build((1, 2), (5, 2 ** 70)), [1, 2, 5, 2 ** 70])
+
+    def test_to_columns(self):
+        cols = to_columns([[(1, "a"), (2, "b")], [(3, None)]], [("id", False), ("name", False)], False)
+        self.assertEqual(list(cols["id"]), [1, 2, 3])
+        self.assertEqual(cols["name"], ["a", "b", None])
+
+
+if __name__ == '__main__':
+    unittest.main()
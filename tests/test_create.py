@@ -0,0 +1,71 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+
+
+class AutoIncrementCursor(object):
+    """
+    MySQL多行INSERT的lastrowid:第一行的ID,各行ID相差auto_increment_increment
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lastrowid = None
+        self.rowcount = 0
+        self.row = None
+
+    def execute(self, sql, params=()):
+        if sql == "SELECT @@auto_increment_increment":
+            self.row = (self.conn.step,)
+            return 1
+        self.rowcount = sql.count("),(") + 1
+        self.lastrowid = self.conn.next_id
+        self.conn.next_id += self.rowcount * self.conn.step
+        return self.rowcount
+
+    def fetchone(self):
+        return self.row
+
+
+class AutoIncrementConnection(object):
+    def __init__(self, step, next_id=1):
+        self.step = step
+        self.next_id = next_id
+
+    def cursor(self, *args, **kwargs):
+        return AutoIncrementCursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CreateManyTest(unittest.TestCase):
+
+    def test_sqlite_ids(self):
+        db = SessionManager(SQLiteConnection(), dialect="sqlite")
+        db.create(User, name="first", age=0)
+        ids = db.create_many(User, [dict(name="n%d" % i, age=i) for i in range(25)], batch_size=10, render=False,
+                             return_ids=True)
+        self.assertEqual(ids, list(range(2, 27)))
+        users = db.create_many(User, [dict(name="m%d" % i, age=i) for i in range(3)])
+        self.assertEqual([u.id for u in users], [27, 28, 29])
+        self.assertEqual(db.query(User).filter(User.id == 28).one().name, "m1")
+
+    def test_auto_increment_increment(self):
+        db = SessionManager(AutoIncrementConnection(step=2, next_id=5))
+        ids = db.create_many(User, [dict(name="n%d" % i, age=i) for i in range(5)], batch_size=3, render=False,
+                             return_ids=True)
+        self.assertEqual(ids, [5, 7, 9, 11, 13])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager, SlowQueryLogger
+from ugly_sql.ex import DBConsole
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+
+
+class EventsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = SQLiteConnection()
+        self.conn.conn.executemany("INSERT INTO users (name, age) VALUES (?, ?)", [("n%d" % i, i) for i in range(3)])
+        self.db = SessionManager(self.conn, dialect="sqlite")
+        self.events = []
+
+    def record(self, name):
+        self.db.listen(name, lambda e: self.events.append((name, e)))
+
+    def test_no_listeners(self):
+        self.assertIsNone(self.db.session._events)
+        self.assertEqual(self.db.query(User).count(), 3)
+        self.assertRaises(ValueError, self.db.listen, "unknown", print)
+
+    def test_execute(self):
+        self.record("before_execute")
+        self.record("after_execute")
+        self.db.query(User).filter(User.age > 0).all()
+        (n1, before), (n2, after) = self.events
+        self.assertEqual((n1, n2), ("before_execute", "after_execute"))
+        self.assertIs(before, after)
+        self.assertIn("SELECT", after.sql)
+        self.assertEqual(tuple(after.args), (0,))
+        self.assertGreaterEqual(after.elapsed, 0)
+        self.assertIs(after.source, self.db.session)
+
+    def test_error(self):
+        self.record("on_error")
+        self.assertRaises(Exception, self.db.session.query, "SELECT * FROM missing", ())
+        (name, event), = self.events
+        self.assertEqual(event.sql, "SELECT * FROM missing")
+        self.assertIsNotNone(event.error)
+
+    def test_commit(self):
+        self.record("on_commit")
+        self.db.begin()
+        self.db.create(User, name="x", age=1)
+        self.db.commit()
+        self.assertEqual([(n, e.sql) for n, e in self.events], [("on_commit", "COMMIT")])
+
+    def test_listener_error(self):
+        def broken(event):
+            raise RuntimeError("listener")
+
+        self.db.listen("after_execute", broken)
+        with self.assertLogs("Events", "ERROR"):
+            self.assertEqual(self.db.query(User).count(), 3)
+
+    def test_slow_query_logger(self):
+        events = []
+        self.db.listen("after_execute", events.append)
+        SlowQueryLogger(threshold=0).install(self.db)
+        with self.assertLogs("SlowQuery", "WARNING") as logs:
+            self.db.query(User).count()
+        self.assertIn("COUNT", logs.output[0])
+        with self.assertNoLogs("SlowQuery"):
+            SlowQueryLogger(threshold=60)(events[-1])
+            SlowQueryLogger(threshold=0, sample_rate=0)(events[-1])
+
+    def test_console(self):
+        console = DBConsole(SQLiteConnection)
+        events = []
+        console.listen("after_execute", events.append)
+        with console.session() as db:
+            db.query(User).count()
+        self.assertEqual(len(events), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection, SQLiteCursor
+from ugly_sql import Table, SessionManager, ExplainSampler
+from ugly_sql._db import Query
+from ugly_sql._explain import QueryPlan, suggest_indexes
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+Order = Table("orders", ("id", "user_id", "amount", "note"), "id")
+
+COLUMNS = ("id", "select_type", "table", "type", "possible_keys", "key", "rows", "filtered", "Extra")
+# MySQL EXPLAIN的输出
+PLAN = (
+    (1, "SIMPLE", "users", "ALL", None, None, 1000, 10.0, "Using where; Using temporary; Using filesort"),
+    (1, "SIMPLE", "orders", "ref", "idx_user", "idx_user", 5, 100.0, None),
+)
+
+
+class ExplainCursor(SQLiteCursor):
+    """EXPLAIN语句返回固定的执行计划"""
+
+    def __init__(self, cursor):
+        SQLiteCursor.__init__(self, cursor)
+        self.plan = None
+
+    def execute(self, sql, params=()):
+        if sql.startswith("EXPLAIN "):
+            self.plan = list(PLAN)
+            return None
+        self.plan = None
+        return SQLiteCursor.execute(self, sql, params)
+
+    @property
+    def description(self):
+        if self.plan is not None:
+            return [(c,) for c in COLUMNS]
+        return self.cursor.description
+
+    def fetchall(self):
+        if self.plan is not None:
+            return self.plan
+        return self.cursor.fetchall()
+
+
+class ExplainConnection(SQLiteConnection):
+
+    def cursor(self):
+        return ExplainCursor(self.conn.cursor())
+
+
+def plan_rows():
+    return [dict(zip(COLUMNS, row)) for row in PLAN]
+
+
+class QueryPlanTest(unittest.TestCase):
+
+    def test_steps(self):
+        plan = QueryPlan(plan_rows())
+        users, orders = plan.steps
+        self.assertTrue(users.full_scan and users.filesort and users.temporary)
+        self.assertFalse(orders.full_scan or orders.filesort or orders.temporary)
+        self.assertEqual((orders.access, orders.key, orders.extra), ("ref", "idx_user", ""))
+        self.assertEqual(plan.rows, 5000)
+        self.assertEqual(plan.problems(), ["full scan on `users` (1000 rows)", "filesort on `users`",
+                                           "temporary table on `users`"])
+
+    def test_advise(self):
+        q = Query(User).join(Order, Order.user_id == User.id).filter(User.age == 1, Order.amount > 10)
+        plan = QueryPlan(plan_rows()).advise(q)
+        # orders使用了索引,只为users建议索引
+        self.assertEqual([(i.table, i.columns) for i in plan.indexes], [("users", ("age",))])
+
+
+class SuggestIndexesTest(unittest.TestCase):
+
+    def suggest(self, query):
+        return [(i.table, i.columns) for i in suggest_indexes(query)]
+
+    def test_equal_then_range(self):
+        q = Query(User).filter(User.age > 1, User.name == "a", User.password.in_(["x", "y"]))
+        self.assertEqual(self.suggest(q), [("users", ("name", "password", "age"))])
+
+    def test_order(self):
+        q = Query(User).filter(User.name == "a", User.age > 1).order_by(User.id.desc())
+        self.assertEqual(self.suggest(q), [("users", ("name", "id"))])
+        # 排序方向不一致时不能使用索引排序
+        q = Query(User).filter(User.name == "a").order_by(User.age.asc(), User.id.desc())
+        self.assertEqual(self.suggest(q), [("users", ("name",))])
+
+    def test_primary_key(self):
+        self.assertEqual(self.suggest(Query(User).filter(User.id == 1, User.name == "a")), [])
+        self.assertEqual(self.suggest(Query(User).filter(User.id > 1)), [])
+
+    def test_join(self):
+        q = Query(User).join(Order, Order.user_id == User.id).filter(User.name == "a")
+        self.assertEqual(self.suggest(q), [("users", ("name",)), ("orders", ("user_id",))])
+
+    def test_derived(self):
+        d = Query(Order, Order.user_id).subquery("d")
+        q = Query(User).join(d, d.user_id == User.id).filter(User.name == "a")
+        self.assertEqual(self.suggest(q), [("users", ("name",))])
+
+    def test_sql(self):
+        index, = suggest_indexes(Query(User).filter(User.name == "a", User.age > 1))
+        self.assertEqual(index.sql(), "ALTER TABLE `users` ADD INDEX `idx_users_name_age` (`name`,`age`)")
+
+
+class ExplainSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = SessionManager(ExplainConnection(), dialect="sqlite")
+
+    def test_explain(self):
+        plan = self.db.query(User).filter(User.age == 1).explain()
+        self.assertEqual(len(plan), 2)
+        self.assertEqual([i.sql() for i in plan.indexes],
+                         ["ALTER TABLE `users` ADD INDEX `idx_users_age` (`age`)"])
+
+    def test_sampler(self):
+        reports = []
+        sampler = ExplainSampler(threshold=0.5, callback=reports.append, interval=60)
+        q = Query(User).filter(User.age == 1)
+        session = self.db.session
+        self.assertIsNone(sampler.observe(session, q, q.sql(), q.args(), 0.1))
+        report = sampler.observe(session, q, q.sql(), q.args(), 1.0)
+        self.assertEqual(report.plan.problems()[0], "full scan on `users` (1000 rows)")
+        # interval内同一语句不重复EXPLAIN
+        self.assertIsNone(sampler.observe(session, q, q.sql(), q.args(), 1.0))
+        self.assertEqual(reports, [report])
+
+
+if __name__ == '__main__':
+    unittest.main()
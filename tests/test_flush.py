@@ -0,0 +1,68 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+
+
+class FlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = SQLiteConnection()
+        self.conn.conn.executemany("INSERT INTO users (name, age) VALUES (?, ?)", [("n%d" % i, i) for i in range(6)])
+        self.db = SessionManager(self.conn, dialect="sqlite")
+        self.updates = []
+        self.db.listen('before_execute', self.record)
+        self.db.begin()
+
+    def record(self, event):
+        if event.sql.startswith("UPDATE"):
+            self.updates.append(event.sql)
+
+    def rows(self):
+        return self.conn.conn.execute("SELECT id, name, age FROM users ORDER BY id").fetchall()
+
+    def test_grouped(self):
+        users = list(self.db.query(User).order_by(User.id.asc()).all())
+        for u in users[:4]:
+            u.age = u.age + 10
+        users[4].name = "x"
+        users[5].name = "y"
+        self.db.commit()
+        self.assertEqual(len(self.updates), 2)
+        self.assertTrue(all("CASE" in sql for sql in self.updates))
+        self.assertEqual(self.rows(), [(1, "n0", 10), (2, "n1", 11), (3, "n2", 12), (4, "n3", 13),
+                                       (5, "x", 4), (6, "y", 5)])
+
+    def test_merge_same_row(self):
+        a = self.db.get(User, 1)
+        b = self.db.get(User, 1)
+        a.age = 20
+        a.age = 21
+        b.name = "z"
+        self.db.commit()
+        self.assertEqual(len(self.updates), 1)
+        self.assertNotIn("CASE", self.updates[0])
+        self.assertEqual(self.rows()[0], (1, "z", 21))
+
+    def test_batch_size(self):
+        self.db.session.flush_batch_size = 2
+        for u in self.db.query(User).filter(User.id < 6).all():
+            u.age = 0
+        self.db.commit()
+        # 5行按每批2行拆分,最后一行单独更新
+        self.assertEqual(len(self.updates), 3)
+        self.assertEqual([r[2] for r in self.rows()], [0, 0, 0, 0, 0, 5])
+
+    def test_no_changes(self):
+        self.db.get(User, 1)
+        self.db.commit()
+        self.assertEqual(self.updates, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
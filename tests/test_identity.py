@@ -0,0 +1,35 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+
+
+class IdentityMapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = SQLiteConnection()
+        self.conn.conn.execute("INSERT INTO users (name, age) VALUES ('a', 1), ('b', 2)")
+
+    def test_disabled_by_default(self):
+        db = SessionManager(self.conn, dialect="sqlite")
+        self.assertIsNot(db.get(User, 1), db.get(User, 1))
+
+    def test_refresh(self):
+        db = SessionManager(self.conn, dialect="sqlite", identity_map=True)
+        user = db.get(User, 1)
+        self.assertIs(db.get(User, 1), user)
+        user.name = "changed"
+        self.conn.conn.execute("UPDATE users SET name = 'x', age = 10")
+        users = list(db.query(User).order_by(User.id.asc()).all())
+        self.assertIs(users[0], user)
+        self.assertEqual((user.name, user.age), ("changed", 10))
+        self.assertEqual(users[1].name, "x")
+
+
+if __name__ == '__main__':
+    unittest.main()
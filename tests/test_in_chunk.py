@@ -0,0 +1,44 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager, Function
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+
+
+class InChunkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = SessionManager(SQLiteConnection(), dialect="sqlite")
+        self.db.create_many(User, [dict(name="n%d" % i, age=i % 3) for i in range(5000)], render=False)
+        self.sql = []
+        self.db.listen("before_execute", lambda e: self.sql.append(e.sql))
+        self.ids = list(range(1, 5001))
+
+    def test_chunked(self):
+        rows = list(self.db.query(User).filter(User.id.in_(self.ids)).order_by(User.id.desc()).limit(10, 5).all())
+        self.assertEqual([u.id for u in rows], list(range(4995, 4985, -1)))
+        self.assertEqual(len(self.sql), 3)
+
+    def test_distinct_not_split(self):
+        rows = list(self.db.query(User, User.age.distinct()).filter(User.id.in_(self.ids)).all())
+        self.assertEqual(sorted(r[0] for r in rows), [0, 1, 2])
+        self.assertEqual(len(self.sql), 1)
+
+    def test_aggregate_not_split(self):
+        total = self.db.query(User).filter(User.id.in_(self.ids)).aggregate(Function.sum(User.age))
+        self.assertEqual(total, sum(i % 3 for i in range(5000)))
+        self.assertFalse(any("TEMPORARY" in s for s in self.sql))
+
+    def test_temp_table(self):
+        q = self.db.query(User, User.age.distinct()).filter(User.id.in_(self.ids)).chunk_in(2000, 10000)
+        self.assertEqual(sorted(r[0] for r in q.all()), [0, 1, 2])
+        self.assertTrue(self.sql[0].startswith("CREATE TEMPORARY TABLE"))
+        self.assertTrue(self.sql[-1].startswith("DROP TABLE"))
+
+
+if __name__ == '__main__':
+    unittest.main()
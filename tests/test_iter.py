@@ -0,0 +1,72 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection, SQLiteCursor
+from ugly_sql import Table, SessionManager
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+
+
+class StreamCursor(SQLiteCursor):
+    """记录fetchmany调用的非缓冲游标,不允许一次读取全部结果"""
+    instances = []
+
+    def __init__(self, cursor):
+        SQLiteCursor.__init__(self, cursor)
+        self.fetches = []
+        self.closed = False
+        self.instances.append(self)
+
+    def fetchmany(self, size):
+        rows = self.cursor.fetchmany(size)
+        self.fetches.append(len(rows))
+        return rows
+
+    def fetchall(self):
+        raise AssertionError("fetchall on streaming cursor")
+
+    def close(self):
+        self.closed = True
+        self.cursor.close()
+
+
+class StreamConnection(SQLiteConnection):
+
+    def cursor(self, cls=None):
+        return cls(self.conn.cursor()) if cls else SQLiteCursor(self.conn.cursor())
+
+
+class StreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        del StreamCursor.instances[:]
+        conn = StreamConnection()
+        conn.conn.executemany("INSERT INTO users (name, age) VALUES (?, ?)", [("n%d" % i, i) for i in range(10)])
+        self.db = SessionManager(conn, stream_cursor=StreamCursor, dialect="sqlite")
+
+    def test_batches(self):
+        users = list(self.db.query(User).order_by(User.id.asc()).iter(batch_size=4))
+        self.assertEqual([u.age for u in users], list(range(10)))
+        cursor, = StreamCursor.instances
+        self.assertEqual(cursor.fetches, [4, 4, 2, 0])
+        self.assertTrue(cursor.closed)
+
+    def test_lazy(self):
+        it = self.db.query(User).order_by(User.id.asc()).iter(batch_size=3)
+        self.assertEqual(next(it).name, "n0")
+        cursor, = StreamCursor.instances
+        # 只读取了第一批
+        self.assertEqual(cursor.fetches, [3])
+        it.close()
+        self.assertTrue(cursor.closed)
+
+    def test_session_iter(self):
+        rows = list(self.db.session.iter("SELECT `age` FROM `users` WHERE `age` < %s", (5,), batch_size=2))
+        self.assertEqual(rows, [(i,) for i in range(5)])
+        self.assertEqual(StreamCursor.instances[0].fetches, [2, 2, 1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
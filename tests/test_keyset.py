@@ -0,0 +1,62 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+
+
+class KeysetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = SessionManager(SQLiteConnection(), dialect="sqlite")
+        self.db.create_many(User, [dict(name="n%d" % i, age=i % 4) for i in range(20)], render=False)
+        self.expected = sorted(((i % 4, i + 1) for i in range(20)), key=lambda r: (-r[0], r[1]))
+
+    def test_column_rows(self):
+        q = self.db.query(User, User.age, User.id).order_by(User.age.desc(), User.id.asc())
+        page = q.page_after(None, 6)
+        page = q.page_after(page[-1], 6)
+        self.assertEqual([tuple(r) for r in page], self.expected[6:12])
+
+    def test_key(self):
+        q = self.db.query(User).order_by(User.age.desc(), User.id.asc())
+        page = q.page_after(size=4, key=self.expected[9])
+        self.assertEqual([(u.age, u.id) for u in page], self.expected[10:14])
+        with self.assertRaises(ValueError):
+            q.page_after(size=4, key=3)
+        with self.assertRaises(TypeError):
+            q.page_after(3, 4)
+
+    def test_iter_pages(self):
+        pages = list(self.db.query(User, User.age, User.id).iter_pages(order_by=User.age.desc(), size=7))
+        self.assertEqual([len(p) for p in pages], [7, 7, 6])
+        self.assertEqual([tuple(r) for p in pages for r in p], self.expected)
+
+    def test_null_order_values(self):
+        db = SessionManager(SQLiteConnection(), dialect="sqlite")
+        ages = [None, 1, None, 2, 1, None, 3, 2, None, 1]
+        db.create_many(User, [dict(name="n%d" % i, age=a) for i, a in enumerate(ages)], render=False)
+        rows = [(a, i + 1) for i, a in enumerate(ages)]
+        # NULL最小:升序在前,降序在后
+        asc = sorted(rows, key=lambda r: (r[0] is not None, r[0] or 0, r[1]))
+        desc = sorted(rows, key=lambda r: (r[0] is None, -(r[0] or 0), r[1]))
+        for order_by, expected in ((User.age.asc(), asc), (User.age.desc(), desc)):
+            for size in (1, 3, 4):
+                pages = db.query(User, User.age, User.id).iter_pages(order_by=order_by, size=size)
+                self.assertEqual([tuple(r) for p in pages for r in p], expected)
+        q = db.query(User).order_by(User.age.desc())
+        self.assertEqual(q.page_after(size=3, key=(None,)), [])
+        self.assertEqual([u.age for u in q.page_after(size=3, key=2)], [1, 1, 1])
+
+    def test_primary_key_not_selected(self):
+        pages = self.db.query(User, User.name).iter_pages(order_by=User.name.asc(), size=5)
+        with self.assertRaises(ValueError):
+            next(pages)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# coding:utf-8
+import time
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql._pool import ConnectionPool
+from ugly_sql.ex import DBConsole
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+
+class Conn(object):
+    def __init__(self):
+        self.closed = False
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class PoolTest(unittest.TestCase):
+
+    def test_expired_on_acquire(self):
+        pool = ConnectionPool(Conn, max_size=2, max_lifetime=0.2, pre_ping=False)
+        old = pool.acquire()
+        time.sleep(0.15)
+        new = pool.acquire()
+        pool.release(new)
+        pool.release(old)
+        time.sleep(0.1)
+        self.assertIs(pool.acquire(), new)
+        self.assertTrue(old.closed)
+
+    def test_console_discard_on_error(self):
+        console = DBConsole(SQLiteConnection, pool_size=2, pre_ping=False)
+        console.execute("SELECT 1")
+        self.assertEqual(console.pool_stats()['idle'], 1)
+        self.assertRaises(Exception, console.execute, "SELECT * FROM missing")
+        self.assertRaises(Exception, console.simple_update, "DELETE FROM missing")
+        data, error = console.simple_select("SELECT * FROM missing")
+        self.assertIsNotNone(error)
+        stats = console.pool_stats()
+        self.assertEqual((stats['idle'], stats['discarded']), (0, 3))
+        console.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager, Update, bindparam
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+
+
+class PreparedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = SQLiteConnection()
+        self.conn.conn.executemany("INSERT INTO users (name, age) VALUES (?, ?)", [("n%d" % i, i) for i in range(6)])
+        self.db = SessionManager(self.conn, dialect="sqlite")
+        self.statements = []
+        self.db.listen('before_execute', lambda e: self.statements.append((e.sql, tuple(e.args))))
+
+    def test_expanding_in(self):
+        q = self.db.query(User).filter(User.id.in_(bindparam("ids")), User.age >= bindparam("age")) \
+            .order_by(User.id.asc()).prepare()
+        self.assertEqual(q.params(), {"ids", "age"})
+        self.assertEqual([u.id for u in q.execute(ids=[1, 3, 5], age=2)], [3, 5])
+        self.assertEqual([u.id for u in q.execute(ids=(2,), age=0)], [2])
+        (sql3, args3), (sql1, args1) = self.statements
+        self.assertEqual(sql3.count("%s"), 4)
+        self.assertEqual(args3, (1, 3, 5, 2))
+        self.assertEqual(sql1.count("%s"), 2)
+        self.assertEqual(args1, (2, 0))
+
+    def test_two_lists(self):
+        q = self.db.query(User).filter(User.id.in_(bindparam("a")), User.age.in_(bindparam("b"))).prepare()
+        self.assertEqual([u.id for u in q.execute(a=[1, 2, 3], b=[1, 2])], [2, 3])
+        self.assertEqual(self.statements[-1][1], (1, 2, 3, 1, 2))
+
+    def test_errors(self):
+        q = self.db.query(User).filter(User.id.in_(bindparam("ids"))).prepare()
+        self.assertRaises(KeyError, q.execute)
+        self.assertRaises(ValueError, q.execute, ids=[])
+
+    def test_between_limit(self):
+        q = self.db.query(User).filter(User.age.between(bindparam("lo"), bindparam("hi"))) \
+            .order_by(User.age.asc()).limit(bindparam("n")).prepare()
+        self.assertEqual([u.age for u in q.execute(lo=1, hi=4, n=2)], [1, 2])
+
+    def test_update_executemany(self):
+        stmt = Update(User, "sqlite").set(User.name == bindparam("name")).where(User.id.in_(bindparam("ids")))
+        up = self.db.prepare(stmt)
+        count = up.executemany([dict(name="a", ids=[1, 2]), dict(name="b", ids=[3]), dict(name="c", ids=[4, 5])])
+        self.assertEqual(count, 5)
+        rows = self.conn.conn.execute("SELECT name FROM users ORDER BY id").fetchall()
+        self.assertEqual([r[0] for r in rows], ["a", "a", "b", "c", "c", "n5"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection, SQLiteCursor
+from ugly_sql import Table, SessionManager
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+Order = Table("orders", ("id", "user_id", "amount", "note"), "id")
+Order.relationship("user", User, Order.user_id)
+
+
+class GuardedCursor(SQLiteCursor):
+    """非缓冲游标未关闭时,同一连接不能执行其他查询"""
+
+    def __init__(self, cursor, conn):
+        SQLiteCursor.__init__(self, cursor)
+        self.conn = conn
+
+    def execute(self, sql, params=()):
+        if self.conn.streaming:
+            raise RuntimeError("commands out of sync")
+        return SQLiteCursor.execute(self, sql, params)
+
+
+class StreamCursor(GuardedCursor):
+
+    def execute(self, sql, params=()):
+        result = GuardedCursor.execute(self, sql, params)
+        self.conn.streaming = True
+        return result
+
+    def close(self):
+        self.conn.streaming = False
+        self.cursor.close()
+
+
+class StreamConnection(SQLiteConnection):
+
+    def __init__(self):
+        SQLiteConnection.__init__(self)
+        self.streaming = False
+
+    def cursor(self, cls=GuardedCursor):
+        return cls(self.conn.cursor(), self)
+
+
+class RelationshipTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = StreamConnection()
+        self.conn.conn.execute("INSERT INTO users (name, age) VALUES ('a', 1), ('b', 2), ('c', 3)")
+        self.conn.conn.executemany("INSERT INTO orders (user_id, amount) VALUES (?, ?)",
+                                   [(i % 3 + 1, i) for i in range(20)])
+        self.db = SessionManager(self.conn, stream_cursor=StreamCursor, dialect="sqlite")
+        self.statements = []
+        self.db.listen('before_execute', lambda e: self.statements.append(e.sql))
+
+    def test_lazy_batched(self):
+        orders = list(self.db.query(Order).order_by(Order.id.asc()).all())
+        del self.statements[:]
+        self.assertEqual([o.user.id for o in orders], [i % 3 + 1 for i in range(20)])
+        self.assertEqual(len(self.statements), 1)
+
+    def test_iter_prefetch(self):
+        rows = list(self.db.query(Order).prefetch("user").iter(batch_size=6))
+        self.assertEqual([o.id for o in rows], list(range(1, 21)))
+        del self.statements[:]
+        self.assertEqual([o.user.name for o in rows], ["abc"[i % 3] for i in range(20)])
+        self.assertEqual(self.statements, [])
+
+    def test_iter_prefetch_limit(self):
+        q = self.db.query(Order).order_by(Order.id.asc()).limit(5).prefetch("user")
+        self.assertEqual([o.user.id for o in q.iter(batch_size=2)], [1, 2, 3, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# coding:utf-8
+import time
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager, ReplicaSet
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+
+
+class ReplicaRoutingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.primary = SQLiteConnection()
+        self.replica = SQLiteConnection()
+        self.replica.conn.execute("INSERT INTO users (name, age) VALUES ('r1', 1), ('r2', 2)")
+        self.db = SessionManager(self.primary, replicas=[lambda: self.replica], dialect="sqlite")
+        self.db.session.read_your_writes = 0.05
+
+    def count(self):
+        return self.db.query(User).count()
+
+    def test_routing(self):
+        self.assertEqual(self.count(), 2)
+        self.db.begin()
+        self.assertEqual(self.count(), 0)
+        self.db.create(User, name="p1", age=1)
+        self.assertEqual(self.count(), 1)
+        self.db.commit()
+        self.assertEqual(self.count(), 1)
+        time.sleep(0.06)
+        self.assertEqual(self.count(), 2)
+
+    def test_write_without_begin(self):
+        self.db.create(User, name="p1", age=1)
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(self.db.query(User).using("replica").count(), 2)
+
+    def test_shared_replica_set(self):
+        replicas = ReplicaSet([lambda: self.replica])
+        with SessionManager(self.primary, replicas=replicas, dialect="sqlite") as db:
+            self.assertEqual(db.query(User).count(), 2)
+        # 共享的ReplicaSet退出会话后仍然可用
+        self.assertEqual(replicas.stats()[0]['reads'], 1)
+        with SessionManager(self.primary, replicas=replicas, dialect="sqlite") as db:
+            self.assertEqual(db.query(User).count(), 2)
+        self.assertTrue(replicas.stats()[0]['available'])
+
+    def test_replica_errors(self):
+        class OperationalError(Exception):
+            pass
+
+        class BrokenCursor(object):
+            def __init__(self, error):
+                self.error = error
+
+            def execute(self, sql, params=()):
+                raise self.error
+
+            def close(self):
+                pass
+
+        class BrokenConnection(object):
+            error = None
+
+            def cursor(self):
+                return BrokenCursor(self.error)
+
+            def close(self):
+                pass
+
+        broken = BrokenConnection()
+        db = SessionManager(self.primary, replicas=[lambda: broken], dialect="sqlite")
+        broken.error = ValueError("bad sql")
+        self.assertRaises(ValueError, db.query(User).count)
+        self.assertTrue(db.session.replicas.stats()[0]['available'])
+        # 连接错误时暂停使用从库,改读主库
+        broken.error = OperationalError("server has gone away")
+        self.assertEqual(db.query(User).count(), 0)
+        self.assertFalse(db.session.replicas.stats()[0]['available'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager
+from ugly_sql._util import DBRow, DBObjProxy
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+Doc = Table("users", ("id", "name", "password", "age"), "id", deferred=("password",))
+Log = Table("users", ("id", "name", "password", "age"), None)
+# 字段名不能作为属性名时使用DBObjProxy
+Keyword = Table("kw", ("id", "class"), "id")
+
+
+class RowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = SQLiteConnection(("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, "
+                                      "password TEXT, age INT)",
+                                      "CREATE TABLE kw (id INTEGER PRIMARY KEY AUTOINCREMENT, class TEXT)"))
+        self.conn.conn.executemany("INSERT INTO users (name, password, age) VALUES (?, ?, ?)",
+                                   [("n%d" % i, "p%d" % i, i) for i in range(3)])
+        self.conn.conn.execute("INSERT INTO kw (class) VALUES ('a')")
+        self.db = SessionManager(self.conn, dialect="sqlite")
+        self.statements = []
+        self.db.listen('before_execute', lambda e: self.statements.append(e.sql))
+
+    def test_slots(self):
+        user = self.db.get(User, 1)
+        self.assertIsInstance(user, DBRow)
+        self.assertFalse(hasattr(user, '__dict__'))
+        self.assertEqual((user.id, user.name, user.age), (1, "n0", 0))
+        self.assertRaises(AttributeError, setattr, user, "id", 5)
+        self.assertRaises(AttributeError, setattr, user, "missing", 5)
+
+    def test_as_dict(self):
+        user = self.db.get(User, 1)
+        data = user.as_dict()
+        self.assertEqual(data, dict(id=1, name="n0", password="p0", age=0))
+        # DBRow返回副本
+        data["name"] = "x"
+        self.assertEqual(user.name, "n0")
+        kw = self.db.get(Keyword, 1)
+        self.assertIsInstance(kw, DBObjProxy)
+        self.assertEqual(kw.as_dict(), {"id": 1, "class": "a"})
+
+    def test_modify(self):
+        self.db.begin()
+        user = self.db.get(User, 2)
+        user.name = "changed"
+        self.db.commit()
+        self.assertEqual(self.conn.conn.execute("SELECT name FROM users WHERE id = 2").fetchone(), ("changed",))
+
+    def test_deferred(self):
+        docs = list(self.db.query(Doc).order_by(Doc.id.asc()).all())
+        self.assertNotIn("password", self.statements[-1])
+        del self.statements[:]
+        self.assertEqual([d.password for d in docs], ["p0", "p1", "p2"])
+        self.assertEqual(len(self.statements), 1)
+
+    def test_created_row(self):
+        user = self.db.create(User, name="new")
+        self.assertEqual(user.name, "new")
+        del self.statements[:]
+        # create()未指定的字段不查询数据库
+        self.assertRaises(AttributeError, getattr, user, "age")
+        self.assertEqual(self.statements, [])
+
+    def test_no_primary_key(self):
+        row = self.db.query(Log).filter(Log.name == "n0").one()
+        self.assertEqual(row.age, 0)
+        self.assertRaises(AttributeError, setattr, row, "age", 1)
+        derived = self.db.query(User, User.name, User.age).subquery("d")
+        row = self.db.query(derived).filter(derived.name == "n1").one()
+        self.assertEqual(row.age, 1)
+        self.assertRaises(AttributeError, setattr, row, "age", 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
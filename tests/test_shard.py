@@ -0,0 +1,49 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, ShardedSessionManager, Function
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id", primary_auto=False, shard_key="id")
+
+
+class ShardAggregateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = ShardedSessionManager([SQLiteConnection() for _ in range(3)])
+        self.ages = [i * 7 % 50 for i in range(1, 31)]
+        self.db.create_many(User, [dict(id=i, name="n%d" % i, age=a) for i, a in enumerate(self.ages, 1)],
+                            render=False)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_aggregate(self):
+        q = self.db.query(User).filter(User.age > 10)
+        ages = [a for a in self.ages if a > 10]
+        total, low, high, avg, n = q.aggregate(Function.sum(User.age), Function.min(User.age), Function.max(User.age),
+                                               Function.avg(User.age), Function.count(User.id))
+        self.assertEqual((total, low, high, n), (sum(ages), min(ages), max(ages), len(ages)))
+        self.assertAlmostEqual(avg, sum(ages) / len(ages))
+        self.assertEqual(q.count(), len(ages))
+        self.assertIsNone(self.db.query(User).filter(User.age > 100).aggregate(Function.avg(User.age)))
+        self.assertEqual(self.db.query(User).filter(User.id == 4).aggregate(Function.max(User.age)), self.ages[3])
+
+    def test_unsupported(self):
+        q = self.db.query(User)
+        with self.assertRaises(ValueError):
+            q.aggregate(Function.count(User.age.distinct()))
+        with self.assertRaises(ValueError):
+            q.aggregate(Function.group_concat(User.name))
+        with self.assertRaises(ValueError):
+            self.db.query(User).limit(5).count()
+        with self.assertRaises(TypeError):
+            q.cached()
+        with self.assertRaises(TypeError):
+            q.prepare()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# coding:utf-8
+import unittest
+
+from ugly_sql import Table, Update, Insert, Function, sql_cache, bindparam
+from ugly_sql._db import Query
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+Order = Table("orders", ("id", "user_id", "amount", "note"), "id")
+
+# 结构不同的语句,编译结果各不相同
+STATEMENTS = (
+    lambda: Query(User).filter(User.id == 1),
+    lambda: Query(User).filter(User.id != 1),
+    lambda: Query(User).filter(User.id == User.age),
+    lambda: Query(User).filter(User.age.is_(None)),
+    lambda: Query(User).filter(User.id.in_([1, 2])),
+    lambda: Query(User).filter(User.id.in_([1, 2, 3])),
+    lambda: Query(User).filter(User.id.in_(bindparam("ids"))),
+    lambda: Query(User).filter(User.id.between(1, 2)),
+    lambda: Query(Order).filter(Order.id == 1),
+    lambda: Query(User, User.name).filter(User.id == 1),
+    lambda: Query(User, Function.count(User.id)).filter(User.id == 1),
+    lambda: Query(User).filter(User.id == 1).order_by(User.id.asc()),
+    lambda: Query(User).filter(User.id == 1).order_by(User.id.desc()),
+    lambda: Query(User).filter(User.id == 1).limit(10),
+    lambda: Query(User).join(Order, Order.user_id == User.id).filter(User.id == 1),
+    lambda: Query(User).left_join(Order, Order.user_id == User.id).filter(User.id == 1),
+    lambda: Update(User).set(User.name == "a").where(User.id == 1),
+    lambda: Update(User).set(User.age == "a").where(User.id == 1),
+    lambda: Update(User, "sqlite").set(User.age == "a").where(User.id == 1).limit(1),
+    lambda: Update(User).set(User.age == "a").where(User.id == 1).limit(1),
+    lambda: Insert(User).set(User.name == "a"),
+    lambda: Insert(User).set(User.name == "a", User.age == 1),
+)
+
+
+def fresh(stmt):
+    """不使用缓存编译"""
+    size = sql_cache.maxsize
+    sql_cache.resize(0)
+    try:
+        return stmt.sql()
+    finally:
+        sql_cache.resize(size)
+
+
+class SQLCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        sql_cache.clear()
+
+    def test_shapes(self):
+        compiled = [make().sql() for make in STATEMENTS]
+        self.assertEqual(len(set(compiled)), len(STATEMENTS))
+        # 缓存命中的结果与重新编译的相同
+        for make, sql in zip(STATEMENTS, compiled):
+            self.assertEqual(make().sql(), sql)
+            self.assertEqual(fresh(make()), sql)
+
+    def test_hit(self):
+        self.assertEqual(Query(User).filter(User.id == 1).args(), (1,))
+        q = Query(User).filter(User.id == 2)
+        self.assertEqual(q.sql(), Query(User).filter(User.id == 1).sql())
+        self.assertEqual(q.args(), (2,))
+        stats = sql_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_lru(self):
+        sql_cache.resize(2)
+        try:
+            for make in STATEMENTS[:3]:
+                make().sql()
+            stats = sql_cache.stats()
+            self.assertEqual((stats['size'], stats['evictions']), (2, 1))
+        finally:
+            sql_cache.resize(1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
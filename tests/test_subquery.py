@@ -0,0 +1,70 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager, Function, exists
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+Order = Table("orders", ("id", "user_id", "amount", "note"), "id")
+
+
+class SubqueryTest(unittest.TestCase):
+
+    def setUp(self):
+        conn = SQLiteConnection()
+        conn.conn.executemany("INSERT INTO users (name, age) VALUES (?, ?)", [("a", 1), ("b", 2), ("c", 3)])
+        conn.conn.executemany("INSERT INTO orders (user_id, amount) VALUES (?, ?)",
+                              [(1, 10), (1, 200), (2, 50), (2, 60), (1, 5)])
+        self.db = SessionManager(conn, dialect="sqlite")
+
+    def test_in_subquery(self):
+        q = self.db.query(User).filter(User.id.in_(self.db.query(Order, Order.user_id).filter(Order.amount > 100)))
+        sql, args = q._statement()
+        self.assertIn("`users`.`id` IN (SELECT `orders`.`user_id` FROM `orders` WHERE `orders`.`amount` > %s)", sql)
+        self.assertEqual(tuple(args), (100,))
+        self.assertEqual([u.name for u in q.all()], ["a"])
+
+    def test_exists(self):
+        sub = self.db.query(Order, Order.id).filter(Order.user_id == User.id, Order.amount >= 50)
+        q = self.db.query(User).filter(exists(sub)).order_by(User.id.asc())
+        self.assertIn("WHERE EXISTS (SELECT `orders`.`id` FROM `orders` WHERE `orders`.`user_id` = `users`.`id`",
+                      q._statement()[0])
+        self.assertEqual([u.name for u in q.all()], ["a", "b"])
+        q = self.db.query(User).filter(~exists(sub))
+        self.assertIn("WHERE NOT EXISTS (", q._statement()[0])
+        self.assertEqual([u.name for u in q.all()], ["c"])
+
+    def test_derived(self):
+        latest = self.db.query(Order, Order.user_id, Function.max(Order.id).label("max_id")) \
+            .filter(Order.amount > 1).group_by(Order.user_id).subquery("latest")
+        q = self.db.query(Order).join(latest, latest.max_id == Order.id).order_by(Order.id.asc())
+        sql, args = q._statement()
+        self.assertIn("JOIN (SELECT `orders`.`user_id`,MAX(`orders`.`id`) AS `max_id` FROM `orders` "
+                      "WHERE `orders`.`amount` > %s GROUP BY `orders`.`user_id`) AS `latest` "
+                      "ON `latest`.`max_id` = `orders`.`id`", sql)
+        self.assertEqual(tuple(args), (1,))
+        self.assertEqual([o.id for o in q.all()], [4, 5])
+        rows = list(self.db.query(latest).order_by(latest.user_id.asc()).all())
+        self.assertEqual([(r.user_id, r.max_id) for r in rows], [(1, 5), (2, 4)])
+
+    def test_cte(self):
+        totals = self.db.query(Order, Order.user_id, Function.sum(Order.amount).label("total")) \
+            .group_by(Order.user_id).cte("totals")
+        q = self.db.query(User, User.name, totals.total).join(totals, totals.user_id == User.id) \
+            .filter(totals.total > 150)
+        sql, args = q._statement()
+        self.assertTrue(sql.startswith("WITH `totals` AS (SELECT `orders`.`user_id`,SUM(`orders`.`amount`) AS "
+                                       "`total` FROM `orders` GROUP BY `orders`.`user_id`) SELECT "))
+        self.assertIn("JOIN `totals` ON", sql)
+        self.assertEqual(tuple(args), (150,))
+        self.assertEqual(list(q.all()), [("a", 215)])
+
+    def test_computed_column_label(self):
+        q = self.db.query(Order, Order.user_id, Function.max(Order.id)).group_by(Order.user_id)
+        self.assertRaises(ValueError, q.subquery, "latest")
+
+
+if __name__ == '__main__':
+    unittest.main()
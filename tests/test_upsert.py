@@ -0,0 +1,68 @@
+# coding:utf-8
+import unittest
+
+from tests._fakes import SQLiteConnection
+from ugly_sql import Table, SessionManager, Upsert
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+User = Table("users", ("id", "name", "password", "age"), "id")
+
+
+class UpsertSQLTest(unittest.TestCase):
+
+    def test_mysql(self):
+        ups = Upsert(User, ("id", "name", "age")).add((1, "a", 1)).add((2, "b", 2))
+        self.assertEqual(ups.sql(), "INSERT INTO `users` (`id`,`name`,`age`) VALUES (%s,%s,%s),(%s,%s,%s) "
+                                    "ON DUPLICATE KEY UPDATE `name`=VALUES(`name`),`age`=VALUES(`age`)")
+        self.assertEqual(ups.args(), [1, "a", 1, 2, "b", 2])
+        ignore = Upsert(User, ("id", "name"), update_columns=()).add((1, "a"))
+        self.assertTrue(ignore.sql().endswith("ON DUPLICATE KEY UPDATE `id`=`id`"))
+
+    def test_sqlite(self):
+        ups = Upsert(User, ("id", "name", "age"), dialect="sqlite").add((1, "a", 1))
+        self.assertTrue(ups.sql().endswith("ON CONFLICT (`id`) DO UPDATE SET `name`=excluded.`name`,"
+                                           "`age`=excluded.`age`"))
+        ups = Upsert(User, ("name", "age"), conflict=("name",), dialect="sqlite").add(("a", 1))
+        self.assertTrue(ups.sql().endswith("ON CONFLICT (`name`) DO UPDATE SET `age`=excluded.`age`"))
+        ignore = Upsert(User, ("id", "name"), update_columns=(), dialect="sqlite").add((1, "a"))
+        self.assertTrue(ignore.sql().endswith("ON CONFLICT (`id`) DO NOTHING"))
+
+    def test_unknown_column(self):
+        self.assertRaises(AttributeError, Upsert, User, ("id", "missing"))
+
+
+class UpsertManyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = SQLiteConnection(("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, "
+                                      "password TEXT, age INT)",))
+        self.conn.conn.executemany("INSERT INTO users (name, age) VALUES (?, ?)", [("a", 1), ("b", 2)])
+        self.db = SessionManager(self.conn, dialect="sqlite")
+        self.statements = []
+        self.db.listen('before_execute', lambda e: self.statements.append(e.sql))
+
+    def rows(self):
+        return self.conn.conn.execute("SELECT id, name, age FROM users ORDER BY id").fetchall()
+
+    def test_primary_key(self):
+        self.db.upsert_many(User, [dict(id=1, name="a", age=10), dict(id=3, name="c", age=3)])
+        self.assertEqual(self.rows(), [(1, "a", 10), (2, "b", 2), (3, "c", 3)])
+
+    def test_conflict_column(self):
+        self.db.upsert_many(User, [dict(name="b", age=20), dict(name="d", age=4)], conflict=("name",))
+        self.assertEqual([r[1:] for r in self.rows()], [("a", 1), ("b", 20), ("d", 4)])
+
+    def test_do_nothing(self):
+        self.db.upsert_many(User, [dict(id=1, name="a", age=10), dict(id=3, name="c", age=3)], update_columns=[])
+        self.assertEqual(self.rows(), [(1, "a", 1), (2, "b", 2), (3, "c", 3)])
+
+    def test_batches(self):
+        rows = [dict(id=i, name="n%d" % i, age=i) for i in range(1, 6)]
+        self.db.upsert_many(User, rows, batch_size=2)
+        self.assertEqual(len(self.statements), 3)
+        self.assertEqual(self.rows(), [(i, "n%d" % i, i) for i in range(1, 6)])
+
+
+if __name__ == '__main__':
+    unittest.main()
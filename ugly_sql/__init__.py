@@ -1,15 +1,24 @@
 # coding:utf-8
 
+from ._async import AsyncSessionManager, AsyncConnectionPool
+from ._cache import result_cache, ResultCache, LRUResultCache
 from ._dao import SessionManager
-from ._db import Table, Field, Insert, Function, OrderBy, ORFilter
+from ._events import SlowQueryLogger
+from ._explain import ExplainSampler
+from ._db import Table, Field, Insert, Update, Delete, Upsert, Function, OrderBy, ORFilter, Exists, sql_cache, bindparam
+from ._replica import ReplicaSet
 from ._session import DBSession
+from ._shard import ShardedSessionManager
 
 __author__ = 'Memory_Leak<irealing@163.com>'
 
-__all__ = ("Table", "Function", "DBSession", "SessionManager", 'or_')
+__all__ = ("Table", "Function", "DBSession", "SessionManager", 'or_', 'exists', 'sql_cache', "AsyncSessionManager",
+           "AsyncConnectionPool", "result_cache", "ResultCache", "LRUResultCache",
+           "bindparam", "SlowQueryLogger", "ShardedSessionManager", "ReplicaSet", "Upsert", "ExplainSampler")
 Table = Table
 # DBSession = DBSession
 Function = Function.instance()
 SessionManager = SessionManager
 OrderBy = OrderBy
 or_ = ORFilter
+exists = Exists
@@ -0,0 +1,855 @@
+# coding:utf-8
+import asyncio
+import inspect
+import logging
+import sys
+import time
+import weakref
+from collections import deque
+
+from ._cache import invalidate_tables, written_table, new_namespace
+from ._columns import ColumnsBuilder
+from ._dao_impl import DBQuery
+from ._events import Events, run_async
+from ._explain import QueryPlan
+from ._pool import PoolTimeout
+from ._prepared import PreparedStatement
+from ._util import row_factory, related_queries, attach_related
+from ._db import get_dialect
+from ._session import (DBSession, _unbuffered_cursor, _insert_stmt, _created_row, _insert_batches, _collect_created,
+                       _modify_statements, _upsert_batches, _evict_table)
+
+try:
+    from contextlib import asynccontextmanager
+except ImportError:  # pragma: no cover
+    asynccontextmanager = None
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+
+async def _maybe_await(ret):
+    if inspect.isawaitable(ret):
+        return await ret
+    return ret
+
+
+class AsyncConnectionPool(object):
+    """
+    asyncio数据库连接池
+    """
+    logger = logging.getLogger("AsyncConnectionPool")
+
+    def __init__(self, connect, min_size=0, max_size=8, idle_timeout=300, max_lifetime=3600, pre_ping=True,
+                 wait_timeout=30, reset_on_return=True):
+        """
+        :param connect: 创建数据库连接的协程函数
+        :param min_size: 保持的最小连接数(首次取出连接时创建)
+        :param max_size: 最大连接数
+        :param idle_timeout: 空闲连接的回收时间(秒),None不回收
+        :param max_lifetime: 连接的最长使用时间(秒),None不限制
+        :param pre_ping: 取出连接前检查连接是否可用
+        :param wait_timeout: 等待可用连接的超时时间(秒),None一直等待
+        :param reset_on_return: 归还连接时回滚未提交的事务
+        """
+        assert max_size > 0 and 0 <= min_size <= max_size
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.pre_ping = pre_ping
+        self.wait_timeout = wait_timeout
+        self.reset_on_return = reset_on_return
+        # 由此创建的会话共享查询结果缓存,连接同一数据库的连接池可设置为相同的值(如DSN)
+        self.cache_key = new_namespace()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._cond = None
+        self._closed = False
+        self._filled = False
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._timeouts = 0
+
+    def __condition(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def __expired(self, item, now):
+        conn, created, last_used = item
+        if self.max_lifetime is not None and now - created > self.max_lifetime:
+            return True
+        return self.idle_timeout is not None and now - last_used > self.idle_timeout and self._size > self.min_size
+
+    async def __fill(self):
+        self._filled = True
+        while self._size < self.min_size:
+            self._size += 1
+            try:
+                conn = await self._connect()
+            except Exception:
+                self._size -= 1
+                raise
+            now = time.time()
+            self._idle.append((conn, now, now))
+
+    @staticmethod
+    async def _ping(conn):
+        ping = getattr(conn, 'ping', None)
+        if ping is not None:
+            await _maybe_await(ping(False))
+            return
+        cursor = await _maybe_await(conn.cursor())
+        try:
+            await cursor.execute("SELECT 1")
+            await cursor.fetchall()
+        finally:
+            await _maybe_await(cursor.close())
+
+    async def _close(self, conn):
+        try:
+            await _maybe_await(conn.close())
+        except Exception as e:
+            self.logger.warning("close connection error %s", e)
+
+    async def acquire(self, timeout=None):
+        """
+        取出连接
+        :param timeout: 等待超时时间,未指定时使用wait_timeout
+        :return: 数据库连接
+        """
+        if self._closed:
+            raise Exception("connection pool closed")
+        if not self._filled:
+            await self.__fill()
+        timeout = self.wait_timeout if timeout is None else timeout
+        cond = self.__condition()
+        start = time.time()
+        waited = False
+        while True:
+            now = time.time()
+            while self._idle and self.__expired(self._idle[0], now):
+                conn, _, _ = self._idle.popleft()
+                self._size -= 1
+                await self._close(conn)
+            if self._idle:
+                item = self._idle.pop()
+                conn, created, _ = item
+                if self.__expired(item, now):
+                    self._size -= 1
+                    await self._close(conn)
+                    continue
+                if self.pre_ping:
+                    try:
+                        await self._ping(conn)
+                    except Exception as e:
+                        self.logger.warning("pre-ping failed, discard connection: %s", e)
+                        self._size -= 1
+                        await self._close(conn)
+                        continue
+            elif self._size < self.max_size:
+                self._size += 1
+                try:
+                    conn = await self._connect()
+                except Exception:
+                    self._size -= 1
+                    raise
+                created = time.time()
+            else:
+                waited = True
+                remain = None if timeout is None else timeout - (now - start)
+                if remain is not None and remain <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout("no connection available after {}s".format(timeout))
+                async with cond:
+                    if not self._idle and self._size >= self.max_size:
+                        try:
+                            await asyncio.wait_for(cond.wait(), remain)
+                        except asyncio.TimeoutError:
+                            pass
+                continue
+            self._in_use[id(conn)] = (conn, created)
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            elapsed = time.time() - start
+            self._wait_time += elapsed
+            self._max_wait_time = max(self._max_wait_time, elapsed)
+            return conn
+
+    async def release(self, conn, discard=False):
+        """
+        归还连接
+        :param conn: 数据库连接
+        :param discard: 是否丢弃连接
+        """
+        item = self._in_use.pop(id(conn), None)
+        if item is None:
+            raise ValueError("connection not belong to this pool")
+        if not discard and self.reset_on_return:
+            try:
+                await _maybe_await(conn.rollback())
+            except Exception as e:
+                self.logger.warning("reset connection error %s", e)
+                discard = True
+        _, created = item
+        if discard or self._closed or (self.max_lifetime is not None and time.time() - created > self.max_lifetime):
+            self._size -= 1
+            await self._close(conn)
+        else:
+            self._idle.append((conn, created, time.time()))
+        cond = self.__condition()
+        async with cond:
+            cond.notify()
+
+    def stats(self):
+        """
+        连接池状态
+        :return: dict
+        """
+        return dict(
+            size=self._size, in_use=len(self._in_use), idle=len(self._idle), max_size=self.max_size,
+            checkouts=self._checkouts, waits=self._waits, timeouts=self._timeouts,
+            wait_time=self._wait_time, max_wait_time=self._max_wait_time,
+            avg_wait_time=self._wait_time / self._checkouts if self._checkouts else 0.0,
+        )
+
+    async def close(self):
+        """关闭连接池及所有空闲连接"""
+        self._closed = True
+        while self._idle:
+            conn, _, _ = self._idle.popleft()
+            self._size -= 1
+            await self._close(conn)
+
+
+class AsyncPreparedStatement(PreparedStatement):
+    """
+    asyncio预处理语句
+    """
+
+    async def execute(self, **params):
+        sql, args = self.bind(params)
+        return await self.session.execute_prepared(sql, args, server_side=self.server_side)
+
+    async def executemany(self, params_list):
+        groups = {}
+        order = []
+        for params in params_list:
+            sql, args = self.bind(params)
+            if sql not in groups:
+                groups[sql] = []
+                order.append(sql)
+            groups[sql].append(args)
+        count = 0
+        for sql in order:
+            count += await self.session.execute_prepared(sql, groups[sql], many=True, server_side=self.server_side)
+        return count
+
+
+class AsyncPreparedQuery(PreparedStatement):
+    """
+    asyncio预处理查询
+    """
+
+    def __init__(self, session, sql, args, render, server_side=True):
+        PreparedStatement.__init__(self, session, sql, args, server_side)
+        self.__render = render
+
+    async def execute(self, **params):
+        sql, args = self.bind(params)
+        rows = await self.session.execute_prepared(sql, args, fetch=True, server_side=self.server_side)
+        return [self.__render(row) for row in rows]
+
+    async def one(self, **params):
+        rows = await self.execute(**params)
+        return rows[0] if rows else None
+
+    async def executemany(self, params_list):
+        return [await self.execute(**params) for params in params_list]
+
+
+class AsyncDBSession(object):
+    """asyncio数据库会话工具,驱动接口与aiomysql一致"""
+    logger = logging.getLogger("AsyncDBSession")
+    max_packet = DBSession.max_packet
+    flush_batch_size = DBSession.flush_batch_size
+    dialect = DBSession.dialect
+
+    def __init__(self, conn, transaction=False, stream_cursor=None, identity_map=False, events=None, cache_key=None):
+        """
+        :param conn: 数据库连接
+        :param transaction: 进入上下文时开启事务
+        :param stream_cursor: 流式查询使用的游标类,未指定时根据驱动选择非缓冲游标
+        :param identity_map: 同一会话中按(表, 主键)复用行对象(默认关闭)
+        :param events: 共享的事件监听器(Events)
+        :param cache_key: 查询结果缓存的命名空间,同DBSession
+        """
+        self.cache_key = new_namespace() if cache_key is None else cache_key
+        self._events = events
+        self._identity = weakref.WeakValueDictionary() if identity_map else None
+        self.__conn = conn
+        self.__stream_cursor = stream_cursor
+        self.__cursor = None
+        self.__begin = False
+        self.__commit = False
+        self.__tran = transaction
+        self.__modify = []
+        self.__written = set()
+        self.__id_step = None
+
+    def listen(self, name, fn):
+        """
+        注册事件监听器,参数同DBSession.listen
+        """
+        if self._events is None:
+            self._events = Events()
+        return self._events.listen(name, fn)
+
+    def _register_modify(self, update):
+        self.__modify.append(update)
+
+    async def __get_cursor(self):
+        if self.__cursor is None:
+            self.__cursor = await _maybe_await(self.__conn.cursor())
+        return self.__cursor
+
+    async def __aenter__(self):
+        if self.__tran:
+            await self.begin()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.__begin and not self.__commit:
+            cursor = await self.__get_cursor()
+            await run_async(self._events, cursor, "ROLLBACK;", (), self)
+            self.clear_identity()
+            self.__invalidate_written()
+        if exc_val:
+            tb = exc_tb
+            if tb is not None and tb.tb_next is not None:
+                tb = tb.tb_next
+            if tb is not None:
+                cn = exc_val.__class__.__name__
+                es = "{}:{}:{}".format(tb.tb_frame.f_code.co_filename, cn, tb.tb_lineno)
+                logging.warning("db context error %s : %s", es, exc_val)
+
+    def __wrote(self, table_name):
+        """记录写操作并使相关的查询结果缓存失效"""
+        if table_name:
+            invalidate_tables(table_name)
+            self.__written.add(table_name)
+
+    def __invalidate_written(self):
+        if self.__written:
+            invalidate_tables(*self.__written)
+            self.__written.clear()
+
+    def clear_identity(self):
+        """清空会话中缓存的行对象"""
+        if self._identity is not None:
+            self._identity.clear()
+
+    async def get(self, table, pk):
+        """
+        按主键获取行对象,会话中已存在时不查询数据库
+        """
+        return (await self.get_many(table, (pk,)))[0]
+
+    async def get_many(self, table, pks):
+        """
+        按主键批量获取行对象,会话中不存在的行合并为一次IN查询
+        :return: 与pks顺序对应的行对象列表,不存在的为None
+        """
+        found = {}
+        misses = []
+        name = table.table_name_
+        for pk in pks:
+            obj = self._identity.get((name, pk)) if self._identity is not None else None
+            if obj is None:
+                if pk not in found:
+                    misses.append(pk)
+                    found[pk] = None
+            else:
+                found[pk] = obj
+        if misses:
+            pk_name = table.primary_key.name
+            for obj in await AsyncDBQuery(self, table).filter(table.primary_key.in_(misses)).all():
+                found[getattr(obj, pk_name)] = obj
+        return [found.get(pk) for pk in pks]
+
+    @property
+    def in_transaction(self):
+        """是否已开启事务"""
+        return self.__begin
+
+    @property
+    def uncommitted_tables(self):
+        """本会话写入后尚未提交或回滚的表名"""
+        return self.__written
+
+    async def begin(self):
+        if not self.__begin:
+            cursor = await self.__get_cursor()
+            await run_async(self._events, cursor, 'BEGIN;', (), self)
+            self.__begin = True
+
+    async def __query(self, sql, params, rows=False):
+        self.logger.debug("execute sql : %s", sql)
+        cursor = await self.__get_cursor()
+        await run_async(self._events, cursor, sql, params, self)
+        return await (cursor.fetchall() if rows else cursor.fetchone())
+
+    async def explain(self, sql, params):
+        """
+        查询语句的执行计划(EXPLAIN)
+        :return: QueryPlan
+        """
+        cursor = await self.__get_cursor()
+        await run_async(self._events, cursor, "EXPLAIN " + sql, params, self)
+        names = [d[0] for d in cursor.description or ()]
+        return QueryPlan([dict(zip(names, row)) for row in await cursor.fetchall()])
+
+    async def query(self, sql, params):
+        """
+        查询多行
+        :param sql:
+        :param params:
+        :return:
+        """
+        return await self.__query(sql, params, True)
+
+    async def one(self, sql, params):
+        """
+        查询一行
+        :param sql:
+        :param params:
+        :return:
+        """
+        return await self.__query(sql, params, False)
+
+    async def iter(self, sql, params, batch_size=1000):
+        """
+        流式查询,使用非缓冲游标逐批(fetchmany)读取
+        :param sql:
+        :param params:
+        :param batch_size: 每批读取的行数
+        :return: async generator
+        """
+        async for rows in self.iter_batches(sql, params, batch_size):
+            for row in rows:
+                yield row
+
+    async def iter_batches(self, sql, params, batch_size=1000):
+        """
+        流式查询,逐批返回结果行
+        :return: async generator of list
+        """
+        cls = self.__stream_cursor or _unbuffered_cursor(self.__conn)
+        cursor = await _maybe_await(self.__conn.cursor(cls) if cls else self.__conn.cursor())
+        try:
+            self.logger.debug("execute sql : %s", sql)
+            await run_async(self._events, cursor, sql, params, self)
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            await _maybe_await(cursor.close())
+
+    async def __do_modify(self):
+        if not self.__modify:
+            return
+        modify, self.__modify = self.__modify, []
+        try:
+            for mu in _modify_statements(modify, self.flush_batch_size, self.dialect):
+                await self.update(mu.sql(), mu.args())
+        except Exception:
+            self.__modify = modify + self.__modify
+            raise
+        for m in modify:
+            m._flushed()
+
+    async def execute_prepared(self, sql, params, fetch=False, many=False, server_side=True):
+        """
+        执行预处理语句,参数同DBSession.execute_prepared
+        """
+        cursor = await self.__get_cursor()
+        self.logger.debug("execute prepared sql : %s", sql)
+        await run_async(self._events, cursor, sql, params, self, many)
+        if fetch:
+            return await cursor.fetchall()
+        self.__wrote(written_table(sql))
+        return cursor.rowcount
+
+    async def update(self, sql, params):
+        """
+        更新数据
+        :param sql:
+        :param params:
+        :return: 影响行数
+        """
+        cursor = await self.__get_cursor()
+        self.logger.debug("execute sql : %s", sql)
+        await run_async(self._events, cursor, sql, params, self)
+        self.__wrote(written_table(sql))
+        return cursor.rowcount
+
+    async def execute_bulk(self, stmt):
+        """
+        执行批量UPDATE/DELETE语句,参数同DBSession.execute_bulk
+        """
+        await self.__do_modify()
+        count = await self.update(stmt.sql(), stmt.args())
+        _evict_table(self._identity, stmt.table)
+        return max(count, 0)
+
+    async def commit(self, again=True):
+        """
+        提交改动
+        :param again:
+        :return:
+        """
+        if not self.__begin:
+            raise Exception("must call begin before commit")
+        start = time.perf_counter()
+        await self.__do_modify()
+        cursor = await self.__get_cursor()
+        await run_async(self._events, cursor, 'COMMIT;', (), self)
+        self.__invalidate_written()
+        if self._events is not None:
+            self._events.commit(self, start)
+        self.__commit = True
+        if again:
+            self.__begin = False
+            await self.begin()
+            self.__commit = False
+
+    async def create(self, table, **kwargs):
+        """
+        生成记录
+        :param table:
+        :param kwargs:
+        :return:
+        """
+        ins = _insert_stmt(table, kwargs)
+        cursor = await self.__get_cursor()
+        await run_async(self._events, cursor, ins.sql(), list(ins.args()), self)
+        self.__wrote(table.table_name_)
+        return _created_row(ins, cursor.lastrowid, self)
+
+    async def create_many(self, table, rows, batch_size=1000, return_ids=False, render=True, max_packet=None):
+        """
+        批量生成记录,参数同DBSession.create_many
+        """
+        max_packet = self.max_packet if max_packet is None else max_packet
+        objs = [] if render or return_ids else None
+        count = 0
+        cursor = await self.__get_cursor()
+        dialect = get_dialect(self.dialect)
+        step = await self.__auto_increment() if objs is not None and table.primary_auto else 1
+        for ins in _insert_batches(table, rows, batch_size, max_packet):
+            await run_async(self._events, cursor, ins.sql(), ins.args(), self)
+            self.__wrote(table.table_name_)
+            count += len(ins.rows)
+            if objs is not None:
+                _collect_created(ins, cursor.lastrowid, objs, render, self, step, dialect.lastrowid_first)
+        return count if objs is None else objs
+
+    async def __auto_increment(self):
+        """自增步长(auto_increment_increment),每个会话查询一次"""
+        if self.__id_step is None:
+            sql = get_dialect(self.dialect).auto_increment_sql
+            if sql is None:
+                self.__id_step = 1
+            else:
+                cursor = await self.__get_cursor()
+                await run_async(self._events, cursor, sql, (), self)
+                row = await cursor.fetchone()
+                self.__id_step = int(row[0]) if row and row[0] else 1
+        return self.__id_step
+
+    async def upsert_many(self, table, rows, update_columns=None, batch_size=1000, conflict=None, max_packet=None,
+                          dialect=None):
+        """
+        批量插入,冲突时更新,参数同DBSession.upsert_many
+        """
+        max_packet = self.max_packet if max_packet is None else max_packet
+        dialect = get_dialect(dialect or self.dialect)
+        count = 0
+        cursor = await self.__get_cursor()
+        for ups in _upsert_batches(table, rows, update_columns, batch_size, max_packet, conflict, dialect):
+            await run_async(self._events, cursor, ups.sql(), ups.args(), self)
+            self.__wrote(table.table_name_)
+            count += max(cursor.rowcount, 0)
+        _evict_table(self._identity, table)
+        return count
+
+
+class AsyncDBQuery(DBQuery):
+    """
+    asyncio数据库查询,查询条件的构造与DBQuery相同
+    """
+
+    def __init__(self, session, table, *columns):
+        DBQuery.__init__(self, session, table, *columns)
+        self.__sess = session
+
+    async def __query(self, rows=True):
+        plan = self._in_plan()
+        if plan is not None:
+            return await self.__query_in(plan, rows)
+        sql, args = self._statement()
+        key, data = self._cache_get(sql, args, rows)
+        if data is not None:
+            return data[0]
+        data = await (self.__sess.query(sql, args) if rows else self.__sess.one(sql, args))
+        self._cache_set(key, data, rows)
+        return data
+
+    async def __query_in(self, plan, rows):
+        """
+        执行包含超大IN条件的查询,按IN条件拆分后合并结果;
+            不支持临时表,不能拆分时执行未拆分的原查询
+        """
+        split = self._split_in(plan, rows)
+        if split is None:
+            if self.in_temp_threshold is not None:
+                raise TypeError("temporary table for IN values is not supported in async query")
+            sql, args = self._statement()
+            return await (self.__sess.query(sql, args) if rows else self.__sess.one(sql, args))
+        queries, key, rng = split
+        results = []
+        count = 0
+        for q in queries:
+            data = await self.__sess.query(*q._statement())
+            results.append(data)
+            count += len(data)
+            if key is None and rng is not None and count >= rng[0] + rng[1]:
+                break
+        merged = self._merge(results, key, rng)
+        return list(merged) if rows else next(merged, None)
+
+    async def __load_related(self, rows):
+        for rel, parents in self._prefetch_parents(rows):
+            groups, children, queries = related_queries(rel, parents, self.__sess)
+            render = None
+            for q in queries:
+                if render is None:
+                    render = row_factory(rel.target, self.__sess, q.load_columns(rel.target))
+                for row in await self.__sess.query(q.sql(), q.args()):
+                    child = render(row)
+                    children.setdefault(getattr(child, rel.remote.name), []).append(child)
+            attach_related(rel, groups, children)
+        return rows
+
+    async def all(self):
+        rows = await self.__query()
+        return await self.__load_related([self._render(row) for row in rows])
+
+    async def one(self):
+        obj = self._identity_lookup()
+        if obj is None:
+            row = await self.__query(False)
+            if not row:
+                return None
+            obj = self._render(row)
+        await self.__load_related([obj])
+        return obj
+
+    async def scalar(self):
+        r = await self.one()
+        if not r:
+            return -1
+        return r[0]
+
+    async def count(self):
+        row = await self.__sess.one(*self._select().count_statement())
+        return row[0] if row else 0
+
+    async def exists(self):
+        row = await self.__sess.one(*self._select().exists_statement())
+        return bool(row and row[0])
+
+    async def aggregate(self, *fields):
+        row = await self.__sess.one(*self._select().aggregate_statement(*fields))
+        if row is None:
+            return None if len(fields) == 1 else (None,) * len(fields)
+        return row[0] if len(fields) == 1 else tuple(row)
+
+    async def explain(self):
+        sql, args = self._statement()
+        plan = await self.__sess.explain(sql, args)
+        return plan.advise(self._select())
+
+    async def update(self, values):
+        if not values:
+            raise ValueError("no column to update")
+        return await self.__sess.execute_bulk(self._bulk_statement(values))
+
+    async def delete(self):
+        return await self.__sess.execute_bulk(self._bulk_statement())
+
+    async def delete_in_batches(self, batch_size=1000, commit=True, pause=0):
+        q = self._batch_delete_query(batch_size)
+        total = 0
+        while True:
+            count = await q.delete()
+            total += count
+            if commit and self.__sess.in_transaction:
+                await self.__sess.commit()
+            if count < batch_size:
+                return total
+            if pause:
+                await asyncio.sleep(pause)
+
+    def prepare(self, server_side=True):
+        """
+        编译为预处理查询
+        :return: AsyncPreparedQuery
+        """
+        sql, args = self._statement()
+        return AsyncPreparedQuery(self.__sess, sql, args, self._render, server_side)
+
+    async def iter(self, batch_size=1000):
+        """
+        流式查询: async for row in query.iter()
+        :param batch_size: 每批读取的行数
+        """
+        pages = self._prefetch_pages(batch_size)
+        if pages is not None:
+            # 流式游标未读完时不能查询关联的行,同DBQuery.iter
+            if isinstance(pages, list):
+                for obj in await pages[0]:
+                    yield obj
+                return
+            async for page in pages:
+                for obj in page:
+                    yield obj
+            return
+        sql, args = self._statement()
+        async for rows in self.__sess.iter_batches(sql, args, batch_size):
+            for row in rows:
+                yield self._render(row)
+
+    async def to_columns(self, batch_size=10000, numpy=None):
+        """
+        按列读取查询结果,同DBQuery.to_columns
+        """
+        sql, args = self._statement()
+        builder = ColumnsBuilder(self._column_names(), numpy)
+        async for rows in self.__sess.iter_batches(sql, args, batch_size):
+            builder.extend(rows)
+        return builder.build()
+
+    async def to_dataframe(self, batch_size=10000):
+        import pandas
+        return pandas.DataFrame(await self.to_columns(batch_size))
+
+    async def page_after(self, last=None, size=1000, key=None):
+        """
+        keyset分页,同DBQuery.page_after
+        """
+        return await self._page_query(last, size, key=key).all()
+
+    async def iter_pages(self, order_by=None, size=1000):
+        """
+        keyset分页: async for page in query.iter_pages()
+        """
+        base, ordering = self._pages_base(order_by)
+        last = None
+        while True:
+            page = await base._page_query(last, size, ordering).all()
+            if page:
+                yield page
+            if len(page) < size:
+                break
+            last = page[-1]
+
+
+class AsyncSessionManager(object):
+    """
+    asyncio数据对象操作会话
+    """
+    logger = logging.getLogger("AsyncSessionManager")
+
+    def __init__(self, conn, stream_cursor=None, identity_map=False, events=None, cache_key=None):
+        self.session = AsyncDBSession(conn, stream_cursor=stream_cursor, identity_map=identity_map, events=events,
+                                      cache_key=cache_key)
+
+    def listen(self, name, fn):
+        return self.session.listen(name, fn)
+
+    async def begin(self):
+        await self.session.begin()
+
+    async def __aenter__(self):
+        await self.session.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.session.__aexit__(exc_type, exc_val, exc_tb)
+
+    def query(self, table, *cols):
+        return AsyncDBQuery(self.session, table, *cols)
+
+    def prepare(self, statement, server_side=True):
+        """
+        编译预处理语句
+        :param statement: AsyncDBQuery或Update/Insert等语句
+        :return: AsyncPreparedQuery|AsyncPreparedStatement
+        """
+        if isinstance(statement, AsyncDBQuery):
+            return statement.prepare(server_side)
+        return AsyncPreparedStatement(self.session, statement.sql(), statement.args(), server_side)
+
+    async def commit(self):
+        return await self.session.commit()
+
+    async def create(self, table, **kwargs):
+        return await self.session.create(table, **kwargs)
+
+    async def get(self, table, pk):
+        return await self.session.get(table, pk)
+
+    async def get_many(self, table, pks):
+        return await self.session.get_many(table, pks)
+
+    async def create_many(self, table, rows, batch_size=1000, return_ids=False, render=True, max_packet=None):
+        return await self.session.create_many(table, rows, batch_size, return_ids, render, max_packet)
+
+    async def upsert_many(self, table, rows, update_columns=None, batch_size=1000, conflict=None, max_packet=None):
+        return await self.session.upsert_many(table, rows, update_columns, batch_size, conflict, max_packet)
+
+
+if asynccontextmanager is not None:
+    @asynccontextmanager
+    async def async_db_ctx(connect, begin=False):
+        """
+        asyncio数据库会话上下文
+        :param connect: 创建数据库连接的协程函数,或AsyncConnectionPool
+        :param begin: 是否开启事务
+        """
+        pooled = isinstance(connect, AsyncConnectionPool)
+        conn = await (connect.acquire() if pooled else connect())
+        manager = AsyncSessionManager(conn, cache_key=connect.cache_key if pooled else None)
+        try:
+            if begin:
+                await manager.begin()
+            yield await manager.__aenter__()
+            await manager.__aexit__(None, None, None)
+        except Exception as e:
+            logging.exception("async_db_ctx exception %s", e.__class__.__name__)
+            et, ev, tb = sys.exc_info()
+            await manager.__aexit__(et, ev, tb)
+            raise e
+        finally:
+            if pooled:
+                await connect.release(conn)
+            else:
+                await _maybe_await(conn.close())
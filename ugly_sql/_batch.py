@@ -0,0 +1,102 @@
+# coding:utf-8
+from collections import OrderedDict
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+
+class BatchResult(object):
+    """
+    合并查询中一条查询的结果,QueryBatch.execute()后可用
+    """
+    __slots__ = ('query', 'kind', '_value', '_done')
+
+    def __init__(self, query, kind):
+        self.query = query
+        self.kind = kind
+        self._value = None
+        self._done = False
+
+    @property
+    def value(self):
+        if not self._done:
+            raise RuntimeError("batch is not executed")
+        return self._value
+
+    def _set(self, value):
+        self._value = value
+        self._done = True
+
+
+class QueryBatch(object):
+    """
+    合并查询:多条相互独立的DBQuery在一次网络往返中执行(连接允许多语句时),结果与DBQuery的对应方法相同
+        with db.batch() as b:
+            users = b.all(db.query(User).filter(User.age > 18))
+            total = b.count(db.query(Order))
+        users.value, total.value
+    """
+
+    def __init__(self, session):
+        """
+        :param session: DBSession
+        """
+        self.session = session
+        self.__items = []
+
+    def all(self, query):
+        """
+        :return: BatchResult, value为行对象列表
+        """
+        return self.__add(query, 'all')
+
+    def one(self, query):
+        """
+        :return: BatchResult, value为行对象|None
+        """
+        return self.__add(query, 'one')
+
+    def count(self, query):
+        return self.__add(query, 'count')
+
+    def exists(self, query):
+        return self.__add(query, 'exists')
+
+    def __add(self, query, kind):
+        result = BatchResult(query, kind)
+        self.__items.append(result)
+        return result
+
+    def execute(self):
+        """
+        执行所有查询,同一读目标(DBQuery.using)的查询合并执行;
+            不能合并的查询(超大IN条件/其他会话的查询等)单独执行
+        :return: 各查询的结果列表
+        """
+        items, self.__items = self.__items, []
+        groups = OrderedDict()
+        for item in items:
+            q = item.query
+            stmt = q._batch_statement(item.kind, self.session)
+            if stmt is None:
+                value = getattr(q, item.kind)()
+                item._set(list(value) if item.kind == 'all' else value)
+                continue
+            sql, args = stmt
+            key, data = q._cache_get(sql, args) if item.kind in ('all', 'one') else (None, None)
+            if data is not None:
+                item._set(q._batch_result(item.kind, data[0]))
+                continue
+            groups.setdefault(q._read_target(), []).append((item, key, sql, args))
+        for target, group in groups.items():
+            results = self.session.query_many([(sql, args) for _, _, sql, args in group], target)
+            for (item, key, _, _), rows in zip(group, results):
+                item.query._cache_set(key, rows)
+                item._set(item.query._batch_result(item.kind, rows))
+        return [item.value for item in items]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.execute()
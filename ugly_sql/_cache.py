@@ -0,0 +1,171 @@
+# coding:utf-8
+import itertools
+import re
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+_caches = weakref.WeakSet()
+_namespaces = itertools.count(1)
+_WRITE_TABLE = re.compile(r'^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+`?(\w+)`?',
+                          re.IGNORECASE)
+
+
+def invalidate_tables(*tables):
+    """
+    清除所有结果缓存中与表相关的数据
+    :param tables: 表名
+    """
+    if not tables:
+        return
+    for cache in list(_caches):
+        cache.invalidate(*tables)
+
+
+def new_namespace():
+    """
+    唯一的缓存命名空间:未指定cache_key的会话/连接池使用,不同命名空间的缓存结果互不可见
+    :return: str
+    """
+    return "ns{}".format(next(_namespaces))
+
+
+def written_table(sql):
+    """
+    解析写操作SQL语句的目标表
+    :param sql:
+    :return: 表名|None
+    """
+    m = _WRITE_TABLE.match(sql)
+    return m.group(1) if m else None
+
+
+def _sizeof(value, depth=3):
+    size = sys.getsizeof(value)
+    if depth and isinstance(value, (tuple, list)):
+        for v in value:
+            size += _sizeof(v, depth - 1)
+    return size
+
+
+class ResultCache(object):
+    """
+    查询结果缓存接口,创建后自动注册,数据库写操作时按表失效
+    """
+
+    def __init__(self):
+        _caches.add(self)
+
+    def get(self, key):
+        """
+        :param key: (命名空间, sql, args, 是否多行)
+        :return: 缓存的查询结果,未命中时返回None
+        """
+        raise NotImplementedError("'get' method not implemented")
+
+    def set(self, key, value, tables, ttl=None):
+        """
+        :param key: (命名空间, sql, args, 是否多行)
+        :param value: 查询结果
+        :param tables: 查询涉及的表名
+        :param ttl: 过期时间(秒),None不过期
+        """
+        raise NotImplementedError("'set' method not implemented")
+
+    def invalidate(self, *tables):
+        raise NotImplementedError("'invalidate' method not implemented")
+
+    def clear(self):
+        raise NotImplementedError("'clear' method not implemented")
+
+    def stats(self):
+        return {}
+
+
+class LRUResultCache(ResultCache):
+    """
+    进程内LRU结果缓存,按条目数和估算的内存大小限制
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        ResultCache.__init__(self)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.bytes = 0
+        self.__data = OrderedDict()
+        self.__tables = {}
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        with self.__lock:
+            item = self.__data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, tables, expire, size = item
+            if expire is not None and expire < time.time():
+                self.__remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.__data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tables, ttl=None):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        expire = None if ttl is None else time.time() + ttl
+        tables = tuple(tables)
+        with self.__lock:
+            if key in self.__data:
+                self.__remove(key)
+            self.__data[key] = (value, tables, expire, size)
+            self.bytes += size
+            for t in tables:
+                self.__tables.setdefault(t, set()).add(key)
+            while self.__data and (len(self.__data) > self.max_entries or self.bytes > self.max_bytes):
+                self.__remove(next(iter(self.__data)))
+                self.evictions += 1
+
+    def __remove(self, key):
+        """调用时需持有锁"""
+        value, tables, expire, size = self.__data.pop(key)
+        self.bytes -= size
+        for t in tables:
+            keys = self.__tables.get(t)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.__tables[t]
+
+    def invalidate(self, *tables):
+        with self.__lock:
+            for t in tables:
+                for key in list(self.__tables.get(t, ())):
+                    self.__remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+            self.__tables.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, expirations=self.expirations,
+                    invalidations=self.invalidations, size=len(self.__data), bytes=self.bytes,
+                    max_entries=self.max_entries, max_bytes=self.max_bytes)
+
+
+result_cache = LRUResultCache()
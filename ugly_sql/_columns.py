@@ -0,0 +1,168 @@
+# coding:utf-8
+"""按列读取查询结果"""
+from array import array
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+_ALIASES = {'int': 'q', 'int64': 'q', 'i8': 'q', 'int32': 'l' if array('l').itemsize == 4 else 'i', 'i4': 'i',
+            'float': 'd', 'float64': 'd', 'f8': 'd', 'float32': 'f', 'f4': 'f', 'object': None, 'O': None}
+
+
+def typecode(dtype):
+    """
+    将字段类型转换为array的typecode
+    :param dtype: array typecode / numpy dtype / int,float,object
+    :return: typecode, None表示使用list保存
+    """
+    if dtype is None or dtype is object:
+        return None
+    if dtype is int:
+        return 'q'
+    if dtype is float:
+        return 'd'
+    if isinstance(dtype, str) and len(dtype) == 1 and dtype in 'bBhHiIlLqQfd':
+        return dtype
+    if dtype in _ALIASES:
+        return _ALIASES[dtype]
+    if numpy is not None:
+        char = numpy.dtype(dtype).char
+        return char if char in 'bBhHiIlLqQfd' else None
+    raise ValueError("unsupported dtype {!r}".format(dtype))
+
+
+def _infer(values):
+    for v in values:
+        if v is None:
+            continue
+        if type(v) is int:
+            return 'q'
+        if type(v) is float:
+            return 'd'
+        return None
+    return False
+
+
+class ColumnBuilder(object):
+    """
+    逐批追加数据的列,数值列保存在array中,其他保存在list中
+    """
+    __slots__ = ('name', 'code', 'data')
+
+    def __init__(self, name, dtype=False):
+        """
+        :param dtype: 字段类型,False表示根据数据推断
+        """
+        self.name = name
+        self.code = False if dtype is False else typecode(dtype)
+        self.data = None
+
+    def extend(self, values):
+        if self.data is None:
+            if self.code is False:
+                code = _infer(values)
+                if code is False:
+                    # 本批数据全部为NULL,暂不确定类型
+                    self.data = list(values)
+                    return
+                self.code = code
+            self.data = [] if self.code is None else array(self.code)
+        elif self.code is False:
+            # 之前的数据全部为NULL
+            self.code = None
+        if self.code is None or isinstance(self.data, list):
+            self.data.extend(values)
+            return
+        size = len(self.data)
+        try:
+            self.data.extend(values)
+        except (TypeError, OverflowError):
+            # NULL或类型不一致时改用list保存;array.extend出错前可能已追加部分数据
+            del self.data[size:]
+            data = self.data.tolist()
+            data.extend(values)
+            self.data = data
+            self.code = None
+
+    def build(self, use_numpy):
+        data = self.data if self.data is not None else []
+        if not use_numpy:
+            return data
+        if isinstance(data, array):
+            return numpy.frombuffer(data, dtype=data.typecode) if len(data) else numpy.array([], dtype=data.typecode)
+        return numpy.array(data, dtype=object)
+
+
+def column_names(columns, load_columns=None):
+    """
+    查询字段对应的列名,重名时使用"表名.字段名"
+    :param columns: DBQuery的查询字段
+    :param load_columns: 表查询的字段load_columns(table),默认为全部字段
+    :return: [(列名, dtype), ...]
+    """
+    from ._db import Table
+    items = []
+    for c in columns:
+        if isinstance(c, Table):
+            names = load_columns(c) if load_columns else c.table_columns_()
+            items.extend((c.table_name_, name, c.dtypes.get(name, False)) for name in names)
+        else:
+            items.append((c.table, c.name, False, c))
+    counts = {}
+    for it in items:
+        counts[it[1]] = counts.get(it[1], 0) + 1
+    names = []
+    seen = set()
+    for it in items:
+        name = it[1] if counts[it[1]] == 1 else "{}.{}".format(it[0], it[1])
+        if name in seen:
+            name = it[3].sql() if len(it) > 3 else name
+        seen.add(name)
+        names.append((name, it[2]))
+    return names
+
+
+def to_columns(batches, names, use_numpy=None):
+    """
+    :param batches: fetchmany的结果
+    :param names: [(列名, dtype), ...]
+    :param use_numpy: 返回numpy数组,None为numpy可用时使用
+    :return: OrderedDict 列名 -> 数组
+    """
+    builder = ColumnsBuilder(names, use_numpy)
+    for rows in batches:
+        builder.extend(rows)
+    return builder.build()
+
+
+class ColumnsBuilder(object):
+    """
+    逐批写入结果行,按列生成数组
+    """
+
+    def __init__(self, names, use_numpy=None):
+        """
+        :param names: [(列名, dtype), ...]
+        :param use_numpy: 返回numpy数组,None为numpy可用时使用
+        """
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        elif use_numpy and numpy is None:
+            raise ImportError("numpy is required")
+        self.use_numpy = use_numpy
+        self.builders = [ColumnBuilder(name, dtype) for name, dtype in names]
+
+    def extend(self, rows):
+        for builder, values in zip(self.builders, zip(*rows)):
+            builder.extend(values)
+
+    def build(self):
+        """
+        :return: OrderedDict 列名 -> 数组
+        """
+        return OrderedDict((b.name, b.build(self.use_numpy)) for b in self.builders)
@@ -2,6 +2,8 @@
 import logging
 
 from ._dao_impl import DBQuery
+from ._prepared import PreparedStatement
+from ._replica import ReplicaSet
 from ._session import DBSession
 
 __author__ = 'Memory_Leak<irealing@163.com>'
@@ -13,8 +15,36 @@ class SessionManager(object):
     """
     logger = logging.getLogger("SessionManager")
 
-    def __init__(self, conn):
-        self.session = DBSession(conn)
+    def __init__(self, conn, stream_cursor=None, identity_map=False, events=None, replicas=None,
+                 replica_policy=ReplicaSet.ROUND_ROBIN, dialect=None, cache_key=None):
+        """
+        :param conn: 数据库连接(主库)
+        :param replicas: 创建从库连接的函数列表(或ReplicaSet),查询在事务外且会话未写入时使用从库;
+            传入的ReplicaSet可在多个会话间共享,退出会话时不关闭
+        :param replica_policy: 选择从库的策略,round_robin|least_latency
+        :param dialect: SQL方言(mysql|sqlite),默认为mysql
+        :param cache_key: 查询结果缓存的命名空间(如DSN),默认每个会话独立
+        """
+        self.session = DBSession(conn, stream_cursor=stream_cursor, identity_map=identity_map, events=events,
+                                 replicas=replicas, dialect=dialect, cache_key=cache_key,
+                                 replica_policy=replica_policy)
+
+    def listen(self, name, fn):
+        return self.session.listen(name, fn)
+
+    def batch(self):
+        """
+        合并查询:
+            with db.batch() as b:
+                users = b.all(db.query(User).filter(User.age > 18))
+                total = b.count(db.query(Order))
+            users.value, total.value
+        :return: QueryBatch
+        """
+        return self.session.batch()
+
+    def explain_slow(self, threshold=1.0, sample_rate=1.0, callback=None, interval=60):
+        return self.session.explain_slow(threshold, sample_rate, callback, interval)
 
     def begin(self):
         self.session.begin()
@@ -34,3 +64,26 @@ class SessionManager(object):
 
     def create(self, table, **kwargs):
         return self.session.create(table, **kwargs)
+
+    def prepare(self, statement, server_side=True):
+        """
+        编译预处理语句
+        :param statement: DBQuery或Update/Insert等语句
+        :param server_side: 驱动支持时使用服务端预处理语句
+        :return: PreparedQuery|PreparedStatement
+        """
+        if isinstance(statement, DBQuery):
+            return statement.prepare(server_side)
+        return PreparedStatement(self.session, statement.sql(), statement.args(), server_side)
+
+    def get(self, table, pk):
+        return self.session.get(table, pk)
+
+    def get_many(self, table, pks):
+        return self.session.get_many(table, pks)
+
+    def create_many(self, table, rows, batch_size=1000, return_ids=False, render=True, max_packet=None):
+        return self.session.create_many(table, rows, batch_size, return_ids, render, max_packet)
+
+    def upsert_many(self, table, rows, update_columns=None, batch_size=1000, conflict=None, max_packet=None):
+        return self.session.upsert_many(table, rows, update_columns, batch_size, conflict, max_packet)
@@ -1,17 +1,51 @@
 # coding:utf-8
+import heapq
+import itertools
 import logging
+import operator
+import time
+from collections import OrderedDict
 
-from ._db import Query, Table, GroupBy
-from ._util import DBObjProxy
+from ._cache import result_cache
+from ._columns import column_names, to_columns
+from ._db import Query, Table, GroupBy, Field, InFilter, BindParam, SQLFragment, Update, Delete, seek_filter
+from ._prepared import PreparedQuery
+from ._util import row_factory, load_related
 
 __author__ = 'Memory_Leak<irealing@163.com>'
 
 
+class _SortKey(object):
+    """按order_by比较结果行,NULL排在最前(与MySQL一致)"""
+    __slots__ = ('values', 'desc')
+
+    def __init__(self, values, desc):
+        self.values = values
+        self.desc = desc
+
+    def __lt__(self, other):
+        for a, b, desc in zip(self.values, other.values, self.desc):
+            if a == b:
+                continue
+            if a is None:
+                lt = True
+            elif b is None:
+                lt = False
+            else:
+                lt = a < b
+            return lt != desc
+        return False
+
+
 class DBQuery:
     """
     数据库查询
     """
     logger = logging.getLogger(__name__)
+    # IN条件的取值超过in_chunk_size时拆分为多次查询;
+    # 设置in_temp_threshold后,超过此数量或拆分后不能合并时改用临时表,否则不拆分(需CREATE TEMPORARY TABLES权限)
+    in_chunk_size = 2000
+    in_temp_threshold = None
 
     def __init__(self, session, table, *columns):
         """
@@ -25,9 +59,13 @@ class DBQuery:
         self.__sess = session
         self.__sql_query = Query(table, *columns)
         self.__mapping, self.__index = self.__obj_mapping(columns)
+        self.__render = self.__row_factory()
+        self.__cache = None
+        self.__ttl = None
+        self.__target = None
+        self.__prefetch = ()
 
-    @staticmethod
-    def __obj_mapping(cols):
+    def __obj_mapping(self, cols):
         """
         对象映射关系
         :param cols:
@@ -42,8 +80,9 @@ class DBQuery:
             i += 1
             if isinstance(c, Table):
                 index.append(cursor)
-                mapping.append((c, cursor, cursor + c.col_size()))
-                cursor += c.col_size()
+                size = len(self.__sql_query.load_columns(c))
+                mapping.append((c, cursor, cursor + size))
+                cursor += size
             else:
                 cursor += 1
         return mapping, index
@@ -52,6 +91,42 @@ class DBQuery:
         self.__sql_query.filter(*fs)
         return self
 
+    def undefer(self, *cols):
+        """
+        同时查询延迟加载的字段
+        :param cols: Field
+        :return:
+        """
+        for col in cols:
+            table = self.__table_of(col)
+            loaded = self.__sql_query.load_columns(table)
+            self.__sql_query.load(table, loaded + (col.name,))
+        return self.__refresh()
+
+    def only(self, *cols):
+        """
+        只查询指定的字段(和主键),其他字段首次访问时批量加载
+        :param cols: Field
+        :return:
+        """
+        names = {}
+        for col in cols:
+            names.setdefault(self.__table_of(col), []).append(col.name)
+        for table, ns in names.items():
+            self.__sql_query.load(table, ns)
+        return self.__refresh()
+
+    def __table_of(self, col):
+        for c in self.__columns:
+            if isinstance(c, Table) and c.table_name_ == col.table and col.name in c.fields:
+                return c
+        raise ValueError("table of column {} not selected".format(col.sql()))
+
+    def __refresh(self):
+        self.__mapping, self.__index = self.__obj_mapping(self.__columns)
+        self.__render = self.__row_factory()
+        return self
+
     def join(self, table, on):
         """
         INNER JOIN
@@ -86,56 +161,812 @@ class DBQuery:
         self.__sql_query.limit(limit, offset)
         return self
 
+    def cached(self, ttl=None, cache=None):
+        """
+        缓存查询结果(all/one),涉及的表发生写操作时自动失效
+        :param ttl: 过期时间(秒),None不过期
+        :param cache: 缓存后端(ResultCache),默认使用进程内LRU缓存
+        :return:
+        """
+        self.__cache = result_cache if cache is None else cache
+        self.__ttl = ttl
+        return self
+
+    def using(self, target):
+        """
+        指定查询使用主库或从库(读写分离),未指定时由会话自动选择
+        :param target: "primary"|"replica"
+        :return:
+        """
+        assert target in ("primary", "replica", None)
+        self.__target = target
+        return self
+
+    def prefetch(self, *rels):
+        """
+        查询后批量加载关联的行(每个关联一次分批IN查询),避免逐行查询
+        :param rels: Relationship或关联名
+        :return:
+        """
+        table = self.__sql_query.from_
+        self.__prefetch += tuple(table.relations[r] if isinstance(r, str) else r for r in rels)
+        return self
+
+    def __load_related(self, rows):
+        """
+        为结果行加载prefetch的关联
+        :param rows: 渲染后的结果行
+        """
+        for rel, parents in self._prefetch_parents(rows):
+            load_related(rel, parents, self.__sess)
+        return rows
+
+    def _prefetch_parents(self, rows):
+        """
+        prefetch的关联及需要加载该关联的行对象
+        :param rows: 渲染后的结果行
+        :return: [(Relationship, [行对象])]
+        """
+        cols = self.__columns
+        single = len(cols) == 1 and isinstance(cols[0], Table)
+        result = []
+        for rel in self.__prefetch:
+            if single:
+                parents = rows
+            else:
+                idx = [i for i, c in enumerate(cols) if isinstance(c, Table) and c is rel.table]
+                if not idx:
+                    raise ValueError("table of relationship {} not selected".format(rel.name))
+                parents = [r[idx[0]] for r in rows]
+            result.append((rel, [p for p in parents if p is not None]))
+        return result
+
+    def chunk_in(self, size, temp_threshold=None):
+        """
+        设置超大IN条件的处理方式
+        :param size: 每次查询的最大IN取值个数,None不拆分
+        :param temp_threshold: 超过此数量时写入临时表后以子查询代替IN列表,None不使用临时表
+        :return:
+        """
+        self.in_chunk_size = size
+        self.in_temp_threshold = temp_threshold
+        return self
+
+    def _prefetch_pages(self, batch_size):
+        """
+        使用prefetch时iter()逐页完整读取的结果:有LIMIT时一次读取全部,否则按keyset分页
+        :param batch_size: 每页行数
+        :return: iterable of pages|None(未使用prefetch)
+        """
+        if not self.__prefetch:
+            return None
+        if self.__sql_query.limit_range():
+            return [self.all()]
+        return self.iter_pages(size=batch_size)
+
+    def _in_plan(self):
+        """
+        查找需要拆分的IN条件(只处理顶层AND条件中取值最多的一个)
+        :return: (InFilter, 去重后的取值, 是否需要临时表)|None
+        """
+        size = self.in_chunk_size
+        if not size:
+            return None
+        candidates = [f for f in self.__sql_query.filters if type(f) is InFilter and
+                      not isinstance(f.value, (BindParam, SQLFragment)) and len(f.value) > size]
+        if not candidates:
+            return None
+        f = max(candidates, key=lambda c: len(c.value))
+        values = list(OrderedDict.fromkeys(f.value))
+        threshold = self.in_temp_threshold
+        # 聚合/DISTINCT查询拆分后结果不正确,只能使用临时表(LIMIT由合并结果时处理)
+        temp = not self.__sql_query.splittable(True) or (threshold is not None and len(values) > threshold)
+        return f, values, temp
+
+    def __via_temp(self, plan, execute):
+        """
+        以临时表代替IN列表执行;未启用临时表(in_temp_threshold为None)时执行未拆分的原查询
+        :param plan: _in_plan()
+        :param execute: function(DBQuery, target)
+        """
+        f, values, _ = plan
+        if self.in_temp_threshold is None:
+            return execute(self, self.__target)
+        with self.__sess.temp_values(f.column, values) as sub:
+            return execute(self.__replaced(f, sub), "primary")
+
+    def __replaced(self, f, value):
+        """
+        复制查询并替换IN条件的取值
+        :param f: InFilter
+        :param value: 取值列表或子查询
+        :return: DBQuery
+        """
+        q = self.copy()
+        q.__sql_query.filters = [InFilter(f.column, value) if c is f else c for c in q.__sql_query.filters]
+        return q
+
+    def __chunks(self, values):
+        size = self.in_chunk_size
+        for i in range(0, len(values), size):
+            yield values[i:i + size]
+
+    def __raw_key(self, ordering):
+        """
+        从查询结果(未转换的行)中取出排序字段值的函数
+        :return: function(row)|None,排序字段未被查询时返回None
+        """
+        index = {}
+        pos = 0
+        for c in self.__columns:
+            if isinstance(c, Table):
+                for name in self.__sql_query.load_columns(c):
+                    index.setdefault((c.table_name_, name), pos)
+                    pos += 1
+                continue
+            if type(c) is Field:
+                index.setdefault((c.table, c.name), pos)
+            pos += 1
+        try:
+            idx = tuple(index[(f.table, f.name)] for f, _ in ordering if type(f) is Field)
+        except KeyError:
+            return None
+        if len(idx) != len(ordering):
+            return None
+        return lambda row: tuple(row[i] for i in idx)
+
+    def _merge(self, results, row_key, limit_range):
+        """
+        合并多次查询的结果:有order_by时k路归并,有LIMIT时取到足够的行即停止
+        :param results: 各次查询的结果(已排序)
+        :param row_key: 取出行的排序字段值的函数
+        :param limit_range: (offset, limit)|None
+        :return: iterator
+        """
+        ordering = self.__sql_query.ordering()
+        if len(results) == 1:
+            merged = iter(results[0])
+        elif ordering:
+            desc = tuple(d for _, d in ordering)
+            merged = heapq.merge(*results, key=lambda row: _SortKey(row_key(row), desc))
+        else:
+            merged = itertools.chain(*results)
+        if limit_range is not None:
+            merged = itertools.islice(merged, limit_range[0], limit_range[0] + limit_range[1])
+        return merged
+
+    def __query_in(self, plan, rows):
+        """
+        执行包含超大IN条件的查询
+        :param plan: _in_plan()
+        :param rows: 多行返回
+        """
+        sess = self.__sess
+        split = self._split_in(plan, rows)
+        if split is None:
+            def execute(q, target):
+                sql, args = q._statement()
+                return sess.query(sql, args, target) if rows else sess.one(sql, args, target)
+
+            return self.__via_temp(plan, execute)
+        queries, key, rng = split
+        results = []
+        count = 0
+        for q in queries:
+            sql, args = q._statement()
+            data = sess.query(sql, args, self.__target)
+            results.append(data)
+            count += len(data)
+            if key is None and rng is not None and count >= rng[0] + rng[1]:
+                break
+        merged = self._merge(results, key, rng)
+        return list(merged) if rows else next(merged, None)
+
+    def _split_in(self, plan, rows):
+        """
+        按IN条件拆分查询,各部分的结果由_merge合并
+        :param plan: _in_plan()
+        :param rows: 多行返回
+        :return: (拆分后的查询generator, 合并时的排序键, LIMIT范围),需要临时表时返回None
+        """
+        f, values, temp = plan
+        ordering = self.__sql_query.ordering()
+        key = self.__raw_key(ordering) if ordering else None
+        if temp or (ordering and key is None):
+            return None
+        rng = self.__sql_query.limit_range()
+        if rng is None and not rows:
+            rng = (0, 1)
+        return self.__split_queries(f, values, rng), key, rng
+
+    def __split_queries(self, f, values, rng):
+        for chunk in self.__chunks(values):
+            q = self.__replaced(f, chunk)
+            if rng is not None:
+                q.__sql_query.limit(rng[0] + rng[1])
+            yield q
+
+    def __batches(self, batch_size):
+        """
+        流式查询,逐批返回未转换的结果行
+        :param batch_size: 每批读取的行数
+        :return: generator of list
+        """
+        sess = self.__sess
+        plan = self._in_plan()
+        if plan is None:
+            sql, args = self._statement()
+            for rows in sess.iter_batches(sql, args, batch_size, self.__target):
+                yield rows
+            return
+        f, values, temp = plan
+        if temp or self.__sql_query.ordering() or self.__sql_query.limit_range():
+            # 同一连接不能同时打开多个流式游标,需要排序时使用临时表
+            if self.in_temp_threshold is None:
+                sql, args = self._statement()
+                for rows in sess.iter_batches(sql, args, batch_size, self.__target):
+                    yield rows
+                return
+            with sess.temp_values(f.column, values) as sub:
+                sql, args = self.__replaced(f, sub)._statement()
+                for rows in sess.iter_batches(sql, args, batch_size, "primary"):
+                    yield rows
+            return
+        for chunk in self.__chunks(values):
+            sql, args = self.__replaced(f, chunk)._statement()
+            for rows in sess.iter_batches(sql, args, batch_size, self.__target):
+                yield rows
+
     def all(self):
+        if self.__prefetch:
+            return self.__load_related([self.__render(row) for row in self.__query()])
         return map(self.__render, self.__query())
 
+    def iter(self, batch_size=1000):
+        """
+        流式查询,内存占用与batch_size成正比
+            使用prefetch时流式游标未读完不能在同一连接上查询关联的行,
+            改为按keyset分页(iter_pages)逐页完整读取后加载关联
+        :param batch_size: 每批读取的行数
+        :return: generator
+        """
+        pages = self._prefetch_pages(batch_size)
+        if pages is not None:
+            for page in pages:
+                for obj in page:
+                    yield obj
+            return
+        render = self.__render
+        for rows in self.__batches(batch_size):
+            for obj in map(render, rows):
+                yield obj
+
+    def to_columns(self, batch_size=10000, numpy=None):
+        """
+        按列读取查询结果,不生成行对象
+            数值列为numpy数组(或array.array),其他为object数组(或list);字段类型可在Table(dtypes=...)中指定
+        :param batch_size: 每批读取的行数
+        :param numpy: 是否返回numpy数组,None为numpy可用时返回
+        :return: OrderedDict 列名 -> 数组
+        """
+        batches = self.__batches(batch_size)
+        return to_columns(batches, self._column_names(), numpy)
+
+    def _column_names(self):
+        """
+        to_columns的列名和类型
+        :return: [(列名, dtype), ...]
+        """
+        return column_names(self.__columns, self.__sql_query.load_columns)
+
+    def to_dataframe(self, batch_size=10000):
+        """
+        按列读取查询结果为pandas.DataFrame
+        :param batch_size: 每批读取的行数
+        """
+        import pandas
+        return pandas.DataFrame(self.to_columns(batch_size))
+
     def one(self):
+        obj = self._identity_lookup()
+        if obj is not None:
+            return self.__load_related([obj])[0] if self.__prefetch else obj
         row = self.__query(False)
         if not row:
             return None
-        return self.__render(row)
+        obj = self.__render(row)
+        if self.__prefetch:
+            self.__load_related([obj])
+        return obj
 
     def scalar(self):
         r = self.one()
         if not r:
             return -1
-        return self.one()[0]
+        return r[0]
+
+    def count(self):
+        """
+        服务端计数(SELECT COUNT(*)),只返回计数结果
+        :return: int
+        """
+        combine = (lambda rows: (sum(r[0] for r in rows),)) if self.__sql_query.splittable() else None
+        row = self.__aggregate_one(Query.count_statement, combine)
+        return row[0] if row else 0
+
+    def exists(self):
+        """
+        是否存在符合条件的行(SELECT EXISTS(... LIMIT 1))
+        :return: bool
+        """
+        combine = None if self.__sql_query.limit_range() else lambda rows: (any(r[0] for r in rows),)
+        row = self.__aggregate_one(Query.exists_statement, combine, lambda r: r and r[0])
+        return bool(row and row[0])
+
+    def aggregate(self, *fields):
+        """
+        服务端聚合,如aggregate(Function.sum(User.age), Function.max(User.age))
+        :param fields: 聚合函数字段
+        :return: 单个字段时返回值,多个字段时返回tuple
+        """
+        row = self.__aggregate_one(lambda q: q.aggregate_statement(*fields), None)
+        if row is None:
+            return None if len(fields) == 1 else (None,) * len(fields)
+        return row[0] if len(fields) == 1 else tuple(row)
+
+    def __aggregate_one(self, statement, combine, stop=None):
+        """
+        执行聚合语句,IN条件超大时拆分后合并(combine)或使用临时表
+        :param statement: function(Query) -> (sql, args)
+        :param combine: 合并各部分结果的函数,None时使用临时表
+        :param stop: 拆分执行时某部分的结果满足stop(row)即停止
+        :return: 结果行
+        """
+        sess = self.__sess
+        plan = self._in_plan()
+        if plan is None:
+            sql, args = statement(self.__sql_query)
+            return sess.one(sql, args, self.__target)
+        f, values, temp = plan
+        if temp or combine is None:
+            return self.__via_temp(plan, lambda q, target: sess.one(*statement(q.__sql_query), target=target))
+        rows = []
+        for chunk in self.__chunks(values):
+            sql, args = statement(self.__replaced(f, chunk).__sql_query)
+            rows.append(sess.one(sql, args, self.__target))
+            if stop is not None and stop(rows[-1]):
+                break
+        return combine(rows)
+
+    def update(self, values):
+        """
+        按查询条件批量更新(UPDATE ... WHERE [ORDER BY ... LIMIT]),不加载行对象
+        :param values: {字段或字段名: 值或表达式},如 {User.age: User.age + 1}
+        :return: 影响行数
+        """
+        if not values:
+            raise ValueError("no column to update")
+        return self.__bulk(values)
+
+    def delete(self):
+        """
+        按查询条件批量删除(DELETE ... WHERE [ORDER BY ... LIMIT])
+        :return: 删除的行数
+        """
+        return self.__bulk(None)
+
+    def delete_in_batches(self, batch_size=1000, commit=True, pause=0):
+        """
+        分批删除,每批一条DELETE ... LIMIT语句,避免大事务和长时间锁表
+            未指定order_by时按主键顺序删除
+        :param batch_size: 每批删除的行数
+        :param commit: 会话已开启事务时每批删除后提交
+        :param pause: 每批之间暂停的秒数
+        :return: 删除的总行数
+        """
+        q = self._batch_delete_query(batch_size)
+        sess = self.__sess
+        total = 0
+        while True:
+            count = q.delete()
+            total += count
+            if commit and sess.in_transaction:
+                sess.commit()
+            if count < batch_size:
+                return total
+            if pause:
+                time.sleep(pause)
+
+    def _batch_delete_query(self, batch_size):
+        """分批删除使用的查询:复制查询并设置排序和LIMIT"""
+        if self.__sql_query.limit_range():
+            raise ValueError("delete_in_batches does not support limit")
+        q = self.copy()
+        pk = q.__sql_query.from_.primary_key
+        if not q.__sql_query.ordering() and pk is not None:
+            q.__sql_query.order_by(pk.asc())
+        q.__sql_query.limit(batch_size)
+        return q
+
+    def _bulk_statement(self, values=None):
+        """
+        由查询条件生成批量语句
+        :param values: 更新的字段和值,None时生成DELETE语句
+        :return: Update|Delete
+        """
+        q = self.__sql_query
+        table = q.from_
+        dialect = self.__sess.dialect
+        if values is None:
+            return q.bulk(Delete(table, dialect))
+        stmt = Update(table, dialect)
+        for col, value in values.items():
+            if not isinstance(col, Field):
+                if col not in table.fields:
+                    raise ValueError("table {} has no column {}".format(table.table_name_, col))
+                col = table.fields[col]
+            stmt.set(col == value)
+        return q.bulk(stmt)
+
+    def __bulk(self, values):
+        """
+        执行批量UPDATE/DELETE,IN条件超大时拆分执行,有LIMIT时使用临时表
+        :return: 影响行数
+        """
+        sess = self.__sess
+        plan = self._in_plan()
+        if plan is None:
+            return sess.execute_bulk(self._bulk_statement(values))
+        f, keys, temp = plan
+        if temp or self.__sql_query.limit_range():
+            return self.__via_temp(plan, lambda q, _: sess.execute_bulk(q._bulk_statement(values)))
+        return sum(sess.execute_bulk(self.__replaced(f, chunk)._bulk_statement(values))
+                   for chunk in self.__chunks(keys))
 
     def __query(self, rows=True):
+        plan = self._in_plan()
+        if plan is not None:
+            return self.__query_in(plan, rows)
         sql = self.__sql_query.sql()
         args = self.__sql_query.args()
-        return self.__sess.query(sql, args) if rows else self.__sess.one(sql, args)
+        if self.__cache is None:
+            return self.__execute(sql, args, rows)
+        key, data = self._cache_get(sql, args, rows)
+        if data is not None:
+            return data[0]
+        data = self.__execute(sql, args, rows)
+        self._cache_set(key, data, rows)
+        return data
+
+    def __execute(self, sql, args, rows):
+        """执行查询,会话开启执行计划采样时记录耗时"""
+        sess = self.__sess
+        target = self.__target
+        sampler = sess.explain_sampler
+        if sampler is None:
+            return sess.query(sql, args, target) if rows else sess.one(sql, args, target)
+        start = time.perf_counter()
+        data = sess.query(sql, args, target) if rows else sess.one(sql, args, target)
+        sampler.observe(sess, self.__sql_query, sql, args, time.perf_counter() - start, target)
+        return data
 
-    def __render(self, row):
+    def explain(self):
         """
-        数据库查询结果生成对象
-            (如果有的话)
-        :param row:
-        :return:
+        查询的执行计划(EXPLAIN),并为全表扫描/filesort/未使用索引的表建议索引
+        :return: QueryPlan, plan.steps为执行计划各行, plan.indexes为建议的索引
+        """
+        sql, args = self._statement()
+        return self.__sess.explain(sql, args, self.__target).advise(self.__sql_query)
+
+    def _batch_statement(self, kind, session):
+        """
+        合并执行(QueryBatch)时的查询语句
+        :param kind: all|one|count|exists
+        :param session: 执行合并查询的会话
+        :return: (sql, args),不能合并执行(其他会话的查询/IN条件需拆分/会话中已存在)时返回None
+        """
+        if session is not self.__sess or self._in_plan() is not None:
+            return None
+        q = self.__sql_query
+        if kind == 'count':
+            return q.count_statement()
+        if kind == 'exists':
+            return q.exists_statement()
+        if kind == 'one':
+            if self._identity_lookup() is not None:
+                return None
+            if q.limit_range() is None:
+                q = q.copy().limit(1)
+        return q.sql(), q.args()
+
+    def _batch_result(self, kind, rows):
+        """
+        合并执行的结果转换为与all()/one()/count()/exists()相同的返回值
+        :param kind: all|one|count|exists
+        :param rows: 查询结果行
+        """
+        if kind == 'count':
+            return rows[0][0] if rows else 0
+        if kind == 'exists':
+            return bool(rows and rows[0][0])
+        if kind == 'one':
+            if not rows:
+                return None
+            obj = self.__render(rows[0])
+            if self.__prefetch:
+                self.__load_related([obj])
+            return obj
+        objs = [self.__render(row) for row in rows]
+        return self.__load_related(objs) if self.__prefetch else objs
+
+    def _read_target(self):
+        """读主库/从库(using)"""
+        return self.__target
+
+    def _cache_get(self, sql, args, rows=True):
+        """
+        查询缓存
+        :return: (key, (data,)|None), 未启用缓存、参数不可hash或会话中有未提交的写操作时key为None
+        """
+        if self.__cache is None or self.__uncommitted():
+            return None, None
+        key = (self.__sess.cache_key, sql, args, rows)
+        try:
+            hash(key)
+        except TypeError:
+            return None, None
+        return key, self.__cache.get(key)
+
+    def _cache_set(self, key, data, rows=True):
+        if key is None or self.__uncommitted():
+            return
+        if rows:
+            data = tuple(data)
+        self.__cache.set(key, (data,), self.__sql_query.tables(), self.__ttl)
+
+    def __uncommitted(self):
+        """
+        查询涉及的表在会话中有未提交的写操作:结果包含其他会话不可见的数据,不读写进程内共享的缓存
+        """
+        written = getattr(self.__sess, 'uncommitted_tables', None)
+        return bool(written) and not written.isdisjoint(self.__sql_query.tables())
+
+    def _statement(self):
+        """
+        编译后的查询语句
+        :return: (sql, args)
+        """
+        return self.__sql_query.sql(), self.__sql_query.args()
+
+    def prepare(self, server_side=True):
+        """
+        编译为预处理查询,查询条件中可使用bindparam("name")作为参数占位符
+            q = db.query(User).filter(User.name == bindparam("name")).prepare()
+            q.execute(name="root")
+        :param server_side: 驱动支持时使用服务端预处理语句
+        :return: PreparedQuery
+        """
+        sql, args = self._statement()
+        return PreparedQuery(self.__sess, sql, args, self.__render, server_side)
+
+    def _render(self, row):
+        return self.__render(row)
+
+    def _select(self):
+        """
+        查询语句对象
+        :return: Query
+        """
+        return self.__sql_query
+
+    def _bind(self, session):
+        """
+        复制查询并绑定到另一个会话,结果行的修改由该会话提交
+        :param session:
+        :return: DBQuery
+        """
+        q = DBQuery.__new__(DBQuery)
+        q.__dict__.update(self.__dict__)
+        q.__sql_query = self.__sql_query.copy()
+        q.__sess = session
+        q.__render = q.__row_factory()
+        q.__cache = None
+        return q
+
+    def _identity_lookup(self):
+        """
+        主键等值查询时从会话的identity map中获取行对象
+        :return: 行对象|None
+        """
+        identity = getattr(self.__sess, '_identity', None)
+        if not identity:
+            return None
+        key = self.__sql_query._identity_key()
+        return identity.get(key) if key is not None else None
+
+    def __row_factory(self):
+        """
+        根据字段映射关系预先生成结果行的转换函数
+        :return: function(row)
         """
         if not self.__mapping:
-            return row
+            return lambda row: row
         t, s, e = self.__mapping[0]
-        if s == 0 and e == len(row):
-            return DBObjProxy(t, dict(zip(t.table_columns_(), row)), self.__sess)
-        rdata = []
+        if len(self.__mapping) == 1 and s == 0 and len(self.__columns) == 1:
+            return row_factory(t, self.__sess, self.__sql_query.load_columns(t))
+        parts = []
         cursor = 0
         for i in range(len(self.__index)):
             idx = self.__index[i]
             if cursor < idx:
-                rdata.extend(row[cursor:idx])
+                parts.append((None, cursor, idx))
             t, s, e = self.__mapping[i]
-            r = DBObjProxy(t, dict(zip(t.table_columns_(), row[s:e])), self.__sess)
-            rdata.append(r)
+            parts.append((row_factory(t, self.__sess, self.__sql_query.load_columns(t)), s, e))
             cursor = e
-        if cursor < len(row):
-            rdata.extend(row[cursor:])
-        return rdata
+
+        def render(row):
+            rdata = []
+            for factory, start, end in parts:
+                if factory is None:
+                    rdata.extend(row[start:end])
+                else:
+                    rdata.append(factory(row[start:end]))
+            if cursor < len(row):
+                rdata.extend(row[cursor:])
+            return rdata
+
+        return render
 
     def order_by(self, *order):
         self.__sql_query.order_by(*order)
         return self
 
+    def copy(self):
+        """
+        复制查询,修改副本的条件不影响原查询
+        :return: DBQuery
+        """
+        q = self.__class__.__new__(self.__class__)
+        q.__dict__.update(self.__dict__)
+        q.__sql_query = self.__sql_query.copy()
+        return q
+
+    def _row_key(self, row, ordering):
+        """
+        从查询结果中取出排序字段的值
+        :param row: all()返回的行
+        :param ordering: [(Field, desc), ...]
+        :return: tuple
+        """
+        return tuple(get(row) for get in self.__order_getters(ordering))
+
+    def __order_getters(self, ordering):
+        """
+        从结果行中取排序字段值的函数
+        :param ordering: [(Field, desc), ...]
+        :return: [function(row)]
+        """
+        cols = self.__columns
+        single = len(cols) == 1 and isinstance(cols[0], Table)
+        getters = []
+        for field, _ in ordering:
+            if single:
+                getters.append(operator.attrgetter(field.name))
+                continue
+            for i, c in enumerate(cols):
+                if isinstance(c, Table):
+                    if c.table_name_ == field.table and field.name in c.fields:
+                        getters.append(lambda row, i=i, name=field.name: getattr(row[i], name))
+                        break
+                elif c.table == field.table and c.name == field.name and type(c) is type(field):
+                    getters.append(operator.itemgetter(i))
+                    break
+            else:
+                raise ValueError("order column {} not selected".format(field.sql()))
+        return getters
+
+    def page_after(self, last=None, size=1000, key=None):
+        """
+        keyset(seek)分页:按查询的order_by取出排在last之后的size行
+        :param last: 上一页的最后一行(all()返回的行),None为第一页
+        :param size: 每页行数
+        :param key: 代替last,排序字段的值(tuple,只有一个排序字段时可以为单个值)
+        :return: list
+        """
+        return list(self._page_query(last, size, key=key).all())
+
+    def _page_query(self, last, size, ordering=None, key=None):
+        """
+        排在last之后的一页数据的查询
+        :param last: 同page_after
+        :param size: 每页行数
+        :param ordering: [(Field, desc), ...],默认为查询的排序
+        :param key: 同page_after
+        :return: DBQuery
+        """
+        ordering = ordering or self.__sql_query.ordering()
+        if not ordering:
+            raise ValueError("page_after requires order_by")
+        if last is not None and key is not None:
+            raise ValueError("last and key are mutually exclusive")
+        if last is not None:
+            if not isinstance(last, (tuple, list)) and not hasattr(last, 'table'):
+                raise TypeError("last must be a row returned by the query, pass the order values by key=")
+            key = self._row_key(last, ordering)
+        elif key is not None and not isinstance(key, tuple):
+            key = (key,)
+        if key is not None and len(key) != len(ordering):
+            raise ValueError("key has {} values, {} order columns".format(len(key), len(ordering)))
+        q = self.copy()
+        if key is not None:
+            seek = seek_filter(ordering, key)
+            if seek is None:
+                # 已是最后一行
+                size = 0
+            else:
+                q.__sql_query.filter(seek)
+        q.__sql_query.limit(size)
+        return q
+
+    def iter_pages(self, order_by=None, size=1000):
+        """
+        按keyset分页依次返回每页数据,每页的查询代价与页码无关
+            排序字段不包含主键时追加主键排序以保证顺序唯一
+        :param order_by: 排序(Field/OrderBy),未指定时使用查询的order_by,默认按主键
+        :param size: 每页行数
+        :return: generator of list
+        """
+        base, ordering = self._pages_base(order_by)
+        last = None
+        while True:
+            page = list(base._page_query(last, size, ordering).all())
+            if page:
+                yield page
+            if len(page) < size:
+                break
+            last = page[-1]
+
+    def _pages_base(self, order_by):
+        """
+        iter_pages的查询和排序
+        :return: (DBQuery, [(Field, desc), ...])
+        """
+        base = self.copy()
+        if order_by:
+            if not isinstance(order_by, (list, tuple)):
+                order_by = (order_by,)
+            base.__sql_query.order_by(*(o.asc() if type(o) is Field else o for o in order_by))
+        ordering = base.__sql_query.ordering()
+        pk = base.__sql_query.from_.primary_key
+        if pk is not None and not any(f.table == pk.table and f.name == pk.name for f, _ in ordering):
+            orders = [f.desc() if d else f.asc() for f, d in ordering] + [pk.asc()]
+            base.__sql_query.order_by(*orders)
+            ordering = base.__sql_query.ordering()
+        if not ordering:
+            raise ValueError("iter_pages requires order_by")
+        # 每页的最后一行需要包含排序字段(及追加的主键)的值
+        base.__order_getters(ordering)
+        return base, ordering
+
     def group_by(self, *col):
         self.__sql_query.group_by(GroupBy(*col))
         return self
+
+    def subquery(self, name):
+        """
+        作为派生表,可在FROM/JOIN中使用,字段通过属性访问
+            latest = db.query(Order, Order.user_id, Function.max(Order.id).label("max_id"))
+                       .group_by(Order.user_id).subquery("latest")
+            db.query(Order).join(latest, latest.max_id == Order.id).all()
+        :param name: 别名
+        :return: Derived
+        """
+        return self.__sql_query.subquery(name)
+
+    def cte(self, name):
+        """
+        作为WITH公共表表达式,在FROM/JOIN中引用时生成WITH子句
+        :param name: 名称
+        :return: Derived
+        """
+        return self.__sql_query.cte(name)
@@ -1,4 +1,6 @@
 # coding:utf-8
+import copy
+import threading
 from collections import OrderedDict
 
 from ._patch import local_map
@@ -7,16 +9,157 @@ __author__ = 'Memory_Leak<irealing@163.com>'
 map = local_map
 
 
+class SQLCache(object):
+    """
+    编译后SQL语句的LRU缓存,以语句结构(_shape)为键
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__data = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, compile_):
+        """
+        获取编译结果,未命中时调用compile_编译并缓存
+        :param key: 语句结构
+        :param compile_: 编译函数
+        :return: str
+        """
+        with self.__lock:
+            sql = self.__data.get(key)
+            if sql is not None:
+                self.__data.move_to_end(key)
+                self.hits += 1
+                return sql
+            self.misses += 1
+        sql = compile_()
+        if self.maxsize:
+            with self.__lock:
+                self.__data[key] = sql
+                while len(self.__data) > self.maxsize:
+                    self.__data.popitem(last=False)
+                    self.evictions += 1
+        return sql
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, size=len(self.__data),
+                    maxsize=self.maxsize)
+
+    def resize(self, maxsize):
+        with self.__lock:
+            self.maxsize = maxsize
+            while len(self.__data) > maxsize:
+                self.__data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+sql_cache = SQLCache()
+
+
+class Dialect(object):
+    """
+    SQL方言,编译数据库相关的语法(默认为MySQL)
+    """
+    name = "mysql"
+    # 是否支持UPDATE/DELETE ... ORDER BY ... LIMIT
+    limit_in_dml = True
+    # UPDATE SET中的字段名是否带表名
+    qualified_set = True
+    # 多行INSERT后lastrowid是否为第一行的自增ID(MySQL的LAST_INSERT_ID()),否则为最后一行
+    lastrowid_first = True
+    # 查询自增步长的语句,None为步长固定为1
+    auto_increment_sql = "SELECT @@auto_increment_increment"
+
+    def drop_temporary(self, name):
+        """删除临时表的语句"""
+        return "DROP TEMPORARY TABLE IF EXISTS `{}`".format(name)
+
+    def upsert_clause(self, table, keys, update_columns, conflict):
+        """
+        插入冲突时的更新子句
+        :param table: Table
+        :param keys: 插入的字段名
+        :param update_columns: 冲突时更新的字段名
+        :param conflict: 判断冲突的字段名(MySQL由主键/唯一索引决定,忽略此参数)
+        :return: str
+        """
+        if not update_columns:
+            pk = table.primary_key.name
+            return "ON DUPLICATE KEY UPDATE `{0}`=`{0}`".format(pk)
+        return "ON DUPLICATE KEY UPDATE {}".format(",".join("`{0}`=VALUES(`{0}`)".format(c) for c in update_columns))
+
+
+class SQLiteDialect(Dialect):
+    """SQLite(3.24+)方言"""
+    name = "sqlite"
+    limit_in_dml = False
+    qualified_set = False
+    lastrowid_first = False
+    auto_increment_sql = None
+
+    def drop_temporary(self, name):
+        return "DROP TABLE IF EXISTS temp.`{}`".format(name)
+
+    def upsert_clause(self, table, keys, update_columns, conflict):
+        target = ",".join("`{}`".format(c) for c in conflict)
+        if not update_columns:
+            return "ON CONFLICT ({}) DO NOTHING".format(target)
+        return "ON CONFLICT ({}) DO UPDATE SET {}".format(
+            target, ",".join("`{0}`=excluded.`{0}`".format(c) for c in update_columns))
+
+
+dialects = {"mysql": Dialect(), "sqlite": SQLiteDialect()}
+
+
+def get_dialect(dialect):
+    """
+    :param dialect: 方言名称(dialects中注册的)或Dialect对象
+    :return: Dialect
+    """
+    if isinstance(dialect, Dialect):
+        return dialect
+    return dialects[dialect or "mysql"]
+
+
 class Table(object):
     """
     数据库表对象
     """
 
-    def __init__(self, name, column_names, primary_key, primary_auto=True):
+    def __init__(self, name, column_names, primary_key, primary_auto=True, dtypes=None, shard_key=None,
+                 shard_router=None, deferred=None):
+        """
+        :param name: 表名
+        :param column_names: 字段名列表
+        :param primary_key: 主键字段名
+        :param primary_auto: 主键是否自动生成
+        :param dtypes: 按列读取(DBQuery.to_columns)时各字段的类型,如{"age": "int64", "score": "d"}
+        :param shard_key: 分片字段名(ShardedSessionManager)
+        :param shard_router: 分片路由函数router(value, shard_count) -> 分片序号,默认按值取模
+        :param deferred: 延迟加载的字段名(大TEXT/BLOB字段),默认不查询,首次访问时加载
+        """
         self.table_name_ = name
+        self.dtypes = dict(dtypes) if dtypes else {}
         self.fields = OrderedDict((cn, Field(name, cn)) for cn in column_names)
         self.primary_key = self.fields.get(primary_key)
+        self.shard_key = self.fields[shard_key] if shard_key else None
+        self.shard_router = shard_router
+        self.deferred = frozenset(deferred or ())
+        assert primary_key not in self.deferred and self.deferred.issubset(self.fields)
+        self._default_cols = tuple(cn for cn in self.fields if cn not in self.deferred)
+        self.relations = OrderedDict()
         self.primary_auto = primary_auto
+        self._shape_key = ('T', name, tuple(self.fields))
+        self._row_cls = False
 
     def __getattr__(self, item):
         if item in self.fields:
@@ -33,6 +176,136 @@ class Table(object):
     def col_size(self):
         return len(self.fields)
 
+    def relationship(self, name, target, local, remote=None, many=False):
+        """
+        声明关联关系,行对象通过属性name访问关联的行
+            Order.relationship("user", User, Order.user_id)
+            User.relationship("orders", Order, User.id, Order.user_id, many=True)
+        :param name: 属性名
+        :param target: 关联的表
+        :param local: 本表的字段
+        :param remote: 关联表的字段,默认为关联表的主键
+        :param many: 一对多关系,属性值为列表
+        :return: Relationship
+        """
+        assert name not in self.fields
+        rel = Relationship(self, name, target, local, remote if remote is not None else target.primary_key, many)
+        self.relations[name] = rel
+        return rel
+
+    def default_columns_(self):
+        """
+        默认查询的字段(不含延迟加载字段)
+        :return: tuple
+        """
+        return self._default_cols
+
+    def row_class(self):
+        """
+        数据行对象类(__slots__),首次调用时生成
+        :return: DBRow子类,不支持时返回None
+        """
+        if self._row_cls is False:
+            from ._util import row_class
+            self._row_cls = row_class(self)
+        return self._row_cls
+
+    def _shape(self):
+        return self._shape_key
+
+    def from_sql(self):
+        """FROM/JOIN中引用表的SQL"""
+        return "`{}`".format(self.table_name_)
+
+    def from_args(self):
+        return ()
+
+    def source_tables(self):
+        """
+        实际读取的数据库表名(派生表为子查询涉及的表)
+        :return: list
+        """
+        return [self.table_name_]
+
+
+class Derived(Table):
+    """
+    派生表/CTE:以查询结果作为表,字段为查询的各列(计算列需使用label()命名)
+        latest = Query(Order, Order.user_id, Function.max(Order.id).label("max_id"))
+                     .group_by(GroupBy(Order.user_id)).subquery("latest")
+        Query(Order).join(latest, latest.max_id == Order.id)
+    """
+
+    def __init__(self, query, name, cte=False):
+        """
+        :param query: Query
+        :param name: 别名
+        :param cte: 作为WITH公共表表达式引用
+        """
+        Table.__init__(self, name, _result_columns(query), None, primary_auto=False)
+        self._query = query
+        self._cte = cte
+
+    def _shape(self):
+        return 'DT', self.table_name_, self._cte, self._query._shape()
+
+    def from_sql(self):
+        if self._cte:
+            return "`{}`".format(self.table_name_)
+        return "({}) AS `{}`".format(self._query.sql(), self.table_name_)
+
+    def from_args(self):
+        return () if self._cte else tuple(self._query.args())
+
+    def source_tables(self):
+        return self._query.tables()
+
+    def with_sql(self):
+        """WITH子句中CTE的定义"""
+        return "`{}` AS ({})".format(self.table_name_, self._query.sql())
+
+
+def _result_columns(query):
+    """
+    查询结果的列名
+    :param query: Query
+    :return: list
+    """
+    names = []
+    for f in query.fields:
+        if isinstance(f, Table):
+            names.extend(query.load_columns(f))
+        elif type(f) in (Field, WrapField, LabelField):
+            names.append(f.name)
+        else:
+            raise ValueError("label() is required for computed column {} of derived table".format(f.sql()))
+    if len(set(names)) != len(names):
+        raise ValueError("duplicate column names in derived table: {}".format(names))
+    return names
+
+
+def _subquery(value):
+    """DBQuery转换为Query,用于子查询"""
+    select = getattr(value, '_select', None)
+    return select() if select is not None else value
+
+
+class Relationship(object):
+    """
+    表之间的关联关系: table.local = target.remote
+    """
+
+    def __init__(self, table, name, target, local, remote, many=False):
+        self.table = table
+        self.name = name
+        self.target = target
+        self.local = local
+        self.remote = remote
+        self.many = many
+
+    def __repr__(self):
+        return "<Relationship {}.{} -> {}>".format(self.table.table_name_, self.name, self.target.table_name_)
+
 
 class SQLFragment(object):
     def __str__(self):
@@ -41,6 +314,34 @@ class SQLFragment(object):
     def sql(self):
         raise NotImplemented
 
+    def _shape(self):
+        """
+        语句结构,结构相同的语句编译出相同的SQL(不含参数值)
+        :return: hashable
+        """
+        return self.sql()
+
+
+class BindParam(object):
+    """
+    命名参数占位符,执行预处理语句时传入参数值
+    """
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def expand_marker(self):
+        """IN列表的占位符,执行时按参数个数展开为%s,%s..."""
+        return "__UGLY_EXPAND_{}__".format(self.name)
+
+    def __repr__(self):
+        return "bindparam({!r})".format(self.name)
+
+
+def bindparam(name):
+    return BindParam(name)
+
 
 class OrderBy(SQLFragment):
     """
@@ -52,7 +353,13 @@ class OrderBy(SQLFragment):
         self.order = "ASC"
 
     def sql(self):
-        return "ORDER BY {} {}".format(",".join(map(lambda c: c.sql(), self.column)), self.order)
+        cols = self.column if isinstance(self.column, (list, tuple)) else (self.column,)
+        return "ORDER BY {} {}".format(",".join(map(lambda c: c.sql(), cols)), self.order)
+
+    def _shape(self):
+        if isinstance(self.column, (list, tuple)):
+            return 'O', tuple(c._shape() for c in self.column), self.order
+        return 'O', self.column._shape(), self.order
 
     def asc(self):
         self.order = "ASC"
@@ -72,6 +379,9 @@ class _OrderByGroup(SQLFragment):
             ','.join(map(lambda it: "{} {}".format(it.column.sql(), it.order), self._conditions))
         )
 
+    def _shape(self):
+        return 'OG', tuple((it.column._shape(), it.order) for it in self._conditions)
+
 
 class GroupBy(SQLFragment):
     """
@@ -84,6 +394,9 @@ class GroupBy(SQLFragment):
     def sql(self):
         return "GROUP BY {}".format(",".join(map(lambda c: c.sql(), self.column)))
 
+    def _shape(self):
+        return 'G', tuple(c._shape() for c in self.column)
+
 
 class Field(SQLFragment):
     """
@@ -97,6 +410,39 @@ class Field(SQLFragment):
     def sql(self):
         return "`{}`.`{}`".format(self.table, self.name)
 
+    def _shape(self):
+        return 'F', self.table, self.name
+
+    def args(self):
+        return ()
+
+    def __hash__(self):
+        return hash((self.table, self.name))
+
+    def __add__(self, other):
+        return Expression(self, "+", other)
+
+    def __radd__(self, other):
+        return Expression(other, "+", self)
+
+    def __sub__(self, other):
+        return Expression(self, "-", other)
+
+    def __rsub__(self, other):
+        return Expression(other, "-", self)
+
+    def __mul__(self, other):
+        return Expression(self, "*", other)
+
+    def __rmul__(self, other):
+        return Expression(other, "*", self)
+
+    def __truediv__(self, other):
+        return Expression(self, "/", other)
+
+    def __rtruediv__(self, other):
+        return Expression(other, "/", self)
+
     def __lt__(self, other):
         return SimpleFilter(self, "<", other)
 
@@ -119,7 +465,13 @@ class Field(SQLFragment):
         return self.sql()
 
     def in_(self, values):
-        return InFilter(self, values)
+        return InFilter(self, _subquery(values))
+
+    def label(self, name):
+        """
+        字段别名 AS `name`,只用于查询字段
+        """
+        return LabelField(self, name)
 
     def is_(self, value):
         return SimpleFilter(self, "IS", value)
@@ -136,6 +488,14 @@ class Field(SQLFragment):
     def between(self, start, end):
         return _Between(self, start, end)
 
+    def rebase(self, table):
+        """
+        引用子查询(派生表)中的同名字段
+        :param table: 派生表别名
+        :return: Field
+        """
+        return Field(table, self.name)
+
 
 class FuncField(Field):
     """
@@ -147,9 +507,25 @@ class FuncField(Field):
         self.__opc = base_filed
         self.__func = func.upper()
 
+    @property
+    def func(self):
+        """函数名(大写)"""
+        return self.__func
+
+    @property
+    def operand(self):
+        """函数的参数字段"""
+        return self.__opc
+
     def sql(self):
         return "{}({})".format(self.__func, self.__opc.sql())
 
+    def _shape(self):
+        return 'FN', self.__func, self.__opc._shape()
+
+    def rebase(self, table):
+        return FuncField(self.__func, self.__opc.rebase(table))
+
 
 class WrapField(Field):
     """
@@ -163,6 +539,85 @@ class WrapField(Field):
     def sql(self):
         return "{} {}".format(self.__wrap, super(WrapField, self).sql())
 
+    @property
+    def wrap(self):
+        """包装的关键字,如DISTINCT"""
+        return self.__wrap
+
+    def _shape(self):
+        return 'W', self.__wrap, self.table, self.name
+
+    def rebase(self, table):
+        return WrapField(self.__wrap, Field(table, self.name))
+
+
+class LabelField(Field):
+    """
+    带别名的查询字段 expr AS `name`
+    """
+
+    def __init__(self, base, name):
+        Field.__init__(self, base.table if isinstance(base, Field) else None, name)
+        self.__base = base
+
+    def sql(self):
+        return "{} AS `{}`".format(self.__base.sql(), self.name)
+
+    def _shape(self):
+        return 'L', self.__base._shape(), self.name
+
+    def args(self):
+        return self.__base.args()
+
+    def rebase(self, table):
+        return Field(table, self.name)
+
+
+class Expression(SQLFragment):
+    """
+    算术表达式,如 User.age + 1,用于UPDATE SET和查询条件
+    """
+
+    def __init__(self, left, operator, right):
+        self.left = left
+        self.operator = operator
+        self.right = right
+
+    @staticmethod
+    def __operand(v):
+        return v.sql() if isinstance(v, SQLFragment) else "%s"
+
+    def sql(self):
+        return "({} {} {})".format(self.__operand(self.left), self.operator, self.__operand(self.right))
+
+    def _shape(self):
+        return ('E', self.left._shape() if isinstance(self.left, SQLFragment) else None, self.operator,
+                self.right._shape() if isinstance(self.right, SQLFragment) else None)
+
+    def args(self):
+        params = []
+        for v in (self.left, self.right):
+            if isinstance(v, SQLFragment):
+                params.extend(v.args())
+            else:
+                params.append(v)
+        return params
+
+    def __add__(self, other):
+        return Expression(self, "+", other)
+
+    def __sub__(self, other):
+        return Expression(self, "-", other)
+
+    def __mul__(self, other):
+        return Expression(self, "*", other)
+
+    def __truediv__(self, other):
+        return Expression(self, "/", other)
+
+    def label(self, name):
+        return LabelField(self, name)
+
 
 class _Between(SQLFragment):
     def __init__(self, field, start, end):
@@ -173,6 +628,9 @@ class _Between(SQLFragment):
     def sql(self):
         return "{} BETWEEN %s AND %s".format(self._field.sql())
 
+    def _shape(self):
+        return 'B', self._field._shape()
+
     def args(self):
         return self._start, self._end
 
@@ -196,6 +654,29 @@ class ORFilter(Filter):
     def sql(self):
         return "({})".format(" OR ".join(map(lambda f: f.sql(), self.__fs)))
 
+    def _shape(self):
+        return 'OR', tuple(f._shape() for f in self.__fs)
+
+    def args(self):
+        params = []
+        for f in self.__fs:
+            params.extend(f.args())
+        return params
+
+
+class ANDFilter(Filter):
+    def __init__(self, *fs):
+        self.__fs = fs
+
+    def conditions(self):
+        return self.__fs
+
+    def sql(self):
+        return "({})".format(" AND ".join(map(lambda f: f.sql(), self.__fs)))
+
+    def _shape(self):
+        return 'AND', tuple(f._shape() for f in self.__fs)
+
     def args(self):
         params = []
         for f in self.__fs:
@@ -203,19 +684,50 @@ class ORFilter(Filter):
         return params
 
 
+class Exists(Filter):
+    """
+    EXISTS (子查询),子查询可引用外层查询的字段(相关子查询)
+        exists(Query(Order, Order.id).filter(Order.user_id == User.id))
+        ~exists(...) 为 NOT EXISTS
+    """
+
+    def __init__(self, query, negate=False):
+        self.query = _subquery(query)
+        self.negate = negate
+
+    def sql(self):
+        return "{}EXISTS ({})".format("NOT " if self.negate else "", self.query.sql())
+
+    def _shape(self):
+        return 'EX', self.negate, self.query._shape()
+
+    def args(self):
+        return tuple(self.query.args())
+
+    def __invert__(self):
+        return Exists(self.query, not self.negate)
+
+    def __or__(self, other):
+        return ORFilter(self, other)
+
+
 class SimpleFilter(Filter):
     def __init__(self, column, operator, value):
         Filter.__init__(self)
         self.column = column
         self.operator = operator
         self.value = value
-        self.with_column = isinstance(value, Field)
+        # 值为字段/表达式等SQL片段
+        self.with_column = isinstance(value, SQLFragment)
 
     def sql(self):
         return "{} {} {}".format(self.column.sql(), self.operator, "%s" if not self.with_column else self.value.sql())
 
+    def _shape(self):
+        return 'S', self.column._shape(), self.operator, self.value._shape() if self.with_column else None
+
     def args(self):
-        return () if self.with_column else (self.value,)
+        return tuple(self.value.args()) if self.with_column else (self.value,)
 
     def __or__(self, other):
         return ORFilter(self, other)
@@ -230,13 +742,34 @@ class InFilter(SimpleFilter):
         super(InFilter, self).__init__(column, "IN", values)
 
     def sql(self):
-        params = ",".join(map(lambda _: "%s", self.value))
+        if isinstance(self.value, BindParam):
+            params = self.value.expand_marker()
+        elif isinstance(self.value, SQLFragment):
+            params = self.value.sql()
+        else:
+            params = ",".join(map(lambda _: "%s", self.value))
         return "{} {} ({})".format(self.column.sql(), self.operator, params)
 
+    def _shape(self):
+        if isinstance(self.value, BindParam):
+            return 'IN', self.column._shape(), self.value.expand_marker()
+        if isinstance(self.value, SQLFragment):
+            return 'IN', self.column._shape(), self.value._shape()
+        return 'IN', self.column._shape(), len(self.value)
+
     def args(self):
+        if isinstance(self.value, BindParam):
+            return _Expanding(self.value.name),
+        if isinstance(self.value, SQLFragment):
+            return self.value.args()
         return self.value
 
 
+class _Expanding(BindParam):
+    """IN列表参数,执行时展开为多个参数"""
+    __slots__ = ()
+
+
 class _Join(SQLFragment):
     """
     连接查询
@@ -251,7 +784,53 @@ class _Join(SQLFragment):
         self.on = on
 
     def sql(self):
-        return "{} JOIN `{}` ON {}".format(self.method, self.table.table_name_, self.on.sql())
+        return "{} JOIN {} ON {}".format(self.method, self.table.from_sql(), self.on.sql())
+
+    def _shape(self):
+        return 'J', self.method, self.table._shape(), self.on._shape()
+
+    def args(self):
+        return tuple(self.table.from_args()) + tuple(self.on.args())
+
+
+def seek_filter(ordering, values):
+    """
+    keyset分页条件,排序在values之后的行
+        (a, b) > (x, y) 展开为 a >= x AND (a > x OR (a = x AND b > y))
+        NULL按最小值处理(与MySQL/SQLite的排序一致):升序时排在最前,降序时排在最后
+    :param ordering: [(Field, desc), ...]
+    :param values: 排序字段的值
+    :return: Filter,没有排在values之后的行时返回None
+    """
+    assert len(ordering) == len(values)
+    branches = []
+    for i, (field, desc) in enumerate(ordering):
+        after = _seek_after(field, desc, values[i])
+        if after is None:
+            continue
+        cond = [_seek_equal(ordering[j][0], values[j]) for j in range(i)]
+        cond.append(after)
+        branches.append(cond[0] if len(cond) == 1 else ANDFilter(*cond))
+    if len(branches) < 2:
+        return branches[0] if branches else None
+    field, desc = ordering[0]
+    value = values[0]
+    if value is None:
+        # 第一个字段为NULL时没有可用于索引的范围条件
+        return ORFilter(*branches)
+    start = ORFilter(field <= value, field.is_(None)) if desc else field >= value
+    return ANDFilter(start, ORFilter(*branches))
+
+
+def _seek_after(field, desc, value):
+    """排序在value之后的条件,不存在时返回None"""
+    if value is None:
+        return None if desc else SimpleFilter(field, "IS NOT", None)
+    return ORFilter(field < value, field.is_(None)) if desc else field > value
+
+
+def _seek_equal(field, value):
+    return field.is_(None) if value is None else field == value
 
 
 class Function(object):
@@ -274,6 +853,8 @@ class Query(SQLFragment):
     """
     查询
     """
+    # 子查询(派生表)的别名
+    SUBQUERY = "_ugly_sub"
 
     def __init__(self, table, *fields):
         self.from_ = table
@@ -283,24 +864,87 @@ class Query(SQLFragment):
         self.fields = fields
         self.__join_filters = []
         self.__limit = None
-        self.__args = []
         self.__order = None
         self.__group_by = None
+        self.__loads = {}
 
     def filter(self, *fs):
         self.filters.extend(fs)
-        map(lambda f: self.__args.extend(f.args()), fs)
+        return self
+
+    def load_columns(self, table):
+        """
+        查询表的哪些字段
+        :param table: Table
+        :return: 字段名tuple
+        """
+        return self.__loads.get(table.table_name_) or table.default_columns_()
+
+    def load(self, table, names):
+        """
+        指定查询表的字段,主键总是查询
+        :param table: Table
+        :param names: 字段名
+        :return:
+        """
+        names = set(names)
+        pk = table.primary_key.name if table.primary_key is not None else None
+        loads = dict(self.__loads)
+        loads[table.table_name_] = tuple(cn for cn in table.fields if cn in names or cn == pk)
+        self.__loads = loads
         return self
 
     def args(self):
+        return self.__args(True)
+
+    def __args(self, columns):
+        """
+        :param columns: 包含查询字段(计算列)的参数
+        """
+        args = []
+        for c in self.__ctes():
+            args.extend(c._query.args())
+        if columns:
+            for f in self.fields:
+                if not isinstance(f, Table):
+                    args.extend(f.args())
+        args.extend(self.from_.from_args())
+        for j in self.__join_filters:
+            args.extend(j.args())
+        for f in self.filters:
+            args.extend(f.args())
         if self.__limit:
-            self.__args.extend(self.__limit)
-        return tuple(self.__args)
+            args.extend(self.__limit)
+        return tuple(args)
+
+    def __ctes(self):
+        """FROM/JOIN中引用的CTE"""
+        ctes = OrderedDict()
+        for t in [self.from_] + [j.table for j in self.__join_filters]:
+            if isinstance(t, Derived) and t._cte:
+                ctes.setdefault(t.table_name_, t)
+        return list(ctes.values())
+
+    def subquery(self, name):
+        """
+        作为派生表(FROM/JOIN中的子查询)
+        :param name: 别名
+        :return: Derived
+        """
+        return Derived(self.copy(), name)
+
+    def cte(self, name):
+        """
+        作为WITH公共表表达式,在FROM/JOIN中引用时生成WITH子句
+        :param name: 名称
+        :return: Derived
+        """
+        return Derived(self.copy(), name, True)
 
     def __query_columns(self):
         return "*" if not self.fields else ",".join(
-            map(lambda c: ",".join(map(lambda tc: tc.sql(), c.fields.values())) if isinstance(c, Table) else c.sql(),
-                self.fields))
+            map(lambda c: ",".join(c.fields[cn].sql() for cn in self.load_columns(c))
+                if isinstance(c, Table) else c.sql(), self.fields))
 
     def __join(self, method, table, on):
         self.__join_filters.append(_Join(table, method, on))
@@ -319,41 +963,268 @@ class Query(SQLFragment):
         self.__limit = (offset, limit)
         return self
 
+    def _shape(self):
+        return ('Q', self.from_._shape(),
+                tuple(('T', f.table_name_, self.load_columns(f)) if isinstance(f, Table) else f._shape()
+                      for f in self.fields),
+                tuple(j._shape() for j in self.__join_filters), tuple(f._shape() for f in self.filters),
+                self.__group_by._shape() if self.__group_by else None,
+                self.__order._shape() if self.__order else None, self.__limit is not None)
+
     def sql(self):
-        cs = self.__query_columns()
-        sql = "SELECT {} FROM `{}`".format(cs, self.from_.table_name_)
+        return sql_cache.get(self._shape(), self.__compile)
+
+    def __compile(self):
+        return self.__select(self.__query_columns())
+
+    def __select(self, columns, ordered=True):
+        """
+        :param columns: 查询字段
+        :param ordered: 是否保留ORDER BY,有LIMIT时总是保留
+        """
+        sql = "SELECT {} FROM {}".format(columns, self.from_.from_sql())
+        ctes = self.__ctes()
+        if ctes:
+            sql = "WITH {} {}".format(",".join(c.with_sql() for c in ctes), sql)
         if self.__join_filters:
             sql = "{} {}".format(sql, " ".join(map(lambda j: j.sql(), self.__join_filters)))
         if self.filters:
             sql = "{} WHERE {}".format(sql, " AND ".join(map(lambda f: f.sql(), self.filters)))
         if self.__group_by:
             sql = "{} {}".format(sql, self.__group_by.sql())
-        if self.__order:
+        if self.__order and (ordered or self.__limit):
             sql = "{} {}".format(sql, self.__order.sql())
         if self.__limit:
             sql = "{} LIMIT %s,%s".format(sql)
         return sql
 
+    def __distinct(self):
+        return any(isinstance(f, WrapField) for f in self.fields)
+
+    def splittable(self, ignore_limit=False):
+        """
+        按条件拆分为多次查询时各部分的结果能否直接合并(非聚合/DISTINCT/LIMIT查询)
+        :param ignore_limit: 不考虑LIMIT(由调用方合并后截取)
+        :return: bool
+        """
+        return not self.aggregated() and not self.__distinct() and (ignore_limit or self.__limit is None)
+
+    def __keep_columns(self):
+        """计数/判断存在时需要保留查询字段(DISTINCT/聚合查询的结果行由查询字段决定)"""
+        return self.__distinct() or self.aggregated()
+
+    def __outputs(self):
+        """
+        包装为子查询时的查询字段及其别名
+        :return: [(Field, 别名)]
+        """
+        cols = []
+        for c in self.fields:
+            if isinstance(c, Table):
+                cols.extend(c.fields[cn] for cn in self.load_columns(c))
+            else:
+                cols.append(c)
+        return [(c, c.name if isinstance(c, LabelField) else "_c{}".format(i)) for i, c in enumerate(cols)]
+
+    def __labeled_columns(self):
+        return ",".join(c.sql() if isinstance(c, LabelField) else "{} AS `{}`".format(c.sql(), label)
+                        for c, label in self.__outputs())
+
+    def __rebase(self, field, outputs):
+        """
+        子查询外的聚合函数改为引用子查询输出的字段
+        :param field: 聚合函数的参数
+        :param outputs: __outputs()
+        """
+        shape = field._shape()
+        for f, label in outputs:
+            if f._shape() == shape or (type(field) in (Field, WrapField) and type(f) in (Field, WrapField) and
+                                       f.table == field.table and f.name == field.name):
+                column = Field(self.SUBQUERY, label)
+                return WrapField(field.wrap, column) if isinstance(field, WrapField) else column
+        if isinstance(field, FuncField):
+            return FuncField(field.func, self.__rebase(field.operand, outputs))
+        raise ValueError("column {} is not selected by the query".format(field.sql()))
+
+    def count_statement(self):
+        """
+        计数语句,不包含ORDER BY;GROUP BY/DISTINCT/LIMIT/聚合查询包装为子查询
+        :return: (sql, args)
+        """
+        return sql_cache.get(('COUNT', self._shape()), self.__compile_count), self.__args(self.__keep_columns())
+
+    def __compile_count(self):
+        if self.splittable():
+            return self.__select("COUNT(*)", False)
+        inner = self.__select(self.__labeled_columns() if self.__keep_columns() else "1", False)
+        return "SELECT COUNT(*) FROM ({}) AS `{}`".format(inner, self.SUBQUERY)
+
+    def exists_statement(self):
+        """
+        SELECT EXISTS(SELECT 1 ... LIMIT 1)
+        :return: (sql, args)
+        """
+        return sql_cache.get(('EXISTS', self._shape()), self.__compile_exists), self.__args(self.__keep_columns())
+
+    def __compile_exists(self):
+        inner = self.__select(self.__labeled_columns() if self.__keep_columns() else "1", False)
+        if not self.__limit:
+            inner = "{} LIMIT 1".format(inner)
+        return "SELECT EXISTS({})".format(inner)
+
+    def aggregate_statement(self, *fields):
+        """
+        聚合语句,如aggregate_statement(Function.sum(User.age), Function.max(User.age))
+            GROUP BY/DISTINCT/LIMIT/聚合查询包装为子查询,聚合函数引用子查询输出的字段,
+            如query(User.age, Function.count(User.id)).group_by(User.age)的aggregate(Function.sum(Function.count(User.id)))
+        :param fields: FuncField
+        :return: (sql, args)
+        """
+        assert fields
+        shape = ('AGG', self._shape(), tuple(f._shape() for f in fields))
+        return sql_cache.get(shape, lambda: self.__compile_aggregate(fields)), self.__args(not self.splittable())
+
+    def __compile_aggregate(self, fields):
+        if self.splittable():
+            return self.__select(",".join(f.sql() for f in fields), False)
+        outputs = self.__outputs()
+        columns = ",".join((FuncField(f.func, self.__rebase(f.operand, outputs)) if isinstance(f, FuncField)
+                            else self.__rebase(f, outputs)).sql() for f in fields)
+        inner = self.__select(self.__labeled_columns(), False)
+        return "SELECT {} FROM ({}) AS `{}`".format(columns, inner, self.SUBQUERY)
+
     def order_by(self, *order):
         assert order
         self.__order = order[0] if len(order) < 2 else _OrderByGroup(*order)
         return self
 
+    def ordering(self):
+        """
+        排序字段
+        :return: [(Field, desc), ...]
+        """
+        order = self.__order
+        if order is None:
+            return []
+        conditions = order._conditions if isinstance(order, _OrderByGroup) else (order,)
+        result = []
+        for it in conditions:
+            if not isinstance(it, OrderBy):
+                result.append((it, False))
+                continue
+            cols = it.column if isinstance(it.column, (list, tuple)) else (it.column,)
+            result.extend((c, it.order == "DESC") for c in cols)
+        return result
+
+    def copy(self):
+        """
+        复制查询,修改副本的条件不影响原查询
+        :return: Query
+        """
+        q = copy.copy(self)
+        q.filters = list(self.filters)
+        q.__join_filters = list(self.__join_filters)
+        return q
+
+    def tables(self):
+        """
+        查询涉及的表名
+        :return: list
+        """
+        names = list(self.from_.source_tables())
+        for j in self.__join_filters:
+            names.extend(j.table.source_tables())
+        return names
+
+    def joins(self):
+        """
+        连接
+        :return: [_Join]
+        """
+        return list(self.__join_filters)
+
+    def limit_range(self):
+        """
+        :return: (offset, limit)|None
+        """
+        return self.__limit
+
+    def key_values(self, field):
+        """
+        查询条件中字段的等值(=/IN)取值,用于分片路由
+        :param field: Field
+        :return: list|None,没有此类条件时返回None
+        """
+        for f in self.filters:
+            if type(f) not in (SimpleFilter, InFilter) or f.with_column or type(f.column) is not Field:
+                continue
+            if f.column.table != field.table or f.column.name != field.name:
+                continue
+            if f.operator == '=' and f.value is not None:
+                return [f.value]
+            if f.operator == 'IN' and not isinstance(f.value, (BindParam, SQLFragment)):
+                return list(f.value)
+        return None
+
+    def _identity_key(self):
+        """
+        仅按主键等值查询单表时返回(表名, 主键值)
+        :return: tuple|None
+        """
+        pk = self.from_.primary_key
+        if pk is None or len(self.filters) != 1 or len(self.fields) != 1 or self.fields[0] is not self.from_:
+            return None
+        if self.__join_filters or self.__limit or self.__group_by:
+            return None
+        f = self.filters[0]
+        if type(f) is not SimpleFilter or f.operator != '=' or f.with_column or f.value is None:
+            return None
+        if f.column.table != pk.table or f.column.name != pk.name or type(f.column) is not Field:
+            return None
+        return self.from_.table_name_, f.value
+
     def group_by(self, group):
         self.__group_by = group
         return self
 
+    def bulk(self, stmt):
+        """
+        将查询条件、排序和LIMIT应用到批量UPDATE/DELETE语句
+        :param stmt: Update|Delete
+        :return: stmt
+        """
+        if self.__join_filters or self.__group_by is not None:
+            raise ValueError("bulk update/delete does not support join or group by")
+        if self.__limit and self.__limit[0]:
+            raise ValueError("bulk update/delete does not support offset")
+        stmt.where(*self.filters)
+        if self.__order:
+            stmt.order_by(self.__order)
+        if self.__limit is not None:
+            stmt.limit(self.__limit[1])
+        return stmt
+
+    def aggregated(self):
+        """
+        是否为聚合查询(GROUP BY或查询字段包含函数)
+        :return: bool
+        """
+        return self.__group_by is not None or any(isinstance(f, FuncField) for f in self.fields)
+
 
 class Update(SQLFragment):
     """
     更新数据库
     """
 
-    def __init__(self, table):
+    def __init__(self, table, dialect=None):
         self.table = table
         self.condition = []
         self.cols = []
         self.__args = []
+        self.dialect = get_dialect(dialect)
+        self._order = None
+        self._limit = None
 
     def where(self, *condition):
         self.condition.extend(condition)
@@ -364,6 +1235,14 @@ class Update(SQLFragment):
         self.cols.extend(cols)
         return self
 
+    def order_by(self, *order):
+        self._order = order[0] if len(order) < 2 else _OrderByGroup(*order)
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
     def sql(self):
         return self.__str__()
 
@@ -371,15 +1250,90 @@ class Update(SQLFragment):
         _args = []
         map(lambda c: _args.extend(c.args()), self.cols)
         map(lambda c: _args.extend(c.args()), self.condition)
+        if self._limit is not None:
+            _args.append(self._limit)
         return _args
 
+    def _shape(self):
+        return ('U', self.table.table_name_, tuple(c._shape() for c in self.cols),
+                tuple(f._shape() for f in self.condition), self._order._shape() if self._order else None,
+                self._limit is not None, self.dialect.name)
+
     def __str__(self):
+        return sql_cache.get(self._shape(), self.__compile)
+
+    def __compile(self):
         sql = "UPDATE `{}`".format(self.table.table_name_)
-        cols = ",".join(c.sql() for c in self.cols)
+        if self.dialect.qualified_set:
+            cols = ",".join(c.sql() for c in self.cols)
+        else:
+            cols = ",".join("`{}` {} {}".format(c.column.name, c.operator, c.value.sql() if c.with_column else "%s")
+                            for c in self.cols)
         sql = "{} SET {}".format(sql, cols)
-        where = " AND ".join(f.sql() for f in self.condition)
-        sql = "{} WHERE {}".format(sql, where)
-        return sql
+        return _dml_where(sql, self)
+
+
+def _dml_where(head, stmt):
+    """
+    UPDATE/DELETE语句的WHERE ... ORDER BY ... LIMIT部分
+        方言不支持LIMIT时改写为 WHERE 主键 IN (SELECT 主键 ... LIMIT %s)
+    """
+    where = " AND ".join(f.sql() for f in stmt.condition)
+    where = " WHERE {}".format(where) if where else ""
+    order = " {}".format(stmt._order.sql()) if stmt._order else ""
+    if stmt._limit is None:
+        return head + where
+    if stmt.dialect.limit_in_dml:
+        return "{}{}{} LIMIT %s".format(head, where, order)
+    if stmt.table.primary_key is None:
+        raise ValueError("{} does not support UPDATE/DELETE ... LIMIT on table {} without primary key".format(
+            stmt.dialect.name, stmt.table.table_name_))
+    pk = stmt.table.primary_key.sql()
+    return "{} WHERE {} IN (SELECT {} FROM `{}`{}{} LIMIT %s)".format(
+        head, pk, pk, stmt.table.table_name_, where, order)
+
+
+class Delete(SQLFragment):
+    """
+    删除 DELETE FROM `t` WHERE ... [ORDER BY ... LIMIT n]
+    """
+
+    def __init__(self, table, dialect=None):
+        self.table = table
+        self.condition = []
+        self.dialect = get_dialect(dialect)
+        self._order = None
+        self._limit = None
+
+    def where(self, *condition):
+        self.condition.extend(condition)
+        return self
+
+    def order_by(self, *order):
+        self._order = order[0] if len(order) < 2 else _OrderByGroup(*order)
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def args(self):
+        _args = []
+        for c in self.condition:
+            _args.extend(c.args())
+        if self._limit is not None:
+            _args.append(self._limit)
+        return _args
+
+    def _shape(self):
+        return ('D', self.table.table_name_, tuple(f._shape() for f in self.condition),
+                self._order._shape() if self._order else None, self._limit is not None, self.dialect.name)
+
+    def sql(self):
+        return sql_cache.get(self._shape(), self.__compile)
+
+    def __compile(self):
+        return _dml_where("DELETE FROM `{}`".format(self.table.table_name_), self)
 
 
 class Insert(SQLFragment):
@@ -409,9 +1363,149 @@ class Insert(SQLFragment):
         map(lambda c: r.extend(c.args()), self.__values.values())
         return r
 
+    def _shape(self):
+        return 'I', self.table.table_name_, tuple(self.__values)
+
     def sql(self):
+        return sql_cache.get(self._shape(), self.__compile)
+
+    def __compile(self):
         sql = "INSERT INTO `{}` ({}) VALUES ({})"
         al = len(self.__values)
         params = ",".join(map(lambda x_: "`{}`".format(x_), self.__values.keys()))
         return sql.format(self.table.table_name_, params,
                           ",".join(map(lambda _: "%s", range(al))))
+
+
+class InsertMany(SQLFragment):
+    """
+    多行插入操作 INSERT ... VALUES (...),(...)
+    """
+
+    def __init__(self, table, keys):
+        self.table = table
+        enable_keys = set(table.table_columns_())
+        if table.primary_auto:
+            enable_keys.discard(table.primary_key.name)
+        for k in keys:
+            if k not in enable_keys:
+                raise AttributeError("'{}' object has no attribute {} ".format(self.__class__.__name__, k))
+        self.__keys = tuple(keys)
+        self.rows = []
+
+    def add(self, values):
+        self.rows.append(values)
+        return self
+
+    def keys(self):
+        return self.__keys
+
+    def args(self):
+        r = []
+        for row in self.rows:
+            r.extend(row)
+        return r
+
+    def _shape(self):
+        return 'IM', self.table.table_name_, self.__keys, len(self.rows)
+
+    def sql(self):
+        return sql_cache.get(self._shape(), self.__compile)
+
+    def __compile(self):
+        return _insert_values(self.table, self.__keys, len(self.rows))
+
+
+def _insert_values(table, keys, count):
+    """INSERT INTO `t` (keys) VALUES (...),(...)"""
+    values = "({})".format(",".join("%s" for _ in keys))
+    return "INSERT INTO `{}` ({}) VALUES {}".format(
+        table.table_name_, ",".join(map(lambda x_: "`{}`".format(x_), keys)), ",".join(values for _ in range(count)))
+
+
+class Upsert(SQLFragment):
+    """
+    多行插入,主键/唯一索引冲突时更新 INSERT ... ON DUPLICATE KEY UPDATE col=VALUES(col)
+    """
+
+    def __init__(self, table, keys, update_columns=None, conflict=None, dialect=None):
+        """
+        :param table:
+        :param keys: 插入的字段名
+        :param update_columns: 冲突时更新的字段名,默认为keys中除conflict外的字段
+        :param conflict: 判断冲突的字段名(SQLite ON CONFLICT),默认为主键
+        :param dialect: 方言名称或Dialect对象
+        """
+        self.table = table
+        for k in keys:
+            if k not in table.fields:
+                raise AttributeError("'{}' object has no attribute {} ".format(self.__class__.__name__, k))
+        self.conflict = tuple(conflict) if conflict else (table.primary_key.name,)
+        if update_columns is None:
+            update_columns = [k for k in keys if k not in self.conflict]
+        self.update_columns = tuple(update_columns)
+        self.dialect = get_dialect(dialect)
+        self.__keys = tuple(keys)
+        self.rows = []
+
+    def add(self, values):
+        self.rows.append(values)
+        return self
+
+    def keys(self):
+        return self.__keys
+
+    def args(self):
+        r = []
+        for row in self.rows:
+            r.extend(row)
+        return r
+
+    def _shape(self):
+        return ('UP', self.dialect.name, self.table.table_name_, self.__keys, self.update_columns, self.conflict,
+                len(self.rows))
+
+    def sql(self):
+        return sql_cache.get(self._shape(), self.__compile)
+
+    def __compile(self):
+        return "{} {}".format(_insert_values(self.table, self.__keys, len(self.rows)),
+                              self.dialect.upsert_clause(self.table, self.__keys, self.update_columns, self.conflict))
+
+
+class CaseUpdate(SQLFragment):
+    """
+    多行更新 UPDATE ... SET col = CASE pk WHEN ... THEN ... END WHERE pk IN (...)
+    """
+
+    def __init__(self, table, columns, rows):
+        """
+        :param table:
+        :param columns: 更新的字段名
+        :param rows: [(主键值, (字段值, ...)), ...]
+        """
+        self.table = table
+        self.columns = tuple(columns)
+        self.rows = rows
+
+    def args(self):
+        r = []
+        for i in range(len(self.columns)):
+            for pk, values in self.rows:
+                r.append(pk)
+                r.append(values[i])
+        r.extend(pk for pk, _ in self.rows)
+        return r
+
+    def _shape(self):
+        return 'CU', self.table.table_name_, self.columns, len(self.rows)
+
+    def sql(self):
+        return sql_cache.get(self._shape(), self.__compile)
+
+    def __compile(self):
+        pk = self.table.primary_key.sql()
+        whens = " ".join("WHEN %s THEN %s" for _ in self.rows)
+        cols = ",".join("`{}` = CASE {} {} END".format(c, pk, whens) for c in self.columns)
+        return "UPDATE `{}` SET {} WHERE {} IN ({})".format(self.table.table_name_, cols, pk,
+                                                            ",".join("%s" for _ in self.rows))
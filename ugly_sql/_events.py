@@ -0,0 +1,144 @@
+# coding:utf-8
+import logging
+import random
+import time
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+
+class ExecuteEvent(object):
+    """
+    SQL执行事件
+    """
+    __slots__ = ('sql', 'args', 'rowcount', 'elapsed', 'error', 'source', 'start')
+
+    def __init__(self, sql, args, source):
+        self.sql = sql
+        self.args = args
+        self.source = source
+        self.rowcount = None
+        self.elapsed = None
+        self.error = None
+        self.start = time.perf_counter()
+
+
+class Events(object):
+    """
+    SQL执行事件监听器
+        before_execute(event): 执行前
+        after_execute(event): 执行后,event.rowcount/event.elapsed(秒)
+        on_error(event): 执行异常,event.error
+        on_commit(event): 提交事务后
+    """
+    names = ('before_execute', 'after_execute', 'on_error', 'on_commit')
+    logger = logging.getLogger("Events")
+
+    def __init__(self):
+        self.before_execute = []
+        self.after_execute = []
+        self.on_error = []
+        self.on_commit = []
+
+    def listen(self, name, fn):
+        if name not in self.names:
+            raise ValueError("unknown event '{}'".format(name))
+        getattr(self, name).append(fn)
+        return fn
+
+    def remove(self, name, fn):
+        getattr(self, name).remove(fn)
+
+    def __fire(self, listeners, event):
+        for fn in listeners:
+            try:
+                fn(event)
+            except Exception as e:
+                self.logger.exception("event listener error %s", e.__class__.__name__)
+
+    def before(self, sql, args, source):
+        event = ExecuteEvent(sql, args, source)
+        if self.before_execute:
+            self.__fire(self.before_execute, event)
+        return event
+
+    def after(self, event, cursor):
+        event.elapsed = time.perf_counter() - event.start
+        event.rowcount = getattr(cursor, 'rowcount', None)
+        if self.after_execute:
+            self.__fire(self.after_execute, event)
+
+    def error(self, event, e):
+        event.elapsed = time.perf_counter() - event.start
+        event.error = e
+        if self.on_error:
+            self.__fire(self.on_error, event)
+
+    def commit(self, source, start):
+        if self.on_commit:
+            event = ExecuteEvent('COMMIT', (), source)
+            event.start = start
+            event.elapsed = time.perf_counter() - start
+            self.__fire(self.on_commit, event)
+
+
+def run(events, cursor, sql, params, source, many=False):
+    """
+    执行SQL并触发事件,未注册监听器(events为None)时直接执行
+    :return: cursor.execute的返回值
+    """
+    if events is None:
+        return cursor.executemany(sql, params) if many else cursor.execute(sql, params)
+    event = events.before(sql, params, source)
+    try:
+        ret = cursor.executemany(sql, params) if many else cursor.execute(sql, params)
+    except Exception as e:
+        events.error(event, e)
+        raise
+    events.after(event, cursor)
+    return ret
+
+
+async def run_async(events, cursor, sql, params, source, many=False):
+    """
+    run的asyncio版本
+    """
+    if events is None:
+        return await (cursor.executemany(sql, params) if many else cursor.execute(sql, params))
+    event = events.before(sql, params, source)
+    try:
+        ret = await (cursor.executemany(sql, params) if many else cursor.execute(sql, params))
+    except Exception as e:
+        events.error(event, e)
+        raise
+    events.after(event, cursor)
+    return ret
+
+
+class SlowQueryLogger(object):
+    """
+    慢查询日志,作为after_execute监听器
+    """
+
+    def __init__(self, threshold=1.0, sample_rate=1.0, logger=None):
+        """
+        :param threshold: 慢查询阈值(秒)
+        :param sample_rate: 超过阈值的语句的采样比例
+        :param logger:
+        """
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.logger = logger or logging.getLogger("SlowQuery")
+
+    def __call__(self, event):
+        if event.elapsed < self.threshold:
+            return
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        self.logger.warning("slow query %.3fs rows=%s : %s %r", event.elapsed, event.rowcount, event.sql, event.args)
+
+    def install(self, target):
+        """
+        :param target: DBSession/SessionManager/DBConsole
+        """
+        target.listen('after_execute', self)
+        return self
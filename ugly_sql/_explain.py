@@ -0,0 +1,275 @@
+# coding:utf-8
+import logging
+import random
+import time
+from collections import OrderedDict
+
+from ._db import Field, SimpleFilter, InFilter, ANDFilter, Derived, _Between
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+
+class PlanStep(object):
+    """
+    执行计划中的一行(MySQL EXPLAIN的一行)
+    """
+    __slots__ = ('table', 'select_type', 'access', 'possible_keys', 'key', 'rows', 'filtered', 'extra')
+
+    def __init__(self, row):
+        """
+        :param row: {EXPLAIN输出的字段名: 值}
+        """
+        self.table = row.get('table')
+        self.select_type = row.get('select_type')
+        self.access = row.get('type')
+        self.possible_keys = row.get('possible_keys')
+        self.key = row.get('key')
+        self.rows = row.get('rows')
+        self.filtered = row.get('filtered')
+        self.extra = row.get('Extra') or ""
+
+    @property
+    def full_scan(self):
+        """全表扫描(type=ALL)"""
+        return self.access == "ALL"
+
+    @property
+    def filesort(self):
+        return "Using filesort" in self.extra
+
+    @property
+    def temporary(self):
+        return "Using temporary" in self.extra
+
+    def __repr__(self):
+        return "PlanStep(table={!r}, access={!r}, key={!r}, rows={!r}, extra={!r})".format(
+            self.table, self.access, self.key, self.rows, self.extra)
+
+
+class IndexSuggestion(object):
+    """
+    建议创建的索引
+    """
+    __slots__ = ('table', 'columns')
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = tuple(columns)
+
+    def sql(self):
+        """
+        :return: ALTER TABLE ... ADD INDEX语句
+        """
+        name = "idx_{}_{}".format(self.table, "_".join(self.columns))[:64]
+        return "ALTER TABLE `{}` ADD INDEX `{}` ({})".format(
+            self.table, name, ",".join("`{}`".format(c) for c in self.columns))
+
+    def __repr__(self):
+        return "IndexSuggestion({!r}, {!r})".format(self.table, self.columns)
+
+
+class QueryPlan(object):
+    """
+    查询的执行计划
+    """
+
+    def __init__(self, rows, indexes=()):
+        """
+        :param rows: EXPLAIN结果,[{字段名: 值}]
+        :param indexes: 建议创建的索引
+        """
+        self.steps = [PlanStep(r) for r in rows]
+        self.indexes = list(indexes)
+
+    @property
+    def rows(self):
+        """各步骤估算扫描行数之积(嵌套循环连接的估算行数)"""
+        total = 1
+        for s in self.steps:
+            total *= s.rows or 1
+        return total
+
+    def problems(self):
+        """
+        需要关注的问题:全表扫描/filesort/临时表
+        :return: [str]
+        """
+        result = []
+        for s in self.steps:
+            if s.full_scan:
+                result.append("full scan on `{}` ({} rows)".format(s.table, s.rows))
+            if s.filesort:
+                result.append("filesort on `{}`".format(s.table))
+            if s.temporary:
+                result.append("temporary table on `{}`".format(s.table))
+        return result
+
+    def _slow_tables(self):
+        """存在问题或未使用索引的表"""
+        return set(s.table for s in self.steps if s.full_scan or s.filesort or s.temporary or s.key is None)
+
+    def advise(self, query):
+        """
+        根据查询的条件、连接和排序字段,为存在问题的表建议索引
+        :param query: Query
+        :return: self
+        """
+        slow = self._slow_tables()
+        self.indexes = [i for i in suggest_indexes(query) if not self.steps or i.table in slow or None in slow]
+        return self
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        return "QueryPlan({!r})".format(self.steps)
+
+
+def _plain(column):
+    return type(column) is Field
+
+
+def _conditions(filters):
+    """
+    展开顶层AND条件,得到(字段, 是否等值)
+    """
+    for f in filters:
+        if isinstance(f, ANDFilter):
+            for c in _conditions(f.conditions()):
+                yield c
+        elif isinstance(f, _Between) and _plain(f._field):
+            yield f._field, False
+        elif type(f) in (SimpleFilter, InFilter) and _plain(f.column) and not f.with_column:
+            if f.operator in ("=", "IN", "IS"):
+                yield f.column, True
+            elif f.operator in ("<", "<=", ">", ">="):
+                yield f.column, False
+
+
+def suggest_indexes(query):
+    """
+    根据查询的条件、连接和排序字段建议索引
+        每个表的索引依次为:等值条件字段,排序字段(均属于FROM表时)或第一个范围条件字段
+    :param query: Query
+    :return: [IndexSuggestion]
+    """
+    tables = OrderedDict((t.table_name_, {'eq': [], 'range': []}) for t in [query.from_] + [
+        j.table for j in query.joins()])
+    for field, eq in _conditions(query.filters):
+        if field.table in tables:
+            tables[field.table]['eq' if eq else 'range'].append(field.name)
+    for j in query.joins():
+        on = j.on
+        if type(on) is not SimpleFilter or not on.with_column or on.operator != "=":
+            continue
+        for c in (on.column, on.value):
+            if _plain(c) and c.table == j.table.table_name_:
+                tables[c.table]['eq'].append(c.name)
+    main = query.from_.table_name_
+    ordering = query.ordering()
+    order = [f.name for f, _ in ordering if _plain(f) and f.table == main]
+    if len(order) != len(ordering) or len(set(d for _, d in ordering)) > 1:
+        order = []
+    pks = dict((t.table_name_, t.primary_key.name) for t in [query.from_] + [j.table for j in query.joins()]
+               if t.primary_key is not None and not isinstance(t, Derived))
+    derived = set(j.table.table_name_ for j in query.joins() if isinstance(j.table, Derived))
+    if isinstance(query.from_, Derived):
+        derived.add(main)
+    result = []
+    for name, cols in tables.items():
+        if name in derived:
+            continue
+        columns = list(OrderedDict.fromkeys(cols['eq']))
+        if pks.get(name) in columns:
+            # 主键等值条件已可以定位
+            continue
+        tail = order if name == main and order else cols['range'][:1]
+        columns.extend(c for c in tail if c not in columns)
+        if columns and columns != [pks.get(name)]:
+            result.append(IndexSuggestion(name, columns))
+    return result
+
+
+class ExplainReport(object):
+    """
+    慢查询的执行计划采样结果
+    """
+    __slots__ = ('sql', 'args', 'elapsed', 'plan')
+
+    def __init__(self, sql, args, elapsed, plan):
+        self.sql = sql
+        self.args = args
+        self.elapsed = elapsed
+        self.plan = plan
+
+    def __repr__(self):
+        return "ExplainReport({:.3f}s {} problems={} indexes={})".format(
+            self.elapsed, self.sql, self.plan.problems(), [i.sql() for i in self.plan.indexes])
+
+
+class ExplainSampler(object):
+    """
+    对超过阈值的DBQuery查询执行EXPLAIN,报告全表扫描/filesort/临时表并建议索引
+    """
+
+    def __init__(self, threshold=1.0, sample_rate=1.0, callback=None, interval=60, logger=None):
+        """
+        :param threshold: 慢查询阈值(秒)
+        :param sample_rate: 超过阈值的查询的采样比例
+        :param callback: callback(ExplainReport),默认在执行计划有问题时记录日志
+        :param interval: 同一语句两次EXPLAIN的最小间隔(秒)
+        :param logger:
+        """
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.callback = callback
+        self.interval = interval
+        self.logger = logger or logging.getLogger("ExplainSampler")
+        self.__last = {}
+
+    def observe(self, session, query, sql, args, elapsed, target=None):
+        """
+        记录一次查询,满足条件时执行EXPLAIN
+        :param session: DBSession
+        :param query: Query
+        :param sql:
+        :param args:
+        :param elapsed: 查询耗时(秒)
+        :param target: 执行查询的主库/从库
+        :return: ExplainReport|None
+        """
+        if elapsed < self.threshold:
+            return None
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        now = time.monotonic()
+        last = self.__last.get(sql)
+        if last is not None and now - last < self.interval:
+            return None
+        if len(self.__last) >= 1024:
+            self.__last.clear()
+        self.__last[sql] = now
+        try:
+            plan = session.explain(sql, args, target).advise(query)
+        except Exception as e:
+            self.logger.warning("explain failed %s : %s", e, sql)
+            return None
+        report = ExplainReport(sql, args, elapsed, plan)
+        if self.callback is not None:
+            self.callback(report)
+        elif plan.problems():
+            self.logger.warning("slow query %.3fs %s : %s, suggested indexes: %s", elapsed, plan.problems(), sql,
+                                "; ".join(i.sql() for i in plan.indexes) or "none")
+        return report
+
+    def install(self, target):
+        """
+        :param target: DBSession/SessionManager/ShardedSessionManager
+        """
+        sessions = getattr(target, 'sessions', None) or [getattr(target, 'session', target)]
+        for s in sessions:
+            s.explain_sampler = self
+        return self
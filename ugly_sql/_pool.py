@@ -0,0 +1,240 @@
+# coding:utf-8
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from ._cache import new_namespace
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+
+class PoolTimeout(Exception):
+    """等待可用连接超时"""
+
+
+class _PooledConn(object):
+    __slots__ = ('conn', 'created', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = self.last_used = time.time()
+
+
+class ConnectionPool(object):
+    """
+    线程安全的数据库连接池
+    """
+    logger = logging.getLogger("ConnectionPool")
+
+    def __init__(self, connect, min_size=0, max_size=8, idle_timeout=300, max_lifetime=3600, pre_ping=True,
+                 wait_timeout=30, reset_on_return=True):
+        """
+        :param connect: 创建数据库连接的函数
+        :param min_size: 保持的最小连接数
+        :param max_size: 最大连接数
+        :param idle_timeout: 空闲连接的回收时间(秒),None不回收
+        :param max_lifetime: 连接的最长使用时间(秒),None不限制
+        :param pre_ping: 取出连接前检查连接是否可用
+        :param wait_timeout: 等待可用连接的超时时间(秒),None一直等待
+        :param reset_on_return: 归还连接时回滚未提交的事务
+        """
+        assert max_size > 0 and 0 <= min_size <= max_size
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.pre_ping = pre_ping
+        self.wait_timeout = wait_timeout
+        self.reset_on_return = reset_on_return
+        # 由此创建的会话共享查询结果缓存,连接同一数据库的连接池可设置为相同的值(如DSN)
+        self.cache_key = new_namespace()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._closed = False
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        for _ in range(min_size):
+            self._idle.append(self.__new_conn())
+            self._size += 1
+
+    def __new_conn(self):
+        pc = _PooledConn(self._connect())
+        self._created += 1
+        return pc
+
+    def __expired(self, pc, now):
+        if self.max_lifetime is not None and now - pc.created > self.max_lifetime:
+            return True
+        return self.idle_timeout is not None and now - pc.last_used > self.idle_timeout and self._size > self.min_size
+
+    @staticmethod
+    def _ping(conn):
+        ping = getattr(conn, 'ping', None)
+        if ping is not None:
+            try:
+                ping(False)
+            except TypeError:
+                ping()
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception as e:
+            ConnectionPool.logger.warning("close connection error %s", e)
+
+    def __discard(self, pc):
+        """调用时需持有锁"""
+        self._size -= 1
+        self._discarded += 1
+        self._cond.notify()
+        return pc.conn
+
+    def acquire(self, timeout=None):
+        """
+        取出连接
+        :param timeout: 等待超时时间,未指定时使用wait_timeout
+        :return: 数据库连接
+        """
+        timeout = self.wait_timeout if timeout is None else timeout
+        start = time.time()
+        waited = False
+        while True:
+            stale = []
+            create = False
+            pc = None
+            with self._cond:
+                if self._closed:
+                    raise Exception("connection pool closed")
+                now = time.time()
+                while self._idle and self.__expired(self._idle[0], now):
+                    stale.append(self.__discard(self._idle.popleft()))
+                while self._idle:
+                    # 后进先出,取出的连接需再次检查是否过期(max_lifetime与归还顺序无关)
+                    pc = self._idle.pop()
+                    if not self.__expired(pc, now):
+                        break
+                    stale.append(self.__discard(pc))
+                    pc = None
+                if pc is None and not stale:
+                    if self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                    else:
+                        waited = True
+                        remain = None if timeout is None else timeout - (now - start)
+                        if remain is not None and remain <= 0:
+                            self._timeouts += 1
+                            raise PoolTimeout("no connection available after {}s".format(timeout))
+                        self._cond.wait(remain)
+                        continue
+            for conn in stale:
+                self._close(conn)
+            if pc is None and not create:
+                continue
+            if create:
+                try:
+                    pc = self.__new_conn()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif self.pre_ping:
+                try:
+                    self._ping(pc.conn)
+                except Exception as e:
+                    self.logger.warning("pre-ping failed, discard connection: %s", e)
+                    with self._cond:
+                        self.__discard(pc)
+                    self._close(pc.conn)
+                    continue
+            with self._cond:
+                self._in_use[id(pc.conn)] = pc
+                self._checkouts += 1
+                if waited:
+                    self._waits += 1
+                elapsed = time.time() - start
+                self._wait_time += elapsed
+                self._max_wait_time = max(self._max_wait_time, elapsed)
+            return pc.conn
+
+    def release(self, conn, discard=False):
+        """
+        归还连接
+        :param conn: 数据库连接
+        :param discard: 是否丢弃连接
+        """
+        if not discard and self.reset_on_return:
+            try:
+                conn.rollback()
+            except Exception as e:
+                self.logger.warning("reset connection error %s", e)
+                discard = True
+        with self._cond:
+            pc = self._in_use.pop(id(conn), None)
+            if pc is None:
+                raise ValueError("connection not belong to this pool")
+            if discard or self._closed or (
+                    self.max_lifetime is not None and time.time() - pc.created > self.max_lifetime):
+                self.__discard(pc)
+            else:
+                pc.last_used = time.time()
+                self._idle.append(pc)
+                self._cond.notify()
+                return
+        self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """取出连接,使用完毕后自动归还;发生异常时丢弃连接"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self):
+        """
+        连接池状态
+        :return: dict
+        """
+        with self._cond:
+            return dict(
+                size=self._size, in_use=len(self._in_use), idle=len(self._idle), max_size=self.max_size,
+                checkouts=self._checkouts, waits=self._waits, timeouts=self._timeouts,
+                wait_time=self._wait_time, max_wait_time=self._max_wait_time,
+                avg_wait_time=self._wait_time / self._checkouts if self._checkouts else 0.0,
+                created=self._created, discarded=self._discarded,
+            )
+
+    def close(self):
+        """关闭连接池及所有空闲连接"""
+        with self._cond:
+            self._closed = True
+            idle = [pc.conn for pc in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
@@ -0,0 +1,120 @@
+# coding:utf-8
+from ._db import BindParam, _Expanding
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+
+class PreparedStatement(object):
+    """
+    预处理语句:编译一次,使用不同的参数多次执行
+        驱动支持时(如mysql-connector的prepared cursor)使用服务端预处理语句
+    """
+
+    def __init__(self, session, sql, args, server_side=True):
+        """
+        :param session: 数据库会话
+        :param sql: 编译后的SQL
+        :param args: 参数模板,BindParam在执行时替换为参数值
+        :param server_side: 是否尝试使用服务端预处理语句
+        """
+        self.session = session
+        self.sql = sql
+        self.server_side = server_side
+        self.__args = tuple(args)
+        self.__names = set(a.name for a in self.__args if isinstance(a, BindParam))
+        self.__expanding = any(isinstance(a, _Expanding) for a in self.__args)
+        self.__expanded = {}
+
+    def params(self):
+        """
+        :return: 需要传入的参数名
+        """
+        return set(self.__names)
+
+    def bind(self, params):
+        """
+        生成执行的SQL和参数
+        :param params: {参数名: 值}
+        :return: (sql, args)
+        """
+        missing = self.__names - set(params)
+        if missing:
+            raise KeyError("missing bind parameters: {}".format(", ".join(sorted(missing))))
+        if not self.__expanding:
+            return self.sql, tuple(params[a.name] if isinstance(a, BindParam) else a for a in self.__args)
+        args = []
+        sizes = []
+        for a in self.__args:
+            if isinstance(a, _Expanding):
+                values = tuple(params[a.name])
+                if not values:
+                    raise ValueError("empty IN list for bind parameter '{}'".format(a.name))
+                args.extend(values)
+                sizes.append((a, len(values)))
+            elif isinstance(a, BindParam):
+                args.append(params[a.name])
+            else:
+                args.append(a)
+        key = tuple(n for _, n in sizes)
+        sql = self.__expanded.get(key)
+        if sql is None:
+            sql = self.sql
+            for a, n in sizes:
+                sql = sql.replace(a.expand_marker(), ",".join("%s" for _ in range(n)), 1)
+            self.__expanded[key] = sql
+        return sql, tuple(args)
+
+    def execute(self, **params):
+        """
+        执行语句
+        :return: 影响行数
+        """
+        sql, args = self.bind(params)
+        return self.session.execute_prepared(sql, args, server_side=self.server_side)
+
+    def executemany(self, params_list):
+        """
+        使用多组参数执行语句(cursor.executemany)
+        :param params_list: [{参数名: 值}, ...]
+        :return: 影响行数
+        """
+        groups = {}
+        order = []
+        for params in params_list:
+            sql, args = self.bind(params)
+            if sql not in groups:
+                groups[sql] = []
+                order.append(sql)
+            groups[sql].append(args)
+        count = 0
+        for sql in order:
+            count += self.session.execute_prepared(sql, groups[sql], many=True, server_side=self.server_side)
+        return count
+
+
+class PreparedQuery(PreparedStatement):
+    """
+    预处理查询,返回结果与DBQuery.all()相同
+    """
+
+    def __init__(self, session, sql, args, render, server_side=True):
+        PreparedStatement.__init__(self, session, sql, args, server_side)
+        self.__render = render
+
+    def execute(self, **params):
+        """
+        :return: list
+        """
+        sql, args = self.bind(params)
+        rows = self.session.execute_prepared(sql, args, fetch=True, server_side=self.server_side)
+        return [self.__render(row) for row in rows]
+
+    def one(self, **params):
+        rows = self.execute(**params)
+        return rows[0] if rows else None
+
+    def executemany(self, params_list):
+        """
+        :return: 每组参数的查询结果
+        """
+        return [self.execute(**params) for params in params_list]
@@ -0,0 +1,124 @@
+# coding:utf-8
+"""读写分离"""
+import itertools
+import logging
+import time
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+# DB-API中表示连接断开、服务器不可用等问题的异常类名,各驱动的异常类不同,按类名判断
+_CONNECTION_ERRORS = ('OperationalError', 'InterfaceError')
+
+
+def connection_error(e):
+    """
+    连接或服务器错误:从库暂停使用并改读主库;SQL语法、参数等错误在主库上同样会出错,不属于此类
+    :param e: 异常
+    :return: bool
+    """
+    if isinstance(e, (OSError, EOFError)):
+        return True
+    return any(c.__name__ in _CONNECTION_ERRORS for c in type(e).__mro__)
+
+
+class ReplicaSet(object):
+    """
+    从库连接集合,按策略选择执行读操作的从库
+    """
+    logger = logging.getLogger("ReplicaSet")
+    ROUND_ROBIN = "round_robin"
+    LEAST_LATENCY = "least_latency"
+
+    def __init__(self, connects, policy=ROUND_ROBIN, decay=0.2, retry_after=30):
+        """
+        :param connects: 创建从库连接的函数列表,首次使用时创建连接
+        :param policy: round_robin(轮询)|least_latency(平均延迟最低)
+        :param decay: 计算平均延迟的衰减系数(指数移动平均)
+        :param retry_after: 从库出错后暂停使用的时间(秒)
+        """
+        assert connects and policy in (self.ROUND_ROBIN, self.LEAST_LATENCY)
+        self.policy = policy
+        self.decay = decay
+        self.retry_after = retry_after
+        self.__connects = list(connects)
+        self.__conns = [None] * len(self.__connects)
+        self.__latency = [0.0] * len(self.__connects)
+        self.__reads = [0] * len(self.__connects)
+        self.__down = [None] * len(self.__connects)
+        self.__counter = itertools.count()
+
+    def __len__(self):
+        return len(self.__connects)
+
+    def choose(self):
+        """
+        选择从库
+        :return: 从库序号,没有可用的从库时返回None
+        """
+        now = time.time()
+        candidates = [i for i, down in enumerate(self.__down) if down is None or now - down > self.retry_after]
+        if not candidates:
+            return None
+        if self.policy == self.LEAST_LATENCY:
+            return min(candidates, key=lambda i: self.__latency[i])
+        return candidates[next(self.__counter) % len(candidates)]
+
+    def connection(self, index):
+        """
+        从库连接,首次使用时创建;创建失败时暂停使用该从库
+        :param index: 从库序号
+        :return: 连接,创建失败时返回None
+        """
+        conn = self.__conns[index]
+        if conn is None:
+            try:
+                conn = self.__conns[index] = self.__connects[index]()
+            except Exception as e:
+                self.failed(index, e)
+        return conn
+
+    def record(self, index, elapsed):
+        """
+        记录读操作的耗时
+        :param index: 从库序号
+        :param elapsed: 耗时(秒)
+        """
+        self.__down[index] = None
+        n = self.__reads[index]
+        self.__reads[index] = n + 1
+        latency = self.__latency[index]
+        self.__latency[index] = elapsed if n == 0 else latency + (elapsed - latency) * self.decay
+
+    def failed(self, index, error=None):
+        """
+        从库出错:关闭连接并在retry_after秒内不再使用
+        :param index: 从库序号
+        :param error: 异常
+        """
+        self.logger.warning("replica %s failed, fall back to primary: %s", index, error)
+        self.__down[index] = time.time()
+        self.__close(index)
+
+    def __close(self, index):
+        conn, self.__conns[index] = self.__conns[index], None
+        if conn is None:
+            return
+        try:
+            conn.close()
+        except Exception as e:
+            self.logger.warning("close replica connection error %s", e)
+
+    def stats(self):
+        """
+        各从库的状态
+        :return: [dict]
+        """
+        now = time.time()
+        return [dict(reads=self.__reads[i], latency=self.__latency[i],
+                     available=self.__down[i] is None or now - self.__down[i] > self.retry_after)
+                for i in range(len(self.__connects))]
+
+    def close(self):
+        """关闭已创建的从库连接"""
+        for i in range(len(self.__conns)):
+            self.__close(i)
@@ -1,24 +1,280 @@
 # coding:utf-8
 __author__ = 'Memory_Leak<irealing@163.com>'
 
+import importlib
 import logging
 import sys
+import time
+import weakref
 
-from ._db import Insert
-from ._util import DBObjProxy
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ._db import Insert, InsertMany, CaseUpdate, Update, Upsert, Query, Table, get_dialect
+from ._cache import invalidate_tables, written_table, new_namespace
+from ._dao_impl import DBQuery
+from ._events import Events, run
+from ._batch import QueryBatch
+from ._explain import ExplainSampler, QueryPlan
+from ._replica import ReplicaSet, connection_error
+from ._util import make_row
+
+
+# 各驱动的非缓冲(服务端)游标
+_SS_CURSORS = {
+    'pymysql': ('pymysql.cursors', 'SSCursor'),
+    'MySQLdb': ('MySQLdb.cursors', 'SSCursor'),
+    'aiomysql': ('aiomysql', 'SSCursor'),
+}
+
+
+# CLIENT.MULTI_STATEMENTS
+_MULTI_STATEMENTS = 1 << 16
+
+
+def _multi_statements(conn):
+    """
+    连接是否允许一次执行多条语句(pymysql/MySQLdb: client_flag包含CLIENT.MULTI_STATEMENTS)
+    :param conn:
+    :return: bool
+    """
+    flag = getattr(conn, 'client_flag', 0)
+    return isinstance(flag, int) and bool(flag & _MULTI_STATEMENTS)
+
+
+def _unbuffered_cursor(conn):
+    """
+    根据连接所属的驱动查找非缓冲游标类
+    :param conn:
+    :return: 游标类,不支持时返回None
+    """
+    driver = type(conn).__module__.split('.')[0]
+    if driver not in _SS_CURSORS:
+        return None
+    module, name = _SS_CURSORS[driver]
+    try:
+        return getattr(importlib.import_module(module), name)
+    except (ImportError, AttributeError):
+        return None
+
+
+def _insert_stmt(table, kwargs):
+    """
+    生成单行INSERT语句并检查字段
+    :param table:
+    :param kwargs:
+    :return: Insert
+    """
+    tk = set(table.table_columns_())
+    ak = set(kwargs.keys())
+    unexpected = ak - tk
+    if unexpected:
+        raise NameError(*unexpected)
+    if table.primary_auto and table.primary_key.name in ak:
+        raise AttributeError("auto-generate primary key {}".format(table.primary_key.name))
+    ins = Insert(table)
+    for k, v in kwargs.items():
+        ins.set(getattr(ins.table, k) == v)
+    return ins
+
+
+def _created_row(ins, lastrowid, session):
+    obj = dict(zip(ins.keys(), ins.args()))
+    if ins.table.primary_auto:
+        obj[ins.table.primary_key.name] = lastrowid
+    return make_row(ins.table, obj, session)
+
+
+def _insert_batches(table, rows, batch_size, max_packet, make=InsertMany):
+    """
+    将多行数据分批为多行INSERT语句
+    :param table:
+    :param rows: dict列表
+    :param batch_size: 每条语句的最大行数
+    :param max_packet: 单条语句的大小上限
+    :param make: 生成语句的函数make(table, keys)
+    :return: generator of InsertMany
+    """
+    tk = set(table.table_columns_())
+    batch = None
+    size = 0
+    for row in rows:
+        keys = tuple(row)
+        if batch is None or batch.keys() != keys:
+            if batch is not None:
+                yield batch
+            unexpected = set(keys) - tk
+            if unexpected:
+                raise NameError(*unexpected)
+            batch = make(table, keys)
+            size = 0
+        values = tuple(row[k] for k in keys)
+        row_size = sum(len(v) if isinstance(v, (str, bytes)) else 8 for v in values) + 4 * len(keys)
+        if batch.rows and (len(batch.rows) >= batch_size or size + row_size > max_packet):
+            yield batch
+            batch = make(table, keys)
+            size = 0
+        batch.add(values)
+        size += row_size
+    if batch is not None and batch.rows:
+        yield batch
+
+
+def _upsert_batches(table, rows, update_columns, batch_size, max_packet, conflict, dialect):
+    """
+    将多行数据分批为多行INSERT ... ON DUPLICATE KEY UPDATE语句
+    :return: generator of Upsert
+    """
+    make = lambda t, keys: Upsert(t, keys, update_columns, conflict, dialect)
+    return _insert_batches(table, rows, batch_size, max_packet, make)
+
+
+def _named(cursor):
+    """多行结果转换为{字段名: 值}列表"""
+    names = [d[0] for d in cursor.description or ()]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def _evict_table(identity, table):
+    """从identity map中移除表的所有行对象"""
+    if identity is None:
+        return
+    name = table.table_name_
+    for key in [k for k in identity.keys() if k[0] == name]:
+        identity.pop(key, None)
+
+
+def _collect_created(ins, lastrowid, objs, render, session, step=1, first=True):
+    """
+    收集多行插入的结果,自增ID由lastrowid推算:
+        MySQL中lastrowid为本批次第一行的ID,之后各行依次增加auto_increment_increment;
+        要求同一语句插入的ID连续(innodb_autoinc_lock_mode为0或1,为2时并发插入的ID可能交错);
+        sqlite3中lastrowid为最后一行的ID
+    :type ins:InsertMany
+    :param step: 自增步长(auto_increment_increment)
+    :param first: lastrowid是否为第一行的ID
+    """
+    n = len(ins.rows)
+    auto_id = ins.table.primary_auto
+    keys = ins.keys()
+    pk = ins.table.primary_key.name
+    if auto_id:
+        start = lastrowid if first else lastrowid - (n - 1) * step
+        ids = range(start, start + n * step, step)
+    if not render:
+        if auto_id:
+            objs.extend(ids)
+        else:
+            idx = keys.index(pk) if pk in keys else None
+            objs.extend(None if idx is None else values[idx] for values in ins.rows)
+        return
+    for i, values in enumerate(ins.rows):
+        obj = dict(zip(keys, values))
+        if auto_id:
+            obj[pk] = ids[i]
+        objs.append(make_row(ins.table, obj, session))
+
+
+def _modify_statements(modify, batch_size, dialect=None):
+    """
+    合并同一行的多次修改,按表和修改的字段分组生成批量更新语句
+    :param modify: 已修改的行对象
+    :param batch_size: 单条语句合并的最大行数
+    :param dialect: SQL方言
+    :return: [Update|CaseUpdate]
+    """
+    pending = OrderedDict()
+    for m in modify:
+        pk = m._primary_value()
+        key = (m.table.table_name_, pk)
+        if key not in pending:
+            pending[key] = (m.table, pk, {})
+        pending[key][2].update(m._changes())
+    groups = OrderedDict()
+    for table, pk, changes in pending.values():
+        if not changes:
+            continue
+        cols = tuple(sorted(changes))
+        gk = (table.table_name_, cols)
+        if gk not in groups:
+            groups[gk] = (table, cols, [])
+        groups[gk][2].append((pk, tuple(changes[c] for c in cols)))
+    statements = []
+    for table, cols, rows in groups.values():
+        for i in range(0, len(rows), batch_size):
+            chunk = rows[i:i + batch_size]
+            if len(chunk) > 1:
+                mu = CaseUpdate(table, cols, chunk)
+            else:
+                pk, values = chunk[0]
+                mu = Update(table, dialect).set(*(table.fields[c] == v for c, v in zip(cols, values)))
+                mu.where(table.primary_key == pk)
+            statements.append(mu)
+    return statements
 
 
 class DBSession(object):
     """数据库会话工具"""
     logger = logging.getLogger("DBSession")
+    # 单条多行INSERT语句的大小上限,与MySQL max_allowed_packet对应
+    max_packet = 4 * 1024 * 1024
+    # 提交修改时单条UPDATE语句合并的最大行数
+    flush_batch_size = 500
+    # SQL方言(upsert等),名称或Dialect对象
+    dialect = "mysql"
+    # 慢查询执行计划采样(ExplainSampler),None不采样
+    explain_sampler = None
+    # 合并查询(query_many)时一次发送多条语句,None根据连接的client_flag判断
+    multi_statements = None
+    # 写操作提交后继续读主库的时间(秒),等待从库同步
+    read_your_writes = 1.0
 
-    def __init__(self, conn, transaction=False):
+    def __init__(self, conn, transaction=False, stream_cursor=None, identity_map=False, events=None, replicas=None,
+                 dialect=None, cache_key=None, replica_policy=ReplicaSet.ROUND_ROBIN):
+        """
+        :param conn: 数据库连接(主库)
+        :param transaction: 进入上下文时开启事务
+        :param stream_cursor: 流式查询使用的游标类,未指定时根据驱动选择非缓冲游标
+        :param identity_map: 同一会话中按(表, 主键)复用行对象(默认关闭)
+        :param events: 共享的事件监听器(Events)
+        :param replicas: 从库(ReplicaSet)或创建从库连接的函数列表,begin()开启的事务外且本会话没有未提交(或刚提交)的写操作时
+            查询使用从库;由函数列表创建的从库连接在退出会话时关闭,传入的ReplicaSet由调用方关闭
+        :param dialect: SQL方言,默认为mysql
+        :param cache_key: 查询结果缓存的命名空间(如DSN),连接同一数据库的会话使用相同的值以共享缓存,
+            默认每个会话独立
+        :param replica_policy: 由函数列表创建从库时选择从库的策略,round_robin|least_latency
+        """
+        if dialect is not None:
+            self.dialect = dialect
+        self.cache_key = new_namespace() if cache_key is None else cache_key
+        self._events = events
+        self.__own_replicas = replicas is not None and not isinstance(replicas, ReplicaSet)
+        self.replicas = ReplicaSet(replicas, replica_policy) if self.__own_replicas else replicas
+        self._identity = weakref.WeakValueDictionary() if identity_map else None
         self.__conn = conn
+        self.__stream_cursor = stream_cursor
+        self.__ps_cursor = None
         self.__cursor = self.__conn.cursor()
         self.__begin = False
         self.__commit = False
         self.__tran = transaction
         self.__modify = []
+        self.__written = set()
+        self.__primary = False
+        self.__primary_until = 0
+        self.__explicit = False
+        self.__temp_depth = 0
+        self.__id_step = None
+
+    def listen(self, name, fn):
+        """
+        注册事件监听器
+        :param name: before_execute|after_execute|on_error|on_commit
+        :param fn: fn(event)
+        """
+        if self._events is None:
+            self._events = Events()
+        return self._events.listen(name, fn)
 
     def _register_modify(self, update):
         self.__modify.append(update)
@@ -30,7 +286,10 @@ class DBSession(object):
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.__begin and not self.__commit:
-            self.__cursor.execute("ROLLBACK;")
+            run(self._events, self.__cursor, "ROLLBACK;", (), self)
+            self.clear_identity()
+            self.__invalidate_written()
+            self.__primary = self.__explicit = False
         if exc_val:
             _, _, tb = sys.exc_info()
             if tb.tb_next is not None:
@@ -38,58 +297,363 @@ class DBSession(object):
             cn = exc_val.__class__.__name__
             es = "{}:{}:{}".format(tb.tb_frame.f_code.co_filename, cn, tb.tb_lineno)
             logging.warning("db context error %s : %s", es, exc_val)
+        if self.__own_replicas:
+            self.replicas.close()
+
+    def __wrote(self, table_name):
+        """记录写操作并使相关的查询结果缓存失效"""
+        self.__primary = True
+        if table_name:
+            invalidate_tables(table_name)
+            self.__written.add(table_name)
+
+    def __invalidate_written(self):
+        if self.__written:
+            invalidate_tables(*self.__written)
+            self.__written.clear()
+
+    def clear_identity(self):
+        """清空会话中缓存的行对象"""
+        if self._identity is not None:
+            self._identity.clear()
+
+    def get(self, table, pk):
+        """
+        按主键获取行对象,会话中已存在时不查询数据库
+        :param table:
+        :param pk: 主键值
+        :return: 行对象|None
+        """
+        return self.get_many(table, (pk,))[0]
+
+    def get_many(self, table, pks):
+        """
+        按主键批量获取行对象,会话中不存在的行合并为一次IN查询
+        :param table:
+        :param pks: 主键值列表
+        :return: 与pks顺序对应的行对象列表,不存在的为None
+        """
+        found = {}
+        misses = []
+        name = table.table_name_
+        for pk in pks:
+            obj = self._identity.get((name, pk)) if self._identity is not None else None
+            if obj is None:
+                if pk not in found:
+                    misses.append(pk)
+                    found[pk] = None
+            else:
+                found[pk] = obj
+        if misses:
+            pk_name = table.primary_key.name
+            for obj in DBQuery(self, table).filter(table.primary_key.in_(misses)).all():
+                found[getattr(obj, pk_name)] = obj
+        return [found.get(pk) for pk in pks]
+
+    @property
+    def in_transaction(self):
+        """是否已开启事务"""
+        return self.__begin
+
+    @property
+    def uncommitted_tables(self):
+        """本会话写入后尚未提交或回滚的表名"""
+        return self.__written
 
     def begin(self):
+        """
+        开启事务,提交前的查询使用主库
+        """
+        self.__start()
+        self.__explicit = True
+
+    def __start(self):
         if not self.__begin:
-            self.__cursor.execute('BEGIN;')
+            run(self._events, self.__cursor, 'BEGIN;', (), self)
             self.__begin = True
 
-    def __query(self, sql, params, rows=False):
+    def __replica(self, target):
+        """
+        选择执行读操作的从库
+        :param target: None自动选择,"primary"使用主库,"replica"使用从库
+        :return: (从库序号, 连接),使用主库时返回(None, None)
+        """
+        if self.replicas is None or target == "primary":
+            return None, None
+        if target != "replica" and (self.__explicit or self.__primary or time.monotonic() < self.__primary_until):
+            # begin()开启的事务中、本会话写入后到提交后read_your_writes秒内读主库,保证读到自己的修改
+            return None, None
+        index = self.replicas.choose()
+        conn = None if index is None else self.replicas.connection(index)
+        return (None, None) if conn is None else (index, conn)
+
+    def __query(self, sql, params, rows=False, target=None, named=False):
         """
         查询
         :param sql:
         :param rows:多行返回
         :param params:
+        :param target: 读主库/从库
+        :param named: 多行返回时每行为{字段名: 值}
         :return:
         """
         self.logger.debug("execute sql : %s", sql)
-        self.__cursor.execute(sql, params)
+        index, conn = self.__replica(target)
+        if index is not None:
+            start = time.perf_counter()
+            try:
+                cursor = conn.cursor()
+                try:
+                    run(self._events, cursor, sql, params, self)
+                    data = _named(cursor) if named else cursor.fetchall() if rows else cursor.fetchone()
+                finally:
+                    cursor.close()
+            except Exception as e:
+                if not connection_error(e):
+                    raise
+                self.replicas.failed(index, e)
+            else:
+                self.replicas.record(index, time.perf_counter() - start)
+                return data
+        run(self._events, self.__cursor, sql, params, self)
+        if named:
+            return _named(self.__cursor)
         return self.__cursor.fetchall() if rows else self.__cursor.fetchone()
 
-    def query(self, sql, params):
+    def query(self, sql, params, target=None):
         """
         查询多行
         :param sql:
         :param params:
+        :param target: None自动选择,"primary"使用主库,"replica"使用从库
         :return:
         """
-        return self.__query(sql, params, True)
+        return self.__query(sql, params, True, target)
 
-    def one(self, sql, params):
+    def one(self, sql, params, target=None):
         """
         查询一行
         :param sql:
         :param params:
+        :param target: None自动选择,"primary"使用主库,"replica"使用从库
         :return:
         """
-        return self.__query(sql, params, False)
+        return self.__query(sql, params, False, target)
+
+    def batch(self):
+        """
+        合并查询,多条DBQuery在一次网络往返中执行
+        :return: QueryBatch
+        """
+        return QueryBatch(self)
+
+    def query_many(self, statements, target=None):
+        """
+        执行多条查询:连接允许多语句时以分号连接后一次发送,按nextset()读取各条语句的结果;
+            否则在同一连接上依次执行
+        :param statements: [(sql, params)]
+        :param target: None自动选择,"primary"使用主库,"replica"使用从库
+        :return: 各语句的结果行列表
+        """
+        if not statements:
+            return []
+        index, conn = self.__replica(target)
+        if index is not None:
+            start = time.perf_counter()
+            try:
+                cursor = conn.cursor()
+                try:
+                    data = self.__run_many(conn, cursor, statements)
+                finally:
+                    cursor.close()
+            except Exception as e:
+                if not connection_error(e):
+                    raise
+                self.replicas.failed(index, e)
+            else:
+                self.replicas.record(index, time.perf_counter() - start)
+                return data
+        return self.__run_many(self.__conn, self.__cursor, statements)
+
+    def __run_many(self, conn, cursor, statements):
+        multi = self.multi_statements
+        if multi is None:
+            multi = _multi_statements(conn)
+        if not multi or len(statements) == 1 or not hasattr(cursor, 'nextset'):
+            result = []
+            for sql, params in statements:
+                self.logger.debug("execute sql : %s", sql)
+                run(self._events, cursor, sql, params, self)
+                result.append(cursor.fetchall())
+            return result
+        sql = ";".join(s for s, _ in statements)
+        params = []
+        for _, p in statements:
+            params.extend(p)
+        self.logger.debug("execute sql : %s", sql)
+        run(self._events, cursor, sql, params, self)
+        result = [cursor.fetchall()]
+        while len(result) < len(statements):
+            if not cursor.nextset():
+                raise Exception("expected {} result sets, got {}".format(len(statements), len(result)))
+            result.append(cursor.fetchall())
+        # 读完剩余的结果集,连接才能执行下一条语句
+        while cursor.nextset():
+            pass
+        return result
+
+    def explain(self, sql, params, target=None):
+        """
+        查询语句的执行计划(EXPLAIN)
+        :param sql: SELECT语句
+        :param params:
+        :param target: None自动选择,"primary"使用主库,"replica"使用从库
+        :return: QueryPlan
+        """
+        return QueryPlan(self.__query("EXPLAIN " + sql, params, True, target, named=True))
+
+    def explain_slow(self, threshold=1.0, sample_rate=1.0, callback=None, interval=60):
+        """
+        开启慢查询执行计划采样:DBQuery查询超过阈值时执行EXPLAIN,
+            报告全表扫描/filesort/临时表并根据查询条件、连接和排序字段建议索引
+        :param threshold: 慢查询阈值(秒),None关闭采样
+        :param sample_rate: 超过阈值的查询的采样比例
+        :param callback: callback(ExplainReport),默认在执行计划有问题时记录日志
+        :param interval: 同一语句两次EXPLAIN的最小间隔(秒)
+        :return: ExplainSampler|None
+        """
+        if threshold is None:
+            self.explain_sampler = None
+            return None
+        return ExplainSampler(threshold, sample_rate, callback, interval).install(self)
+
+    def iter(self, sql, params, batch_size=1000, target=None):
+        """
+        流式查询,使用非缓冲游标逐批(fetchmany)读取
+            迭代结束前同一连接不能执行其他语句
+        :param sql:
+        :param params:
+        :param batch_size: 每批读取的行数
+        :param target: None自动选择,"primary"使用主库,"replica"使用从库
+        :return: generator
+        """
+        for rows in self.iter_batches(sql, params, batch_size, target):
+            for row in rows:
+                yield row
+
+    def iter_batches(self, sql, params, batch_size=1000, target=None):
+        """
+        流式查询,逐批返回fetchmany的结果
+        :return: generator of list
+        """
+        index, conn = self.__replica(target)
+        if conn is None:
+            conn = self.__conn
+        cls = self.__stream_cursor or _unbuffered_cursor(conn)
+        cursor = conn.cursor(cls) if cls else conn.cursor()
+        try:
+            self.logger.debug("execute sql : %s", sql)
+            run(self._events, cursor, sql, params, self)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def temp_values(self, field, values, batch_size=1000):
+        """
+        将大量取值写入临时表,以子查询代替超长的IN列表;退出时删除临时表
+            临时表只在当前连接(主库)中可见
+        :param field: 取值对应的字段,临时表字段的类型与其相同
+        :param values: 取值列表
+        :param batch_size: 每条INSERT语句的最大行数
+        :return: Query(SELECT v FROM 临时表)
+        """
+        name = "_ugly_in_{}".format(self.__temp_depth)
+        tmp = Table(name, ("v",), "v", primary_auto=False)
+        sql = "CREATE TEMPORARY TABLE `{}` AS SELECT {} AS `v` FROM `{}` LIMIT 0".format(name, field.sql(), field.table)
+        run(self._events, self.__cursor, sql, (), self)
+        self.__temp_depth += 1
+        try:
+            for ins in _insert_batches(tmp, ({"v": v} for v in values), batch_size, self.max_packet):
+                run(self._events, self.__cursor, ins.sql(), ins.args(), self)
+            yield Query(tmp, tmp.v)
+        finally:
+            self.__temp_depth -= 1
+            run(self._events, self.__cursor, get_dialect(self.dialect).drop_temporary(name), (), self)
 
     def __do_modify(self):
+        """
+        提交修改:同一行的多次修改合并,按表和修改的字段分组后批量更新
+        """
         if not self.__modify:
             return
-        while self.__modify:
-            m = self.__modify.pop(0)
-            mu = m.__modify__()
-            self.update(mu.sql(), mu.args())
+        modify, self.__modify = self.__modify, []
+        try:
+            for mu in _modify_statements(modify, self.flush_batch_size, self.dialect):
+                self.update(mu.sql(), mu.args())
+        except Exception:
+            self.__modify = modify + self.__modify
+            raise
+        for m in modify:
+            m._flushed()
+
+    def __prepared_cursor(self):
+        """
+        服务端预处理语句游标(mysql-connector: cursor(prepared=True))
+        :return: 游标,驱动不支持时返回None
+        """
+        if self.__ps_cursor is None:
+            try:
+                self.__ps_cursor = self.__conn.cursor(prepared=True)
+            except TypeError:
+                self.__ps_cursor = False
+        return self.__ps_cursor or None
+
+    def execute_prepared(self, sql, params, fetch=False, many=False, server_side=True):
+        """
+        执行预处理语句
+        :param sql:
+        :param params: 参数,many为True时为参数列表
+        :param fetch: 返回查询结果
+        :param many: 使用executemany
+        :param server_side: 驱动支持时使用服务端预处理语句
+        :return: 查询结果|影响行数
+        """
+        cursor = (self.__prepared_cursor() if server_side else None) or self.__cursor
+        self.logger.debug("execute prepared sql : %s", sql)
+        run(self._events, cursor, sql, params, self, many)
+        if fetch:
+            return cursor.fetchall()
+        self.__wrote(written_table(sql))
+        return cursor.rowcount
 
     def update(self, sql, params):
         """
         更新数据
         :param sql:
         :param params:
-        :return:
+        :return: 影响行数
+        """
+        self.logger.debug("execute sql : %s", sql)
+        run(self._events, self.__cursor, sql, params, self)
+        self.__wrote(written_table(sql))
+        return self.__cursor.rowcount
+
+    def execute_bulk(self, stmt):
+        """
+        执行批量UPDATE/DELETE语句,先提交未写入的行对象修改
+            执行后从identity map中移除该表的行对象
+        :param stmt: Update|Delete
+        :return: 影响行数
         """
-        self.__cursor.execute(sql, params)
+        self.__do_modify()
+        count = self.update(stmt.sql(), stmt.args())
+        _evict_table(self._identity, stmt.table)
+        return max(count, 0)
 
     def commit(self, again=True):
         """
@@ -99,12 +663,21 @@ class DBSession(object):
         """
         if not self.__begin:
             raise Exception("must call begin before commit")
+        start = time.perf_counter()
         self.__do_modify()
-        self.__cursor.execute('COMMIT;')
+        run(self._events, self.__cursor, 'COMMIT;', (), self)
+        self.__invalidate_written()
+        if self.__primary:
+            self.__primary = False
+            self.__primary_until = time.monotonic() + self.read_your_writes
+        self.__explicit = False
+        if self._events is not None:
+            self._events.commit(self, start)
         self.__commit = True
         if again:
+            # 自动开启的事务不影响读从库
             self.__begin = False
-            self.begin()
+            self.__start()
             self.__commit = False
 
     def create(self, table, **kwargs):
@@ -114,31 +687,70 @@ class DBSession(object):
         :param kwargs:
         :return:
         """
-        tk = set(table.table_columns_())
-        ak = set(kwargs.keys())
-        unexpected = ak - tk
-        if unexpected:
-            raise NameError(*unexpected)
-        if table.primary_auto and table.primary_key.name in ak:
-            raise AttributeError("auto-generate primary key %s".format(not self.primary_key.name))
-        ins = Insert(table)
-        for k, v in kwargs.items():
-            ins.set(getattr(ins.table, k) == v)
-        return self.__create(ins, table.primary_auto)
-
-    def __create(self, ins, auto_id=False):
-        """
-        插入数据
-        :param ins:
-        :type ins:Insert
-        :param auto_id:
-        :return:
+        ins = _insert_stmt(table, kwargs)
+        run(self._events, self.__cursor, ins.sql(), list(ins.args()), self)
+        self.__wrote(table.table_name_)
+        return _created_row(ins, self.__cursor.lastrowid, self)
+
+    def create_many(self, table, rows, batch_size=1000, return_ids=False, render=True, max_packet=None):
         """
-        # cols = ins.table.table_columns_()
-        args = list(ins.args())
-        sql = ins.sql()
-        self.__cursor.execute(sql, args)
-        obj = dict(zip(ins.keys(), ins.args()))
-        if auto_id:
-            obj[ins.table.primary_key.name] = self.__cursor.lastrowid
-        return DBObjProxy(ins.table, obj, self)
+        批量生成记录,每批使用一条多行INSERT语句
+        :param table:
+        :param rows: dict列表,同一批次内的字段相同
+        :param batch_size: 每条INSERT语句的最大行数
+        :param return_ids: render为False时返回自增ID列表
+        :param render: 是否返回数据对象
+        :param max_packet: 单条语句的大小上限,默认为max_packet
+        :return: 数据对象列表|自增ID列表|影响行数
+        """
+        max_packet = self.max_packet if max_packet is None else max_packet
+        objs = [] if render or return_ids else None
+        count = 0
+        dialect = get_dialect(self.dialect)
+        step = self.__auto_increment() if objs is not None and table.primary_auto else 1
+        for ins in _insert_batches(table, rows, batch_size, max_packet):
+            run(self._events, self.__cursor, ins.sql(), ins.args(), self)
+            self.__wrote(table.table_name_)
+            count += len(ins.rows)
+            if objs is not None:
+                _collect_created(ins, self.__cursor.lastrowid, objs, render, self, step, dialect.lastrowid_first)
+        return count if objs is None else objs
+
+    def __auto_increment(self):
+        """
+        自增步长(auto_increment_increment),每个会话查询一次
+        :return: int
+        """
+        if self.__id_step is None:
+            sql = get_dialect(self.dialect).auto_increment_sql
+            if sql is None:
+                self.__id_step = 1
+            else:
+                run(self._events, self.__cursor, sql, (), self)
+                row = self.__cursor.fetchone()
+                self.__id_step = int(row[0]) if row and row[0] else 1
+        return self.__id_step
+
+    def upsert_many(self, table, rows, update_columns=None, batch_size=1000, conflict=None, max_packet=None,
+                    dialect=None):
+        """
+        批量插入,主键/唯一索引冲突时更新,每批使用一条多行语句
+        :param table:
+        :param rows: dict列表,同一批次内的字段相同
+        :param update_columns: 冲突时更新的字段名,默认为除主键(conflict)外的所有字段,空列表表示不更新
+        :param batch_size: 每条语句的最大行数
+        :param conflict: 判断冲突的字段名(SQLite ON CONFLICT),默认为主键
+        :param max_packet: 单条语句的大小上限,默认为max_packet
+        :param dialect: SQL方言,默认为会话的dialect
+        :return: 影响行数(MySQL中插入计1,更新计2)
+        """
+        max_packet = self.max_packet if max_packet is None else max_packet
+        dialect = get_dialect(dialect or self.dialect)
+        count = 0
+        for ups in _upsert_batches(table, rows, update_columns, batch_size, max_packet, conflict, dialect):
+            run(self._events, self.__cursor, ups.sql(), ups.args(), self)
+            self.__wrote(table.table_name_)
+            count += max(self.__cursor.rowcount, 0)
+        # 已加载的行对象可能已被更新
+        _evict_table(self._identity, table)
+        return count
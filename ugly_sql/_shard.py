@@ -0,0 +1,370 @@
+# coding:utf-8
+"""分片会话"""
+import itertools
+import logging
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from ._columns import column_names, to_columns
+from ._dao_impl import DBQuery
+from ._db import FuncField, WrapField
+from ._events import Events
+from ._session import DBSession
+
+__author__ = 'Memory_Leak<irealing@163.com>'
+
+
+def mod_router(value, shard_count):
+    """
+    默认分片路由:整数取模,其他值按crc32取模
+    :param value: 分片字段的值
+    :param shard_count: 分片数量
+    :return: 分片序号
+    """
+    if isinstance(value, int):
+        return value % shard_count
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    return zlib.crc32(value) % shard_count
+
+
+def _shard_aggregates(fields):
+    """
+    多个分片的聚合:COUNT/SUM/MIN/MAX在各分片执行后合并,AVG拆分为SUM和COUNT
+    :param fields: FuncField
+    :return: (各分片执行的聚合函数, [(函数名, 结果的位置)])
+    """
+    pushed = []
+    plan = []
+    for f in fields:
+        func = getattr(f, 'func', None)
+        if func not in ('COUNT', 'SUM', 'MIN', 'MAX', 'AVG') or isinstance(f.operand, WrapField):
+            raise ValueError("aggregate {} on multiple shards is not supported, "
+                             "only COUNT/SUM/MIN/MAX/AVG without DISTINCT can be merged".format(f.sql()))
+        plan.append((func, len(pushed)))
+        if func == 'AVG':
+            pushed.extend((FuncField('SUM', f.operand), FuncField('COUNT', f.operand)))
+        else:
+            pushed.append(f)
+    return pushed, plan
+
+
+def _merge_aggregates(plan, rows):
+    """
+    合并各分片的聚合结果
+    :param plan: _shard_aggregates()
+    :param rows: 各分片的结果行
+    :return: list
+    """
+    result = []
+    for func, i in plan:
+        values = [r[i] for r in rows if r[i] is not None]
+        if func == 'COUNT':
+            result.append(sum(values))
+        elif func == 'AVG':
+            count = sum(r[i + 1] or 0 for r in rows)
+            result.append(sum(values) / count if count else None)
+        elif not values:
+            result.append(None)
+        else:
+            result.append({'SUM': sum, 'MIN': min, 'MAX': max}[func](values))
+    return result
+
+
+class ShardedQuery(DBQuery):
+    """
+    分片查询:条件包含分片字段的等值/IN条件时只查询对应的分片,否则并发查询所有分片后合并结果
+    """
+
+    def __init__(self, manager, table, *columns):
+        DBQuery.__init__(self, manager.sessions[0], table, *columns)
+        self.__manager = manager
+
+    def shards(self):
+        """
+        查询需要访问的分片
+        :return: 分片序号列表
+        """
+        select = self._select()
+        table = select.from_
+        if table.shard_key is None:
+            return [self.__manager.default_shard]
+        values = select.key_values(table.shard_key)
+        if values is None:
+            return list(range(len(self.__manager.sessions)))
+        return sorted(set(self.__manager.shard_for(table, v) for v in values))
+
+    def __sub_queries(self):
+        """
+        各分片的查询,有LIMIT时每个分片取offset+limit行
+        :return: [DBQuery]
+        """
+        rng = self._select().limit_range()
+        queries = []
+        for i in self.shards():
+            q = self._bind(self.__manager.sessions[i])
+            if rng is not None:
+                q._select().limit(rng[0] + rng[1])
+            queries.append(q)
+        return queries
+
+    def all(self):
+        queries = self.__sub_queries()
+        results = self.__manager.map(lambda q: list(q.all()), queries)
+        return list(self.__merge(results))
+
+    def __merge(self, results):
+        ordering = self._select().ordering()
+        return self._merge(results, lambda row: self._row_key(row, ordering), self._select().limit_range())
+
+    def one(self):
+        shards = self.shards()
+        if len(shards) == 1:
+            return self._bind(self.__manager.sessions[shards[0]]).one()
+        rng = self._select().limit_range()
+        rows = self.copy().limit(1, rng[0] if rng else 0).all()
+        return rows[0] if rows else None
+
+    def iter(self, batch_size=1000):
+        """
+        流式查询,各分片的结果按order_by归并
+        :param batch_size: 每批读取的行数
+        :return: generator
+        """
+        for row in self.__merge([q.iter(batch_size) for q in self.__sub_queries()]):
+            yield row
+
+    def to_columns(self, batch_size=10000, numpy=None):
+        """
+        按列读取查询结果,各分片的结果按分片顺序拼接(不按order_by归并)
+        """
+        shards = self.shards()
+        if len(shards) > 1 and self._select().limit_range() is not None:
+            raise ValueError("limit is not supported by to_columns on multiple shards")
+        sql, args = self._statement()
+        batches = itertools.chain.from_iterable(
+            self.__manager.sessions[i].iter_batches(sql, args, batch_size) for i in shards)
+        select = self._select()
+        return to_columns(batches, column_names(select.fields, select.load_columns), numpy)
+
+    def __bound(self):
+        return [self._bind(self.__manager.sessions[i]) for i in self.shards()]
+
+    def count(self):
+        """
+        各分片计数之和,GROUP BY/DISTINCT/LIMIT查询只能在单个分片计数
+        """
+        queries = self.__bound()
+        if len(queries) > 1 and not self._select().splittable():
+            raise ValueError("count of grouped/distinct/limited query on multiple shards is not supported")
+        return sum(self.__manager.map(lambda q: q.count(), queries))
+
+    def exists(self):
+        return any(self.__manager.map(lambda q: q.exists(), self.__bound()))
+
+    def aggregate(self, *fields):
+        """
+        聚合,查询多个分片时只支持COUNT/SUM/MIN/MAX/AVG(不含DISTINCT),且查询不能包含GROUP BY/DISTINCT/LIMIT
+        """
+        queries = self.__bound()
+        if len(queries) == 1:
+            return queries[0].aggregate(*fields)
+        if not self._select().splittable():
+            raise ValueError("aggregate of grouped/distinct/limited query on multiple shards is not supported")
+        pushed, plan = _shard_aggregates(fields)
+        rows = self.__manager.map(lambda q: q.aggregate(*pushed), queries)
+        if len(pushed) == 1:
+            rows = [(r,) for r in rows]
+        result = _merge_aggregates(plan, rows)
+        return result[0] if len(fields) == 1 else tuple(result)
+
+    def update(self, values):
+        """
+        在各分片批量更新,返回影响行数之和
+        """
+        return sum(self.__manager.map(lambda q: q.update(values), self.__bulk_queries()))
+
+    def delete(self):
+        return sum(self.__manager.map(lambda q: q.delete(), self.__bulk_queries()))
+
+    def delete_in_batches(self, batch_size=1000, commit=True, pause=0):
+        """
+        在各分片分别分批删除,返回删除的总行数
+        """
+        return sum(self.__manager.map(lambda q: q.delete_in_batches(batch_size, commit, pause), self.__bound()))
+
+    def __bulk_queries(self):
+        queries = self.__bound()
+        if len(queries) > 1 and self._select().limit_range() is not None:
+            raise ValueError("limited update/delete on multiple shards is not supported")
+        return queries
+
+    def _batch_statement(self, kind, session):
+        return None
+
+    def cached(self, ttl=None, cache=None):
+        """分片查询不支持结果缓存"""
+        raise TypeError("result cache is not supported by sharded query")
+
+    def prepare(self, server_side=True):
+        """分片查询不支持预处理语句,可对session_for()返回的分片会话使用"""
+        raise TypeError("prepared statement is not supported by sharded query")
+
+
+class ShardedSessionManager(object):
+    """
+    分片数据对象操作会话,每个分片一个数据库连接
+        表通过Table(shard_key=..., shard_router=...)声明分片字段,未声明的表保存在default_shard
+    """
+    logger = logging.getLogger("ShardedSessionManager")
+
+    def __init__(self, conns, max_workers=None, default_shard=0, stream_cursor=None, identity_map=False,
+                 events=None):
+        """
+        :param conns: 各分片的数据库连接
+        :param max_workers: 并发查询的线程数,默认为分片数
+        :param default_shard: 未分片的表所在的分片
+        :param stream_cursor: 流式查询使用的游标类
+        :param identity_map: 同一会话中按(表, 主键)复用行对象(默认关闭)
+        :param events: 共享的事件监听器(Events)
+        """
+        assert conns
+        self.sessions = [DBSession(c, stream_cursor=stream_cursor, identity_map=identity_map, events=events)
+                         for c in conns]
+        self.default_shard = default_shard
+        self.__events = events
+        self.__executor = ThreadPoolExecutor(max_workers or len(conns)) if len(conns) > 1 else None
+
+    def shard_for(self, table, value):
+        """
+        分片字段的值对应的分片
+        :param table:
+        :param value:
+        :return: 分片序号
+        """
+        if table.shard_key is None:
+            return self.default_shard
+        router = table.shard_router or mod_router
+        return router(value, len(self.sessions))
+
+    def session_for(self, table, value=None):
+        """
+        :return: 分片字段的值所在分片的DBSession
+        """
+        return self.sessions[self.shard_for(table, value)]
+
+    def __route(self, table, row):
+        if table.shard_key is None:
+            return self.default_shard
+        name = table.shard_key.name
+        if name not in row:
+            raise ValueError("shard key {} is required".format(name))
+        return self.shard_for(table, row[name])
+
+    def map(self, fn, items):
+        """
+        在线程池中并发执行,每个分片的连接同一时间只在一个线程中使用
+        :return: list
+        """
+        if len(items) < 2 or self.__executor is None:
+            return [fn(it) for it in items]
+        return list(self.__executor.map(fn, items))
+
+    def listen(self, name, fn):
+        if self.__events is None:
+            self.__events = Events()
+            for s in self.sessions:
+                s._events = self.__events
+        return self.__events.listen(name, fn)
+
+    def begin(self):
+        for s in self.sessions:
+            s.begin()
+
+    def __enter__(self):
+        for s in self.sessions:
+            s.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for s in self.sessions:
+            s.__exit__(exc_type, exc_val, exc_tb)
+
+    def query(self, table, *cols):
+        return ShardedQuery(self, table, *cols)
+
+    def commit(self):
+        """
+        依次提交各分片的修改(各分片分别提交,不保证跨分片的原子性)
+        """
+        for s in self.sessions:
+            s.commit()
+
+    def create(self, table, **kwargs):
+        return self.sessions[self.__route(table, kwargs)].create(table, **kwargs)
+
+    def create_many(self, table, rows, batch_size=1000, return_ids=False, render=True, max_packet=None):
+        """
+        按分片字段分组后在各分片批量插入
+        :return: 与rows顺序对应的数据对象列表|自增ID列表|影响行数
+        """
+        groups = {}
+        for i, row in enumerate(rows):
+            groups.setdefault(self.__route(table, row), []).append((i, row))
+        items = sorted(groups.items())
+
+        def insert(item):
+            shard, group = item
+            return self.sessions[shard].create_many(table, [row for _, row in group], batch_size, return_ids,
+                                                    render, max_packet)
+
+        results = self.map(insert, items)
+        if not render and not return_ids:
+            return sum(results)
+        objs = [None] * sum(len(group) for _, group in items)
+        for (_, group), result in zip(items, results):
+            for (i, _), obj in zip(group, result):
+                objs[i] = obj
+        return objs
+
+    def upsert_many(self, table, rows, update_columns=None, batch_size=1000, conflict=None, max_packet=None):
+        """
+        按分片字段分组后在各分片批量插入或更新
+        :return: 影响行数
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(self.__route(table, row), []).append(row)
+        return sum(self.map(lambda item: self.sessions[item[0]].upsert_many(
+            table, item[1], update_columns, batch_size, conflict, max_packet), sorted(groups.items())))
+
+    def get(self, table, pk):
+        return self.get_many(table, (pk,))[0]
+
+    def get_many(self, table, pks):
+        """
+        按主键批量获取,主键为分片字段时只查询对应的分片
+        :return: 与pks顺序对应的行对象列表,不存在的为None
+        """
+        key = table.shard_key
+        if key is None:
+            return self.sessions[self.default_shard].get_many(table, pks)
+        if key.name == table.primary_key.name:
+            groups = {}
+            for pk in pks:
+                groups.setdefault(self.shard_for(table, pk), []).append(pk)
+            items = sorted(groups.items())
+        else:
+            items = [(i, list(pks)) for i in range(len(self.sessions))]
+        found = {}
+        results = self.map(lambda it: self.sessions[it[0]].get_many(table, it[1]), items)
+        for (_, group), objs in zip(items, results):
+            for pk, obj in zip(group, objs):
+                if obj is not None:
+                    found[pk] = obj
+        return [found.get(pk) for pk in pks]
+
+    def close(self):
+        """关闭并发查询的线程池"""
+        if self.__executor is not None:
+            self.__executor.shutdown()
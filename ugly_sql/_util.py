@@ -1,6 +1,9 @@
 # coding:utf-8
+import inspect
+import keyword
+import weakref
 
-from ._db import Update
+from ._db import Query, Update
 
 from ._patch import local_map
 
@@ -19,10 +22,16 @@ class DBObjProxy(object):
         self.__dict__['_binding'] = False
         self.__dict__['_update'] = {}
         self.__dict__['_bind_session'] = bind_session
+        self.__dict__['_loader'] = None
+        self.__dict__['_related'] = None
 
     def __getattr__(self, item):
         if item in self._field_cache:
             return self._field_cache[item]
+        if item in self.table.relations:
+            return _get_related(self, self.table.relations[item])
+        if item not in self._raw and item in self.table.fields and self._loader is not None:
+            self._loader.load(item)
         if item not in self._raw:
             raise AttributeError("'{}' object has not attribute '{}'".format(self.__class__.__name__, item))
         v = self._raw[item]
@@ -37,11 +46,14 @@ class DBObjProxy(object):
         return self._raw.keys()
 
     def __setattr__(self, key, value):
-        if key not in self.table.table_columns_() or key == self.table.primary_key.name:
+        pk = self.table.primary_key
+        # 没有主键的表(如派生表)的行不能更新
+        if key not in self.table.table_columns_() or pk is None or key == pk.name:
             raise AttributeError("attribute '{}' of '{}' object is read-only ".format(key, self.__class__.__name__))
         self._update[key] = getattr(self.table, key) == value
         self._raw[key] = value
         if not self._binding:
+            self.__dict__['_binding'] = True
             self._bind_session._register_modify(self)
 
     def __modify__(self):
@@ -50,9 +62,408 @@ class DBObjProxy(object):
         m.where(self.table.primary_key == self._raw[self.table.primary_key.name])
         return m
 
+    def _primary_value(self):
+        return self._raw[self.table.primary_key.name]
+
+    def _changes(self):
+        """
+        未提交的修改
+        :return: {字段名: 值}
+        """
+        return dict((k, self._raw[k]) for k in self._update)
+
+    def _flushed(self):
+        self._update.clear()
+        self.__dict__['_binding'] = False
+
     def as_dict(self):
         """
         返回字典
         :return:
         """
         return self._raw
+
+
+class DBRow(object):
+    """
+    数据行对象基类,由Table.row_class()为每个表生成带__slots__的子类
+    """
+    __slots__ = ('_dirty', '_bind_session', '_loader', '_related', '__weakref__')
+    table = None
+    _columns = ()
+    _setters = {}
+
+    def __getattr__(self, item):
+        if item not in self._setters:
+            rel = self.table.relations.get(item) if self.table is not None else None
+            if rel is None:
+                raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, item))
+            return _get_related(self, rel)
+        if self._loader is None:
+            # create()等生成的行未包含的字段
+            raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, item))
+        # 查询时未选择的字段(延迟加载),首次访问时从数据库加载
+        self._loader.load(item)
+        return object.__getattribute__(self, item)
+
+    def __setattr__(self, key, value):
+        setter = self._setters.get(key)
+        pk = self.table.primary_key
+        if setter is None or pk is None or key == pk.name:
+            raise AttributeError("attribute '{}' of '{}' object is read-only ".format(key, self.__class__.__name__))
+        setter(self, value)
+        dirty = self._dirty
+        if dirty is None:
+            _set_dirty(self, {key})
+            self._bind_session._register_modify(self)
+        else:
+            dirty.add(key)
+
+    def __dir__(self):
+        return [c for c in self._columns if _loaded(self, c)]
+
+    @classmethod
+    def _from_dict(cls, session, obj):
+        row = cls.__new__(cls)
+        _set_session(row, session)
+        _set_dirty(row, None)
+        _set_loader(row, None)
+        _set_related(row, None)
+        for k, v in obj.items():
+            cls._setters[k](row, v)
+        return row
+
+    def _primary_value(self):
+        return getattr(self, self.table.primary_key.name)
+
+    def _changes(self):
+        return dict((k, getattr(self, k)) for k in self._dirty or ())
+
+    def _flushed(self):
+        _set_dirty(self, None)
+
+    def __modify__(self):
+        m = Update(self.table)
+        local_map(m.set, [getattr(self.table, k) == getattr(self, k) for k in self._dirty or ()])
+        m.where(self.table.primary_key == self._primary_value())
+        return m
+
+    def as_dict(self):
+        """
+        返回字典
+        :return:
+        """
+        return dict((c, getattr(self, c)) for c in self._columns if _loaded(self, c))
+
+
+_set_dirty = DBRow._dirty.__set__
+_set_session = DBRow._bind_session.__set__
+_set_loader = DBRow._loader.__set__
+_set_related = DBRow._related.__set__
+
+
+def _loaded(row, name):
+    """字段是否已加载(不触发延迟加载)"""
+    if isinstance(row, DBObjProxy):
+        return name in row._raw
+    try:
+        object.__getattribute__(row, name)
+        return True
+    except AttributeError:
+        return False
+
+
+def _assign(row, name, value):
+    """写入加载的字段值,不记录为修改"""
+    if isinstance(row, DBObjProxy):
+        row._raw[name] = value
+        row._field_cache.pop(name, None)
+    else:
+        row._setters[name](row, value)
+
+
+def _refresh(row, cols, values):
+    """用查询结果更新会话中已存在的行对象,保留未提交的修改"""
+    changed = row._changes()
+    for name, value in zip(cols, values):
+        if name not in changed:
+            _assign(row, name, value)
+
+
+class _DeferredLoader(object):
+    """
+    延迟加载字段:首次访问某行的字段时,为同一查询返回的所有行批量加载该字段
+    """
+    chunk_size = 1000
+
+    def __init__(self, table, session):
+        self.table = table
+        self.session = session
+        self.rows = []
+
+    def add(self, row):
+        self.rows.append(weakref.ref(row))
+
+    def alive(self):
+        """
+        仍然存在的行对象
+        :return: list
+        """
+        rows = []
+        alive = []
+        for ref in self.rows:
+            row = ref()
+            if row is not None:
+                alive.append(ref)
+                rows.append(row)
+        self.rows = alive
+        return rows
+
+    def load(self, name):
+        """
+        按主键分批(IN)查询尚未加载该字段的行
+        :param name: 字段名
+        """
+        if inspect.iscoroutinefunction(self.session.query):
+            raise TypeError("column '{}' is not loaded, use undefer() in async query".format(name))
+        if self.table.primary_key is None:
+            raise AttributeError("column '{}' is not loaded, table '{}' has no primary key".format(
+                name, self.table.table_name_))
+        pk = self.table.primary_key.name
+        pending = {}
+        for row in self.alive():
+            if not _loaded(row, name):
+                pending.setdefault(getattr(row, pk), []).append(row)
+        keys = list(pending)
+        pk_field = self.table.primary_key
+        for i in range(0, len(keys), self.chunk_size):
+            q = Query(self.table, pk_field, self.table.fields[name]).filter(
+                pk_field.in_(keys[i:i + self.chunk_size]))
+            for key, value in self.session.query(q.sql(), q.args()):
+                for row in pending.get(key, ()):
+                    _assign(row, name, value)
+
+
+def _attach(row, name, value):
+    """保存关联的行"""
+    related = row._related
+    if related is None:
+        related = {}
+        if isinstance(row, DBObjProxy):
+            row.__dict__['_related'] = related
+        else:
+            _set_related(row, related)
+    related[name] = value
+
+
+def _get_related(row, rel):
+    """
+    关联的行,未预先加载(DBQuery.prefetch)时查询数据库,
+        同一查询返回的行共用加载器,为其中尚未加载该关联的行批量查询
+    """
+    related = row._related
+    if related is None or rel.name not in related:
+        loader = row._loader
+        if loader is None:
+            parents = [row]
+        else:
+            parents = [r for r in loader.alive() if r._related is None or rel.name not in r._related]
+        load_related(rel, parents, row._bind_session)
+    return row._related[rel.name]
+
+
+def load_related(rel, parents, session, chunk_size=1000):
+    """
+    批量加载关联的行:按parents的关联字段值分批IN查询,结果保存到各行对象
+    :param rel: Relationship
+    :param parents: 行对象列表
+    :param session:
+    :param chunk_size: 每次IN查询的最大参数个数
+    """
+    if inspect.iscoroutinefunction(session.query):
+        raise TypeError("relationship '{}' is not loaded, use prefetch() in async query".format(rel.name))
+    groups, children, queries = related_queries(rel, parents, session, chunk_size)
+    render = None
+    for q in queries:
+        if render is None:
+            render = row_factory(rel.target, session, q.load_columns(rel.target))
+        for row in session.query(q.sql(), q.args()):
+            child = render(row)
+            children.setdefault(getattr(child, rel.remote.name), []).append(child)
+    attach_related(rel, groups, children)
+
+
+def related_queries(rel, parents, session, chunk_size=1000):
+    """
+    批量加载关联的行需要执行的查询,会话中已存在的行不再查询
+    :return: (关联字段值 -> [行对象], 关联字段值 -> [关联的行], [Query])
+    """
+    groups = {}
+    for p in parents:
+        groups.setdefault(getattr(p, rel.local.name), []).append(p)
+    target = rel.target
+    children = {}
+    keys = [k for k in groups if k is not None]
+    identity = getattr(session, '_identity', None)
+    if not rel.many and identity is not None and target.primary_key is rel.remote:
+        misses = []
+        for k in keys:
+            obj = identity.get((target.table_name_, k))
+            if obj is None:
+                misses.append(k)
+            else:
+                children[k] = [obj]
+        keys = misses
+    queries = [Query(target).filter(rel.remote.in_(keys[i:i + chunk_size])) for i in range(0, len(keys), chunk_size)]
+    return groups, children, queries
+
+
+def attach_related(rel, groups, children):
+    """保存related_queries的查询结果到各行对象"""
+    for k, ps in groups.items():
+        found = children.get(k, ())
+        value = list(found) if rel.many else (found[0] if found else None)
+        for p in ps:
+            _attach(p, rel.name, value)
+
+
+def row_class(table):
+    """
+    生成表对应的行对象类,字段直接保存在__slots__中
+    :param table:
+    :return: DBRow子类,字段名不能作为属性名时返回None
+    """
+    cols = tuple(table.table_columns_())
+    reserved = set(dir(DBRow))
+    for c in cols:
+        if not c.isidentifier() or keyword.iskeyword(c) or c in reserved or c.startswith('__'):
+            return None
+    cls = type(str(table.table_name_), (DBRow,), {'__slots__': cols, 'table': table, '_columns': cols})
+    setters = dict((c, getattr(cls, c).__set__) for c in cols)
+    cls._setters = setters
+    # 生成 __init__(self, _session, v0, v1, ...) 逐个写入slot
+    names = ["_v{}".format(i) for i in range(len(cols))]
+    lines = ["def __init__(self, _session, {}):".format(", ".join(names)),
+             "    _set_session(self, _session)",
+             "    _set_dirty(self, None)",
+             "    _set_loader(self, None)",
+             "    _set_related(self, None)"]
+    ns = {'_set_session': _set_session, '_set_dirty': _set_dirty, '_set_loader': _set_loader,
+          '_set_related': _set_related}
+    for i, c in enumerate(cols):
+        ns['_s{}'.format(i)] = setters[c]
+        lines.append("    _s{0}(self, _v{0})".format(i))
+    exec("\n".join(lines), ns)
+    cls.__init__ = ns['__init__']
+    return cls
+
+
+def _partial_factory(table, session, cls, cols):
+    """
+    只包含部分字段的行对象,同一查询的行共用一个延迟加载器
+    """
+    loader = _DeferredLoader(table, session)
+    add = loader.add
+    if cls is None:
+        def make(row):
+            obj = DBObjProxy(table, dict(zip(cols, row)), session)
+            obj.__dict__['_loader'] = loader
+            add(obj)
+            return obj
+
+        return make
+    setters = tuple(cls._setters[c] for c in cols)
+
+    def make(row):
+        obj = cls.__new__(cls)
+        _set_session(obj, session)
+        _set_dirty(obj, None)
+        _set_loader(obj, loader)
+        _set_related(obj, None)
+        for setter, v in zip(setters, row):
+            setter(obj, v)
+        add(obj)
+        return obj
+
+    return make
+
+
+def _grouped_factory(table, session, cls):
+    """
+    包含全部字段、定义了关联的行对象,同一查询的行共用加载器以便批量加载关联
+    """
+    loader = _DeferredLoader(table, session)
+    add = loader.add
+    if cls is None:
+        cols = tuple(table.table_columns_())
+
+        def make(row):
+            obj = DBObjProxy(table, dict(zip(cols, row)), session)
+            obj.__dict__['_loader'] = loader
+            add(obj)
+            return obj
+
+        return make
+
+    def make(row):
+        obj = cls(session, *row)
+        _set_loader(obj, loader)
+        add(obj)
+        return obj
+
+    return make
+
+
+def make_row(table, obj, session):
+    """
+    由字典生成行对象
+    :param table:
+    :param obj: {字段名: 值}
+    :param session:
+    :return: DBRow|DBObjProxy
+    """
+    cls = table.row_class()
+    row = DBObjProxy(table, obj, session) if cls is None else cls._from_dict(session, obj)
+    identity = getattr(session, '_identity', None)
+    if identity is not None and table.primary_key is not None and obj.get(table.primary_key.name) is not None:
+        identity[(table.table_name_, obj[table.primary_key.name])] = row
+    return row
+
+
+def row_factory(table, session, cols=None):
+    """
+    按表字段顺序由查询结果生成行对象的函数
+    :param table:
+    :param session:
+    :param cols: 查询的字段,未包含的字段首次访问时按同一批结果批量加载
+    :return: function(row)
+    """
+    cls = table.row_class()
+    all_cols = tuple(table.table_columns_())
+    cols = all_cols if cols is None else tuple(cols)
+    if cols != all_cols:
+        make = _partial_factory(table, session, cls, cols)
+    elif table.relations:
+        make = _grouped_factory(table, session, cls)
+    elif cls is None:
+        make = lambda row: DBObjProxy(table, dict(zip(cols, row)), session)
+    else:
+        make = lambda row: cls(session, *row)
+    identity = getattr(session, '_identity', None)
+    if identity is None or table.primary_key is None:
+        return make
+    # 会话中已存在的同一行直接复用,字段值更新为本次查询的结果
+    idx = cols.index(table.primary_key.name)
+    name = table.table_name_
+
+    def render(row):
+        key = (name, row[idx])
+        obj = identity.get(key)
+        if obj is None:
+            obj = make(row)
+            identity[key] = obj
+        else:
+            _refresh(obj, cols, row)
+        return obj
+
+    return render
@@ -1,8 +1,12 @@
 import logging
 import sys
+import time
 from contextlib import contextmanager
 
+from ._cache import new_namespace
 from ._dao import SessionManager
+from ._events import Events, run
+from ._pool import ConnectionPool
 
 __author__ = 'Memory_Leak<irealing@163.com>'
 
@@ -10,12 +14,19 @@ __author__ = 'Memory_Leak<irealing@163.com>'
 class DBConsole(object):
     """简单数据库操作工具"""
 
-    def __init__(self, connect, args=(), kwargs=None, conn_retry=3):
+    def __init__(self, connect, args=(), kwargs=None, conn_retry=3, pool_size=0, pool_min=0, idle_timeout=300,
+                 max_lifetime=3600, pre_ping=True, wait_timeout=30):
         self.logger = logging.getLogger(self.__class__.__name__)
         self._connect_fun = connect
         self._connect_args = args
         self._connect_kw = kwargs if kwargs is not None else {}
         self._conn_retry = conn_retry
+        self.events = None
+        # 由此创建的会话共享查询结果缓存
+        self.cache_key = new_namespace()
+        self.pool = ConnectionPool(self.connect, min_size=pool_min, max_size=pool_size, idle_timeout=idle_timeout,
+                                   max_lifetime=max_lifetime, pre_ping=pre_ping,
+                                   wait_timeout=wait_timeout) if pool_size else None
 
     def connect(self):
         for x in range(self._conn_retry + 1):
@@ -26,67 +37,126 @@ class DBConsole(object):
                 continue
         raise Exception('connection error after {} time try'.format(self._conn_retry))
 
+    def listen(self, name, fn):
+        """
+        注册事件监听器,由此创建的会话(session/ugly_db_ctx)共享监听器
+        :param name: before_execute|after_execute|on_error|on_commit
+        :param fn: fn(event)
+        """
+        if self.events is None:
+            self.events = Events()
+        return self.events.listen(name, fn)
+
+    def acquire(self):
+        """从连接池取出连接,未启用连接池时创建新连接"""
+        return self.pool.acquire() if self.pool else self.connect()
+
+    def release(self, conn, discard=False):
+        """归还连接,未启用连接池时关闭连接"""
+        if self.pool:
+            self.pool.release(conn, discard)
+        else:
+            conn.close()
+
+    def pool_stats(self):
+        """连接池状态"""
+        return self.pool.stats() if self.pool else None
+
+    def close(self):
+        if self.pool:
+            self.pool.close()
+
+    def session(self, begin=False):
+        """使用连接池中的连接创建SessionManager上下文"""
+        return ugly_db_ctx(self, begin)
+
     def execute(self, sql, cursor=None, params=(), commit=False):
         """执行SQL语句"""
         params = params if isinstance(params, (tuple, list, set)) else (params,)
         if cursor is None:
-            conn = self.connect()
+            conn = self.acquire()
             cursor = conn.cursor()
         else:
             conn = None
-        ret = cursor.execute(sql, params)
-        if conn and commit:
-            conn.commit()
-        if conn:
-            conn.close()
-            cursor.close()
+        failed = True
+        try:
+            ret = run(self.events, cursor, sql, params, self)
+            if conn and commit:
+                self.__commit(conn)
+            failed = False
+        finally:
+            if conn:
+                self.__close(conn, cursor, failed)
         return ret
 
+    def __close(self, conn, cursor, failed):
+        """关闭游标并归还连接,执行出错的连接状态未知,不放回连接池"""
+        try:
+            cursor.close()
+        finally:
+            self.release(conn, discard=failed)
+
+    def __commit(self, conn):
+        start = time.perf_counter()
+        conn.commit()
+        if self.events is not None:
+            self.events.commit(self, start)
+
     def simple_select(self, sql, cursor=None, params=(), rows=False, callback=None):
         if not cursor:
-            conn = self.connect()
+            conn = self.acquire()
             cursor = conn.cursor()
         else:
             conn = None
+        failed = False
         try:
             self.execute(sql, cursor=cursor, params=params)
             data = cursor.fetchall() if rows else cursor.fetchone()
             return (data, None) if callback is None else callback(data, None)
         except Exception as e:
+            failed = True
             logging.exception("simple_select exception %s", sql)
             return (None, e) if callback is None else callback(None, e)
         finally:
             if conn:
-                cursor.close()
-                conn.close()
+                self.__close(conn, cursor, failed)
 
     def simple_update(self, sql, params=(), cursor=None, commit=False, auto_id=False, catch=None):
         """执行更新插入操作"""
         if cursor is None:
-            conn = self.connect()
+            conn = self.acquire()
             cursor = conn.cursor()
         else:
             conn = None
+        failed = False
         try:
             self.execute(sql, cursor, params, commit=commit)
             if commit and conn:
-                conn.commit()
+                self.__commit(conn)
             return cursor.lastrowid if auto_id else cursor.rowcount
         except Exception as e:
+            failed = True
             self.logger.exception("simple update exception %s sql %s", sql)
             if not catch:
                 raise e
             return catch(e)
         finally:
             if conn:
-                cursor.close()
-                conn.close()
+                self.__close(conn, cursor, failed)
 
 
 @contextmanager
-def ugly_db_ctx(connect, begin=False):
-    conn = connect()
-    manager = SessionManager(conn)
+def ugly_db_ctx(connect, begin=False, replicas=None):
+    """
+    数据库会话上下文
+    :param connect: 创建数据库连接的函数,或提供acquire/release的连接池(DBConsole/ConnectionPool)
+    :param begin: 是否开启事务
+    :param replicas: 创建从库连接的函数列表,读写分离时使用
+    """
+    pooled = hasattr(connect, 'acquire')
+    conn = connect.acquire() if pooled else connect()
+    manager = SessionManager(conn, events=getattr(connect, 'events', None), replicas=replicas,
+                             cache_key=getattr(connect, 'cache_key', None))
     try:
         if begin:
             manager.begin()
@@ -98,4 +168,7 @@ def ugly_db_ctx(connect, begin=False):
         manager.__exit__(et, ev, tb)
         raise e
     finally:
-        conn.close()
+        if pooled:
+            connect.release(conn)
+        else:
+            conn.close()